@@ -1,8 +1,9 @@
+from pathlib import Path
 import sys
 
 from firefed import Session, util
 from firefed.feature import Feature
-from firefed.output import error, out, good, warn
+from firefed.output import error, good, open_output, out, redirect, warn
 from firefed.util import fatal, read_profiles
 
 
@@ -19,18 +20,32 @@ def run():
     if feature_name is None:
         # Show help message end exit
         parser.parse_args(['-h'])
-    try:
-        profile = util.profile_dir(args.pop('profile'))
-    except util.ProfileNotFoundError as e:
-        fatal(e)
-    session = Session(profile, verbosity=args.pop('verbosity'))
     ChosenFeature = Feature.feature_map()[feature_name]
+    profile_name = args.pop('profile')
+    profile = None
+    if not ChosenFeature.standalone:
+        try:
+            profile = util.profile_dir(profile_name)
+        except util.ProfileNotFoundError as e:
+            fatal(e)
+    session = Session(profile, verbosity=args.pop('verbosity'),
+                      cache=not args.pop('no_cache'))
     force = args.pop('force')
+    output = args.pop('output')
     feature = ChosenFeature(session, **args)
-    if not feature.profile_path('times.json').exists() and not force:
+    if profile is not None and not force and \
+       not feature.profile_path('times.json').exists():
         fatal('"%s" doesn\'t look like a profile directory. Use -f/--force if '
               'you insist it is.' % session.profile)
-    feature()
+    if output is None:
+        feature()
+        return
+    try:
+        stream = open_output(Path(output))
+    except OSError as e:
+        fatal('Can\'t open output file: %s' % e)
+    with stream, redirect(stream):
+        feature()
 
 
 def show_profiles():
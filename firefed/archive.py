@@ -0,0 +1,297 @@
+"""Access to profiles inside zip and tar archives.
+
+Members are read straight from the archive, without extracting it. SQLite
+databases are loaded into memory, or spilled to a temporary file if they are
+large or have a write-ahead log.
+"""
+from fnmatch import fnmatch
+import errno
+import io
+import os
+from pathlib import Path, PurePosixPath
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+import threading
+import time
+import weakref
+import zipfile
+
+
+# Databases up to this size are loaded into memory, larger ones are spilled
+DESERIALIZE_MAX_SIZE = 128 * 1024 * 1024
+# Directories for spilled databases, by preference (tmpfs if available)
+SPILL_DIRS = ['/dev/shm']
+# The file which identifies a profile directory
+PROFILE_MARKER = 'times.json'
+
+
+def is_archive(path):
+    return path.is_file() and (zipfile.is_zipfile(str(path)) or
+                               tarfile.is_tarfile(str(path)))
+
+
+def connect(path):
+    """Open an SQLite connection to a database file or archive member."""
+    if isinstance(path, ArchivePath):
+        return path.connect()
+    return sqlite3.connect(str(path))
+
+
+class Connection(sqlite3.Connection):
+    """A connection which keeps its archive (and spilled files) alive."""
+
+    archive = None
+
+
+class Archive:
+    """A zip or tar archive, with an index of its members.
+
+    Reading members is thread-safe. Members of tar archives are read at once
+    (tar archives don't allow concurrent reads of a member), zip members are
+    streamed.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.spill_lock = threading.Lock()
+        self.databases = {}
+        self.spill_dir = None
+        if zipfile.is_zipfile(str(self.path)):
+            self.zip = zipfile.ZipFile(str(self.path))
+            self.tar = None
+            infos = ((i.filename, i) for i in self.zip.infolist()
+                     if not i.is_dir())
+        else:
+            self.zip = None
+            self.tar = tarfile.open(str(self.path))
+            infos = ((i.name, i) for i in self.tar.getmembers() if i.isfile())
+        # Normalize names like "./foo"
+        self.members = {str(PurePosixPath(name)): i for name, i in infos}
+        self.dirs = {str(p) for name in self.members
+                     for p in PurePosixPath(name).parents}
+        weakref.finalize(self, self.close_resources, self.zip, self.tar)
+
+    @staticmethod
+    def close_resources(zip_, tar):
+        if zip_ is not None:
+            zip_.close()
+        if tar is not None:
+            tar.close()
+
+    def profile_roots(self):
+        """Return all directories in the archive which contain a profile."""
+        return sorted(str(PurePosixPath(name).parent) for name in
+                      self.members if PurePosixPath(name).name ==
+                      PROFILE_MARKER)
+
+    def size(self, name):
+        info = self.members[name]
+        return info.file_size if self.zip is not None else info.size
+
+    def mtime(self, name):
+        info = self.members[name]
+        if self.zip is not None:
+            return time.mktime(info.date_time + (0, 0, -1))
+        return info.mtime
+
+    def open(self, name):
+        """Return a binary file object to read a member."""
+        if self.zip is not None:
+            return self.zip.open(self.members[name])
+        with self.lock:
+            return io.BytesIO(self.tar.extractfile(self.members[name]).read())
+
+    def read(self, name):
+        with self.open(name) as f:
+            return f.read()
+
+    def connect(self, name):
+        """Open an SQLite connection to a database member.
+
+        Small databases are deserialized into an in-memory database. The
+        member is only read once and kept for further connections. Large
+        databases, and databases with a write-ahead log (which can't be
+        deserialized), are spilled to a temporary file once.
+        """
+        if self.must_spill(name):
+            con = sqlite3.connect(str(self.spilled(name)), factory=Connection)
+        else:
+            con = sqlite3.connect(':memory:', factory=Connection)
+            con.deserialize(self.database(name))
+        con.archive = self
+        return con
+
+    def attach(self, con, name, schema):
+        """Attach a database member read-only to con (opened with uri=True).
+        """
+        if self.must_spill(name):
+            uri = '%s?mode=ro' % self.spilled(name).resolve().as_uri()
+            con.execute('ATTACH DATABASE ? AS %s' % schema, (uri,))
+            return
+        con.execute('ATTACH DATABASE \':memory:\' AS %s' % schema)
+        con.deserialize(self.database(name), name=schema)
+
+    def must_spill(self, name):
+        return self.size(name) > DESERIALIZE_MAX_SIZE or \
+            '%s-wal' % name in self.members or \
+            not hasattr(sqlite3.Connection, 'deserialize')
+
+    def database(self, name):
+        """Return the content of a database member, ready to deserialize."""
+        with self.lock:
+            data = self.databases.get(name)
+        if data is None:
+            data = bytearray(self.read(name))
+            # Databases in WAL mode can't be deserialized, so switch to the
+            # legacy journal (the file format is otherwise identical)
+            if data[18:20] == b'\x02\x02':
+                data[18:20] = b'\x01\x01'
+            data = bytes(data)
+            with self.lock:
+                self.databases[name] = data
+        return data
+
+    def spilled(self, name):
+        """Return the path of a member (with its WAL) in the spill dir."""
+        with self.spill_lock:
+            if self.spill_dir is None:
+                root = next((d for d in SPILL_DIRS if os.path.isdir(d)),
+                            None)
+                self.spill_dir = Path(tempfile.mkdtemp(prefix='firefed-',
+                                                       dir=root))
+                weakref.finalize(self, shutil.rmtree, str(self.spill_dir),
+                                 ignore_errors=True)
+            path = self.spill_dir / name
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                # Write the WAL first, so the database is complete as soon
+                # as it exists
+                for member in ('%s-wal' % name, name):
+                    if member not in self.members:
+                        continue
+                    tmp_path = self.spill_dir / ('%s.tmp' % member)
+                    with self.open(member) as src, \
+                            open(str(tmp_path), 'wb') as f:
+                        shutil.copyfileobj(src, f)
+                    tmp_path.rename(self.spill_dir / member)
+        return path
+
+
+class ArchivePath:
+    """A path inside an archive, with the parts of pathlib's API firefed uses.
+    """
+
+    def __init__(self, archive, name=''):
+        self.archive = archive
+        self.member = str(PurePosixPath(name)) if name else ''
+
+    def __truediv__(self, other):
+        other = PurePosixPath(str(other)).as_posix()
+        return ArchivePath(self.archive, str(PurePosixPath(self.member,
+                                                           other)))
+
+    def __str__(self):
+        return str(self.archive.path / self.member)
+
+    def __repr__(self):
+        return 'ArchivePath(%r, %r)' % (str(self.archive.path), self.member)
+
+    def __eq__(self, other):
+        return isinstance(other, ArchivePath) and \
+            (self.archive.path, self.member) == (other.archive.path,
+                                                 other.member)
+
+    def __hash__(self):
+        return hash((self.archive.path, self.member))
+
+    @property
+    def name(self):
+        return PurePosixPath(self.member).name
+
+    def is_file(self):
+        return self.member in self.archive.members
+
+    def is_dir(self):
+        return not self.member or self.member in self.archive.dirs
+
+    def exists(self):
+        return self.is_file() or self.is_dir()
+
+    def stat(self):
+        """Return the archive's stat, with the member's size and mtime."""
+        self.check_file()
+        st = os.stat(str(self.archive.path))
+        mtime = self.archive.mtime(self.member)
+        return os.stat_result((st.st_mode, st.st_ino, st.st_dev, st.st_nlink,
+                               st.st_uid, st.st_gid,
+                               self.archive.size(self.member), mtime, mtime,
+                               mtime))
+
+    def open(self, mode='r', encoding=None):
+        if mode not in ('r', 'rt', 'rb'):
+            raise ValueError('Archives can only be read')
+        self.check_file()
+        f = self.archive.open(self.member)
+        if mode == 'rb':
+            return f
+        return io.TextIOWrapper(f, encoding=encoding)
+
+    def read_bytes(self):
+        self.check_file()
+        return self.archive.read(self.member)
+
+    def connect(self):
+        self.check_file()
+        return self.archive.connect(self.member)
+
+    def attach(self, con, schema):
+        self.check_file()
+        self.archive.attach(con, self.member, schema)
+
+    def glob(self, pattern):
+        """Yield the members of this directory matching pattern."""
+        prefix = '%s/' % self.member if self.member else ''
+        for name in sorted(self.archive.members):
+            rest = name[len(prefix):]
+            if name.startswith(prefix) and '/' not in rest and \
+               fnmatch(rest, pattern):
+                yield ArchivePath(self.archive, name)
+
+    def check_file(self):
+        if not self.is_file():
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT),
+                                    str(self))
+
+
+def archive_profile(path):
+    """Return the profile in an archive as ArchivePath (or None).
+
+    The path is either the archive itself or a directory inside of it
+    (e.g. "evidence.zip/home/user/.mozilla/firefox/x.default"). If the
+    archive is given, it needs to contain a single profile (or its profile
+    files at the top level).
+    """
+    archive_file = path
+    while not archive_file.exists():
+        if archive_file.parent == archive_file:
+            return None
+        archive_file = archive_file.parent
+    if archive_file == path and not is_archive(path) or \
+       not is_archive(archive_file):
+        return None
+    archive = Archive(archive_file)
+    inner = path.relative_to(archive_file).as_posix()
+    if inner != '.':
+        profile = ArchivePath(archive, inner)
+        if not profile.is_dir():
+            raise ValueError('Directory "%s" not found in archive "%s".' % (
+                inner, archive_file))
+        return profile
+    roots = archive.profile_roots()
+    if len(roots) > 1:
+        raise ValueError('Archive "%s" contains several profiles: %s' % (
+            archive_file, ', '.join(roots)))
+    return ArchivePath(archive, roots[0] if roots else '')
@@ -0,0 +1,131 @@
+"""Cache of feature outputs.
+
+Outputs are stored gzip-compressed in the cache directory, under a key of the
+feature, its arguments and the fingerprints of the profile files it reads.
+The cache is capped in size, evicting the least recently used entries.
+"""
+from contextlib import contextmanager
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import firefed.__version__ as version
+from firefed.util import cache_dir
+
+
+# Maximum total size of all entries
+CACHE_MAX_SIZE = 256 * 1024 * 1024
+# Number of bytes at the start of a source file which are hashed
+HASH_PREFIX_SIZE = 64 * 1024
+ENTRY_SUFFIX = '.gz'
+
+
+def fingerprint(path):
+    """Identify the state of a source file (or None if it's missing).
+
+    Size and mtime catch nearly all changes, the hash of the first bytes
+    catches files replaced with others (e.g. when evidence is copied with
+    its mtimes preserved). The header of an SQLite database includes its
+    change counter.
+    """
+    if not path.is_file():
+        return None
+    stat = path.stat()
+    with path.open('rb') as f:
+        digest = hashlib.sha1(f.read(HASH_PREFIX_SIZE)).hexdigest()
+    return [str(path), stat.st_size, stat.st_mtime, digest]
+
+
+def make_key(*parts):
+    data = json.dumps([version.__version__, *parts], default=str)
+    return hashlib.sha256(bytes(data, 'utf-8')).hexdigest()
+
+
+def entry_path(key):
+    return cache_dir('results') / (key + ENTRY_SUFFIX)
+
+
+def replay(key, stream):
+    """Write a cached output to stream and return whether it was cached."""
+    path = entry_path(key)
+    try:
+        f = gzip.open(str(path), 'rt', encoding='utf-8', newline='')
+    except FileNotFoundError:
+        return False
+    with f:
+        shutil.copyfileobj(f, stream)
+    # The mtime tells when an entry was last used
+    try:
+        os.utime(str(path))
+    except FileNotFoundError:
+        pass
+    return True
+
+
+class Recorder:
+    """Text stream which writes to another stream and to a cache entry."""
+
+    def __init__(self, stream, key):
+        self.stream = stream
+        self.path = entry_path(key)
+        # Unique, so that concurrent runs don't write to the same file
+        self.tmp_path = self.path.with_name('%s.%s.tmp' % (key,
+                                                           uuid.uuid4().hex))
+        self.file = gzip.open(str(self.tmp_path), 'wt', compresslevel=1,
+                              encoding='utf-8', newline='')
+
+    def write(self, text):
+        self.file.write(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def commit(self):
+        self.file.close()
+        os.replace(str(self.tmp_path), str(self.path))
+
+    def discard(self):
+        self.file.close()
+        self.tmp_path.unlink()
+
+
+@contextmanager
+def record(key, stream):
+    """Record all output written to the yielded stream under key.
+
+    The entry is only stored if no exception is raised.
+    """
+    recorder = Recorder(stream, key)
+    try:
+        yield recorder
+    except BaseException:
+        recorder.discard()
+        raise
+    recorder.commit()
+    prune()
+
+
+def prune(max_size=None):
+    """Remove the least recently used entries beyond the size cap."""
+    if max_size is None:
+        max_size = CACHE_MAX_SIZE
+    entries = []
+    for path in cache_dir('results').glob('*' + ENTRY_SUFFIX):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries, key=lambda e: e[0]):
+        if total <= max_size:
+            break
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        total -= size
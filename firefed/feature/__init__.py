@@ -1,14 +1,23 @@
 # flake8: noqa
 from .feature import Feature, arg, formatter
 from .addons import Addons
-from .bookmarks import Bookmarks
+from .bookmarks import BookmarkBackups, Bookmarks
 from .cookies import Cookies
 from .logins import Logins
 from .places import Downloads, Hosts, InputHistory
 from .history import History
 from .visits import Visits
 from .preferences import Preferences
+from .compliance import Compliance
 from .summary import Summary
+from .search import Search
+from .query import Query
+from .exportdb import ExportDb
+from .collect import Collect
+from .timeline import Timeline
 from .permissions import Permissions
 from .forms import Forms
+from .hashes import Hashes
+from .diff import Diff
+from .ioc import Ioc
 from .infect import Infect
@@ -1,5 +1,9 @@
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import json
+from pathlib import Path, PureWindowsPath
+import zipfile
 
+import attr
 from attr import attrib, attrs
 
 from firefed.feature import Feature, arg, formatter
@@ -10,6 +14,8 @@ EXTENSIONS_FILE = 'extensions.json'
 STARTUP_FILE = 'addonStartup.json.lz4'
 ADDONS_FILE = 'addons.json'
 DEFAULT_LOCATION = 'app-profile'
+EXTENSIONS_DIR = 'extensions'
+MANIFEST_FILE = 'manifest.json'
 # See constants defined in [1]
 SIGNED_STATES = {
     -2: 'broken',
@@ -52,10 +58,65 @@ class Addon:
         return good('true') if self.visible else bad('false')
 
 
+@attrs
+class InspectedAddon(Addon):
+    """An addon with the permissions requested by its manifest."""
+    manifest_version = attrib(default=None)
+    permissions = attrib(default=None)
+    optional_permissions = attrib(default=None)
+    # Match patterns of the hosts the addon can access
+    host_permissions = attrib(default=None)
+    # Match patterns of the pages content scripts are injected into
+    content_scripts = attrib(default=None)
+
+
+# Fields of InspectedAddon which hold lists
+LIST_FIELDS = ['permissions', 'optional_permissions', 'host_permissions',
+               'content_scripts']
+
+
+def read_manifest(path):
+    """Return the manifest of an addon package (an XPI or a directory).
+
+    Only the manifest is read from an XPI, found by the zip's central
+    directory, so nothing else is decompressed.
+    """
+    if path.is_dir():
+        data = (path / MANIFEST_FILE).read_bytes()
+    else:
+        with path.open('rb') as f, zipfile.ZipFile(f) as xpi:
+            data = xpi.read(MANIFEST_FILE)
+    return json.loads(str(data, 'utf-8-sig'))
+
+
+def string_list(obj, key):
+    """Return the list of strings at obj[key] (or an empty list if unset).
+
+    Raise a ValueError if it isn't a list of strings.
+    """
+    value = obj.get(key, [])
+    if not isinstance(value, list) or \
+            not all(isinstance(x, str) for x in value):
+        raise ValueError('"%s" isn\'t a list of strings' % key)
+    return value
+
+
+def content_script_matches(manifest):
+    """Return the match patterns of all content scripts of a manifest."""
+    scripts = manifest.get('content_scripts', [])
+    if not isinstance(scripts, list) or \
+            not all(isinstance(x, dict) for x in scripts):
+        raise ValueError('"content_scripts" isn\'t a list of objects')
+    return [m for script in scripts for m in string_list(script, 'matches')]
+
+
 @attrs
 class Addons(Feature):
     """List installed addons/extensions."""
 
+    record_cls = Addon
+    source_files = (EXTENSIONS_FILE, ADDONS_FILE, STARTUP_FILE)
+
     show_all = arg('-a', '--all', action='store_true',
                    help='show all extensions (including system extensions)')
     show_addons_json = arg('-A', '--show-addons-json', action='store_true',
@@ -63,12 +124,37 @@ class Addons(Feature):
     show_startup_json = arg('-S', '--show-startup-json', action='store_true',
                             help='show addon startup entries (from "%s")' %
                             STARTUP_FILE)
+    inspect_manifests = arg('-m', '--manifests', action='store_true',
+                            help='read the permissions requested by each '
+                            'addon from the manifest in its package')
+
+    def __attrs_post_init__(self):
+        if self.inspect_manifests:
+            self.record_cls = InspectedAddon
+
+    @classmethod
+    def fields_help(cls):
+        manifest_fields = [f.name for f in attr.fields(InspectedAddon)
+                           if f.name not in attr.fields_dict(Addon)]
+        return '%s; with --manifests also %s' % (super().fields_help(),
+                                                 ', '.join(manifest_fields))
 
     def prepare(self):
-        addons = list(self.load_addons())
+        addons = self.load_addons()
         if not self.show_all:
-            addons = [a for a in addons if a.location == DEFAULT_LOCATION]
-        self.addons = addons
+            addons = (a for a in addons if a.location == DEFAULT_LOCATION)
+        if self.inspect_manifests:
+            addons = self.inspect(list(addons))
+        aggregation = self.aggregation()
+        page = self.page()
+        if aggregation is not None:
+            addons = aggregation.apply(addons)
+        elif page is not None:
+            addons = page.apply(addons)
+        self.addons = list(addons)
+
+    def records(self):
+        return self.addons
 
     def load_addons(self):
         data = self.load_json(EXTENSIONS_FILE).get('addons', [])
@@ -85,6 +171,77 @@ class Addons(Feature):
                 location=addon.get('location'),
             )
 
+    def source_paths(self):
+        # The manifests are sources as well
+        paths = super().source_paths()
+        if self.inspect_manifests:
+            try:
+                addons = list(self.load_addons())
+            except FileNotFoundError:
+                addons = []
+            paths.extend(p for p in map(self.package_path, addons)
+                         if p is not None and p.is_file())
+        return paths
+
+    def package_path(self, addon):
+        """Return the path of an addon's package (or None if unknown).
+
+        The profile may have been copied from elsewhere, so the absolute
+        path it refers to is never followed (it may name a file on the host
+        instead). Only packages in the profile's extensions directory are
+        found.
+        """
+        if not addon.path:
+            return None
+        # The profile may come from Windows
+        name = PureWindowsPath(addon.path).name
+        path = self.profile_path(EXTENSIONS_DIR) / name
+        return path if path.exists() else None
+
+    def inspect(self, addons):
+        """Read the manifests of addons, concurrently.
+
+        Return InspectedAddons, in the same order.
+        """
+        with ThreadPoolExecutor() as executor:
+            return list(executor.map(self.inspect_addon, addons))
+
+    def inspect_addon(self, addon):
+        fields = attr.asdict(addon, recurse=False)
+        path = self.package_path(addon)
+        try:
+            if path is None:
+                raise FileNotFoundError('No package path')
+            manifest = read_manifest(path)
+            if not isinstance(manifest, dict):
+                raise ValueError('Manifest isn\'t an object')
+            permissions = string_list(manifest, 'permissions')
+            optional_permissions = string_list(manifest,
+                                               'optional_permissions')
+            content_scripts = content_script_matches(manifest)
+            # Manifest V2 requests host permissions along with the others
+            host_permissions = [p for p in permissions + optional_permissions
+                                if self.is_host_permission(p)]
+            host_permissions.extend(string_list(manifest, 'host_permissions'))
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+            self.session.logger.info('Can\'t read manifest of "%s": %s',
+                                     addon.id, e)
+            return InspectedAddon(**fields)
+        return InspectedAddon(
+            manifest_version=manifest.get('manifest_version'),
+            permissions=[p for p in permissions
+                         if not self.is_host_permission(p)],
+            optional_permissions=[p for p in optional_permissions
+                                  if not self.is_host_permission(p)],
+            host_permissions=host_permissions,
+            content_scripts=content_scripts,
+            **fields
+        )
+
+    @staticmethod
+    def is_host_permission(permission):
+        return permission == '<all_urls>' or '://' in permission
+
     def dump_addons_json(self):
         data = self.load_json(ADDONS_FILE).get('addons', [])
         out('%d entries in "%s":\n' % (len(data), ADDONS_FILE))
@@ -117,13 +274,25 @@ class Addons(Feature):
     def list(self):
         for addon in self.addons:
             head = '%s (%s) %s' % (addon.name, addon.id, addon.enabled_markup)
-            outitem(head, [
+            items = [
                 ('Version', addon.version),
                 ('Type', addon.type),
                 ('Visible', addon.visible_markup),
                 ('Sig', addon.signed_markup),
                 ('Path', addon.path),
-            ])
+            ]
+            if self.inspect_manifests:
+                if addon.permissions is None:
+                    items.append(('Manifest', '(unreadable)'))
+                else:
+                    items.extend([
+                        ('Permissions', ', '.join(addon.permissions)),
+                        ('Optional', ', '.join(
+                            addon.optional_permissions)),
+                        ('Hosts', ', '.join(addon.host_permissions)),
+                        ('Scripts', ', '.join(addon.content_scripts)),
+                    ])
+            outitem(head, items)
 
     @formatter('short')
     def short(self):
@@ -132,6 +301,20 @@ class Addons(Feature):
 
     @formatter('csv')
     def csv(self):
-        Feature.csv_from_items(self.addons)
+        addons = self.addons
+        if self.inspect_manifests:
+            addons = map(self.join_lists, addons)
+        Feature.csv_from_items(self.project(addons))
+
+    @staticmethod
+    def join_lists(addon):
+        """Join the lists of an inspected addon with spaces (for CSV)."""
+        lists = {f: ' '.join(getattr(addon, f)) for f in LIST_FIELDS
+                 if getattr(addon, f) is not None}
+        return attr.evolve(addon, **lists)
+
+    @formatter('jsonl')
+    def jsonl(self):
+        Feature.jsonl_from_items(self.project(self.addons))
 
 # noqa [1]: https://dxr.mozilla.org/mozilla-central/rev/967c95cee709756596860ed2a3e6ac06ea3a053f/toolkit/mozapps/extensions/AddonManager.jsm#3495
@@ -1,11 +1,28 @@
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import json
+from pathlib import Path
+import re
+
+import attr
 from attr import attrib, attrs
 
-from firefed.feature import Feature, formatter
+from firefed.feature import Feature, arg, formatter
 from firefed.output import csv_writer, good, out
 from firefed.util import moz_to_unix_timestamp
 
 
 DIRECTORY_TYPE = 2
+TYPE_NAMES = {
+    1: 'bookmark',
+    2: 'folder',
+    3: 'separator',
+}
+ROOT_GUID = 'root________'
+PATH_SEPARATOR = '/'
+BACKUP_DIR = Path('bookmarkbackups')
+BACKUP_GLOB = 'bookmarks-*.jsonlz4'
+backup_date_regex = r'bookmarks-(\d{4}-\d{2}-\d{2})'
 
 
 @attrs
@@ -19,13 +36,86 @@ class Bookmark:
     added = attrib(converter=moz_to_unix_timestamp)
     last_modified = attrib(converter=moz_to_unix_timestamp)
     url = attrib()
+    path = attrib(default=None)
+
+
+@attrs
+class BookmarkTree:
+    """The bookmark hierarchy, indexed by parent.
+
+    The tree is built in a single pass over all bookmarks and traversed
+    iteratively, so neither deep nor large hierarchies are an issue. While
+    indexing, each bookmark's folder path is materialized in its `path`
+    attribute.
+    """
+
+    nodes = attrib(default=attr.Factory(OrderedDict))
+    children = attrib(default=attr.Factory(lambda: defaultdict(list)))
+
+    @classmethod
+    def from_bookmarks(cls, bmarks):
+        tree = cls()
+        for bmark in bmarks:
+            tree.nodes[bmark.id] = bmark
+            tree.children[bmark.parent].append(bmark)
+        tree.index_paths()
+        return tree
+
+    def __iter__(self):
+        return iter(self.nodes.values())
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @property
+    def roots(self):
+        """Return all nodes whose parent isn't part of the tree."""
+        return [n for n in self.nodes.values() if n.parent not in self.nodes]
+
+    @property
+    def top_level(self):
+        """Return the titled folders directly below the places root."""
+        return [n for root in self.roots if root.guid == ROOT_GUID
+                for n in self.children.get(root.id, []) if n.title != '']
+
+    def walk(self, nodes=None):
+        """Traverse the tree depth-first and yield (depth, node) tuples.
+
+        Traversal starts at the given nodes (or all roots by default).
+        """
+        if nodes is None:
+            nodes = self.roots
+        stack = [(0, n) for n in reversed(nodes)]
+        while stack:
+            depth, node = stack.pop()
+            yield depth, node
+            children = self.children.get(node.id, [])
+            stack.extend((depth + 1, c) for c in reversed(children))
+
+    def index_paths(self):
+        # Parents are always visited before their children
+        for _, node in self.walk():
+            parent = self.nodes.get(node.parent)
+            if parent is None or parent.guid == ROOT_GUID:
+                node.path = ''
+            elif parent.path:
+                node.path = parent.path + PATH_SEPARATOR + parent.title
+            else:
+                node.path = parent.title
 
 
 @attrs
 class Bookmarks(Feature):
     """List bookmarks."""
 
+    time_aware = True
+    source_files = ('places.sqlite',)
+
     def prepare(self):
+        where, params = self.time_window('dateAdded')
+        if where:
+            # Keep all folders, so the hierarchy stays intact
+            where = 'type = %d OR (%s)' % (DIRECTORY_TYPE, where)
         bmarks = self.load_sqlite(
             db='places.sqlite',
             query='''SELECT b.id, b.parent, b.type, b.title, b.guid, b.dateAdded,
@@ -37,41 +127,31 @@ class Bookmarks(Feature):
                 'lastModified': 'last_modified',
                 'dateAdded': 'added'
             },
+            where=where,
+            params=params,
         )
         # Remove pseudo-bookmarks from list
         bmarks = (b for b in bmarks if not str(b.url).startswith('place:'))
-        self.bmarks = bmarks
+        self.bmarks = BookmarkTree.from_bookmarks(bmarks)
+
+    def records(self):
+        return list(self.bmarks)
 
     def summarize(self):
-        out('%d bookmarks found.' % len(list(self.bmarks)))
+        out('%d bookmarks found.' % len(self.bmarks))
 
     def run(self):
         self.build_format()
 
     @formatter('tree', default=True)
     def tree(self):
-        bmarks = list(self.bmarks)
-        bmark_map = {b.id: b for b in bmarks}
-        def walk(node, depth=0):
+        for depth, node in self.bmarks.walk(self.bmarks.top_level):
             if node.type == DIRECTORY_TYPE:
                 text = good('[%s]') % node.title
                 out('%s%s' % (depth * 4 * ' ', text))
             else:
                 out('%s* %s' % (depth * 4 * ' ', node.title))
                 out('%s%s' % ((depth + 1) * 4 * ' ', node.url))
-            children = [n for n in bmarks if n.parent == node.id]
-            for child in children:
-                walk(child, depth + 1)
-        for bmark in bmarks:
-            try:
-                parent_guid = bmark_map[bmark.parent].guid
-            except KeyError:
-                continue
-            if bmark.title == '':
-                continue
-            if parent_guid != 'root________':
-                continue
-            walk(bmark)
 
     @formatter('list')
     def list(self):
@@ -79,13 +159,143 @@ class Bookmarks(Feature):
             if not bmark.url:
                 continue
             out('%s\n    %s' % (bmark.title, bmark.url))
+            if bmark.path:
+                out('    [%s]' % bmark.path)
 
     @formatter('csv')
     def csv(self):
         writer = csv_writer()
-        writer.writerow(('title', 'url', 'added', 'last_modified'))
+        writer.writerow(('title', 'url', 'added', 'last_modified', 'path'))
         for b in self.bmarks:
             if not b.url:
                 continue
             writer.writerow((b.title, b.url, b.added,
-                             b.last_modified))
+                             b.last_modified, b.path))
+
+    @formatter('json')
+    def json(self):
+        """Write the bookmark hierarchy as nested JSON.
+
+        The output is written while walking the tree, so only the currently
+        open folders need to be tracked.
+        """
+        open_folders = 0
+        need_comma = False
+        out('[', end='')
+        for depth, node in self.bmarks.walk(self.bmarks.top_level):
+            while open_folders > depth:
+                out(']}', end='')
+                open_folders -= 1
+                need_comma = True
+            if need_comma:
+                out(',', end='')
+            fields = OrderedDict([
+                ('type', TYPE_NAMES.get(node.type, node.type)),
+                ('title', node.title),
+                ('guid', node.guid),
+                ('added', node.added),
+                ('last_modified', node.last_modified),
+            ])
+            if node.type != DIRECTORY_TYPE:
+                fields['url'] = node.url
+            obj = json.dumps(fields)
+            if node.type == DIRECTORY_TYPE:
+                # Leave the object open so the children can follow
+                out(obj[:-1] + ', "children": [', end='')
+                open_folders += 1
+                need_comma = False
+            else:
+                out(obj, end='')
+                need_comma = True
+        out(']}' * open_folders + ']')
+
+
+@attrs
+class BookmarkChange:
+
+    backup = attrib()
+    date = attrib()
+    change = attrib()
+    guid = attrib()
+    type = attrib()
+    title = attrib()
+    url = attrib()
+
+
+@attrs
+class BookmarkBackups(Feature):
+    """List changes between bookmark backups.
+
+    Firefox regularly stores a dated backup of all bookmarks in
+    `bookmarkbackups/`. This feature compares consecutive backups and lists
+    which bookmarks have been added or removed in between.
+    """
+
+    source_files = (BACKUP_DIR / BACKUP_GLOB,)
+    workers = arg('-w', '--workers', type=int, help='number of backups to '
+                  'decompress in parallel (default: number of CPUs)')
+
+    def prepare(self):
+        backup_dir = self.profile_path(BACKUP_DIR)
+        self.backups = sorted(p.name for p in backup_dir.glob(BACKUP_GLOB))
+
+    def summarize(self):
+        out('%d bookmark backups found.' % len(self.backups))
+
+    def run(self):
+        self.build_format()
+
+    def load_backup(self, name):
+        """Load a backup and return a dict of its entries, keyed by guid."""
+        entries = {}
+        stack = [self.load_json_mozlz4(BACKUP_DIR / name)]
+        while stack:
+            node = stack.pop()
+            entries[node.get('guid')] = (
+                TYPE_NAMES.get(node.get('typeCode'), node.get('typeCode')),
+                node.get('title'),
+                node.get('uri'),
+            )
+            stack.extend(node.get('children', []))
+        return entries
+
+    def timeline(self):
+        """Yield (backup, date, entries, changes) for each backup.
+
+        Backups are decompressed in parallel, but compared in order.
+        Added and removed entries are computed as set differences of the
+        guids, so each comparison is linear in the size of the backups.
+        """
+        with ThreadPoolExecutor(self.workers) as executor:
+            loaded = executor.map(self.load_backup, self.backups)
+            prev = None
+            for name, entries in zip(self.backups, loaded):
+                match = re.match(backup_date_regex, name)
+                date = match.group(1) if match else None
+                changes = []
+                if prev is not None:
+                    added = entries.keys() - prev.keys()
+                    removed = prev.keys() - entries.keys()
+                    changes += [BookmarkChange(name, date, 'added', guid,
+                                               *entries[guid])
+                                for guid in sorted(added)]
+                    changes += [BookmarkChange(name, date, 'removed', guid,
+                                               *prev[guid])
+                                for guid in sorted(removed)]
+                yield name, date, entries, changes
+                prev = entries
+
+    @formatter('list', default=True)
+    def list(self):
+        for name, date, entries, changes in self.timeline():
+            out('%s (%s): %d entries' % (date, name, len(entries)))
+            for change in changes:
+                sign = '+' if change.change == 'added' else '-'
+                out('    %s [%s] %s' % (sign, change.type, change.title))
+                if change.url:
+                    out('        %s' % change.url)
+
+    @formatter('csv')
+    def csv(self):
+        changes = (c for *_, changes in self.timeline() for c in changes)
+        Feature.csv_from_items(changes, cls=BookmarkChange)
@@ -0,0 +1,150 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import inspect
+import json
+from pathlib import Path
+import sqlite3
+import time
+
+from attr import attrs
+
+from firefed.feature import Feature, arg
+from firefed.feature.compliance import Compliance
+from firefed.feature.diff import Diff
+from firefed.feature.exportdb import FEATURE_ARGS, ExportDb
+from firefed.feature.hashes import Hashes
+from firefed.feature.infect import Infect
+from firefed.feature.ioc import Ioc
+from firefed.feature.logins import Logins
+from firefed.feature.query import Query
+from firefed.feature.search import Search
+from firefed.feature.summary import Summary
+from firefed.hashing import hash_file
+from firefed.output import COMPRESSORS, open_output, out, redirect, warn
+from firefed.util import FatalError, fatal
+
+
+MANIFEST_FILE = 'manifest.json'
+# Features which modify something, need input or only repeat other features
+EXCLUDED_FEATURES = {Compliance, Diff, ExportDb, Infect, Ioc, Logins, Query,
+                     Search, Summary}
+# Formats to write, by preference. Features without any of them are written
+# in their default format.
+PREFERRED_FORMATS = ['jsonl', 'csv']
+
+
+class LineCounter:
+    """Wrap a text stream and count the lines written to it."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lines = 0
+
+    def write(self, text):
+        self.lines += text.count('\n')
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+@attrs
+class Collect(Feature):
+    """Run all features and write their output to a directory.
+
+    Every feature which only reads the profile is run, writing to a file of
+    its own. The features are run in parallel, as they don't depend on each
+    other. A manifest lists the files with their number of rows, their
+    SHA-256 hash and the time it took to create them. The hashes of the
+    profile files are collected as well (by the hashes feature), before
+    any other feature runs: closing a database may checkpoint its
+    write-ahead log, which changes the files.
+    """
+
+    output_dir = arg('-o', '--output-dir', metavar='DIR',
+                     help='directory to write the output files to')
+    compression = arg('-z', '--compress', choices=[s.lstrip('.') for s in
+                                                   COMPRESSORS],
+                      help='compress the output files')
+    workers = arg('-w', '--workers', type=int, help='number of features to '
+                  'run in parallel (default: number of CPUs + 4)')
+
+    def prepare(self):
+        if not self.output_dir:
+            fatal('No output directory given.')
+        self.path = Path(self.output_dir)
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            fatal('Can\'t create output directory: %s' % e)
+
+    def run(self):
+        started = datetime.now()
+        results = [self.collect(Hashes)]
+        with ThreadPoolExecutor(self.workers) as executor:
+            results.extend(executor.map(self.collect,
+                                        self.collected_features()))
+        manifest = OrderedDict([
+            ('profile', str(self.session.profile)),
+            ('started', started.isoformat()),
+            ('features', OrderedDict(results)),
+        ])
+        with open(str(self.path / MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        failed = sum('error' in r for _, r in results)
+        out('Collected %d features into "%s".%s' % (
+            len(results) - failed, self.path,
+            ' (%d failed)' % failed if failed else ''))
+
+    @staticmethod
+    def collected_features():
+        """Return the features to run once the profile is hashed."""
+        return [f for f in Feature.feature_map().values()
+                if f not in EXCLUDED_FEATURES | {Collect, Hashes} and
+                not inspect.isabstract(f)]
+
+    @staticmethod
+    def output_format(Feature_):
+        formats = Feature_.formatters()
+        return next((f for f in PREFERRED_FORMATS if f in formats), None)
+
+    def collect(self, Feature_):
+        """Run a feature with its output redirected to its file.
+
+        Return the feature name and its manifest entry.
+        """
+        name = Feature_.__name__.lower()
+        kwargs = dict(FEATURE_ARGS.get(Feature_, {}))
+        format_ = self.output_format(Feature_)
+        if format_ is not None:
+            kwargs['format'] = format_
+        path = self.path / ('%s.%s' % (name, format_ or 'txt'))
+        if self.compression:
+            path = path.with_name('%s.%s' % (path.name, self.compression))
+        entry = OrderedDict([('file', path.name), ('format', format_)])
+        start = time.monotonic()
+        error = None
+        try:
+            with open_output(path) as f, redirect(LineCounter(f)) as counter:
+                Feature_(self.session, **kwargs)()
+        except (FileNotFoundError, FatalError, KeyError, ValueError,
+                sqlite3.DatabaseError) as e:
+            self.session.logger.info('Collecting %s failed: %s', name, e)
+            error = str(e)
+        except Exception as e:
+            error = '%s: %s' % (e.__class__.__name__, e)
+            warn('Collecting %s failed: %s' % (name, error))
+        if error is None:
+            # The header isn't a row
+            entry['rows'] = counter.lines - (format_ == 'csv' and
+                                             counter.lines > 0)
+            entry['sha256'] = hash_file(path)
+        else:
+            # The file may not have been created in the first place
+            if path.is_file():
+                path.unlink()
+            entry['file'] = None
+            entry['error'] = error
+        entry['seconds'] = round(time.monotonic() - start, 3)
+        return name, entry
@@ -0,0 +1,169 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import json
+import logging
+
+import attr
+from attr import attrib, attrs
+
+from firefed.feature import Feature, arg, formatter
+from firefed.feature.preferences import Preferences
+from firefed.output import csv_writer, out
+from firefed.__version__ import __title__
+from firefed.session import Session
+from firefed.util import FatalError, ProfileNotFoundError, fatal, profile_dir
+
+
+GOOD = 'good'
+BAD = 'bad'
+UNDEFINED = 'undefined'
+
+
+@attrs
+class ProfileCompliance:
+
+    profile = attrib()
+    # Preference key -> status
+    statuses = attrib(default=attr.Factory(OrderedDict))
+    # Why the profile couldn't be checked
+    error = attrib(default=None)
+
+    def count(self, status):
+        return sum(1 for s in self.statuses.values() if s == status)
+
+
+def check_profile(name, recommended, include_undefined):
+    """Return the compliance of a profile (given like to -p/--profile).
+
+    This runs in a worker process, so all errors are reported in the
+    result, including those of finding the profile.
+    """
+    try:
+        profile = profile_dir(name)
+        session = Session(profile, logger=logging.getLogger(__title__))
+        prefs = {p.key: p.value for p in
+                 Preferences(session).parse_prefs()}
+    except (FatalError, ProfileNotFoundError) as e:
+        return ProfileCompliance(name, error=str(e))
+    except Exception as e:
+        return ProfileCompliance(name, error='%s: %s' % (
+            e.__class__.__name__, e))
+    statuses = OrderedDict()
+    for key, value in recommended.items():
+        if key not in prefs:
+            status = BAD if include_undefined else UNDEFINED
+        elif prefs[key] == value:
+            status = GOOD
+        else:
+            status = BAD
+        statuses[key] = status
+    return ProfileCompliance(str(profile), statuses)
+
+
+@attrs
+class Compliance(Feature):
+    """Check the preferences of many profiles against recommended settings.
+
+    The recommended settings are loaded once, and the profiles are checked
+    in parallel by a pool of processes (as parsing is CPU-bound). The result
+    is a matrix with a row per profile and a column per recommended
+    preference, which is either good, bad or undefined (if the profile
+    doesn't set it). A profile is compliant if it has no bad
+    values. Profiles which can't be checked (e.g. unknown profiles, corrupt
+    archives or unreadable preference files) get a row with the error
+    instead.
+    """
+
+    standalone = True
+    profiles = arg('profiles', nargs='*', metavar='PROFILE',
+                   help='profiles to check (names, directories or archives)')
+    recommended_source = \
+        arg('-S', '--source', default='userjs-relaxed', metavar='PATH',
+            help='path to file with recommended settings (use "userjs-master" '
+            'or "userjs-relaxed" to load userjs config from Github)')
+    offline = \
+        arg('--offline', action='store_true', help='don\'t fetch the userjs '
+            'config, but use the copy cached by a previous run')
+    include_undefined = \
+        arg('-i', '--include-undefined', action='store_true', help='treat '
+            'undefined preferences as bad values')
+    jobs = arg('-j', '--jobs', type=int, metavar='N', help='number of '
+               'processes checking profiles (default: number of CPUs)')
+    counts = attrib(default=attr.Factory(dict), init=False)
+
+    def prepare(self):
+        if not self.profiles:
+            fatal('No profiles given.')
+        # The last occurence of a key overrides all previous ones
+        self.recommended = OrderedDict(
+            (p.key, p.value) for p in
+            Preferences.parse_userjs(self.recommended_source,
+                                     offline=self.offline))
+        self.session.logger.info('%d recommended values read.',
+                                 len(self.recommended))
+
+    def run(self):
+        self.build_format()
+
+    def results(self):
+        """Yield the compliance of each profile, in the order given.
+
+        While the results are yielded, the remaining profiles are checked.
+        """
+        self.counts = dict.fromkeys(['profiles', 'compliant', 'failed', GOOD,
+                                     BAD, UNDEFINED], 0)
+        check = partial(check_profile, recommended=self.recommended,
+                        include_undefined=self.include_undefined)
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            for result in executor.map(check, self.profiles):
+                self.counts['profiles'] += 1
+                if result.error is not None:
+                    self.session.logger.info('Can\'t check "%s": %s',
+                                             result.profile, result.error)
+                    self.counts['failed'] += 1
+                    yield result
+                    continue
+                for status in (GOOD, BAD, UNDEFINED):
+                    self.counts[status] += result.count(status)
+                if not result.count(BAD):
+                    self.counts['compliant'] += 1
+                yield result
+
+    def summarize(self):
+        for _ in self.results():
+            pass
+        failed = self.counts['failed']
+        out('%d of %d profiles compliant (%d good, %d bad, %d undefined '
+            'values).%s' % (self.counts['compliant'], self.counts['profiles'],
+                            self.counts[GOOD], self.counts[BAD],
+                            self.counts[UNDEFINED],
+                            ' %d failed.' % failed if failed else ''))
+
+    @formatter('csv', default=True)
+    def csv(self):
+        writer = csv_writer()
+        writer.writerow(['profile', GOOD, BAD, UNDEFINED, *self.recommended,
+                         'error'])
+        for result in self.results():
+            if result.error is not None:
+                writer.writerow([result.profile, *[''] * 3,
+                                 *[''] * len(self.recommended),
+                                 result.error])
+                continue
+            counts = [result.count(s) for s in (GOOD, BAD, UNDEFINED)]
+            writer.writerow([result.profile, *counts,
+                             *result.statuses.values(), ''])
+
+    @formatter('jsonl')
+    def jsonl(self):
+        for result in self.results():
+            obj = OrderedDict([('profile', result.profile)])
+            if result.error is not None:
+                obj['error'] = result.error
+                out(json.dumps(obj))
+                continue
+            for status in (GOOD, BAD, UNDEFINED):
+                obj[status] = result.count(status)
+            obj['preferences'] = result.statuses
+            out(json.dumps(obj))
@@ -78,7 +78,14 @@ class Cookies(Feature):
     Don't find a cookie you have definitely set? Not all cookies are
     immediately written to the cookie store. You possibly need to close the
     browser first to force all cookies being written to disk.
+
+    The time window applies to the last access of a cookie. Cookies from
+    session files don't have timestamps, so they can't be restricted to a
+    time window.
     """
+    time_aware = True
+    record_cls = Cookie
+    source_files = ('cookies.sqlite', *session_file_map.values())
     host = \
         arg('-H', '--host', help='filter by hostname (glob)')
     want_all_sources = \
@@ -90,22 +97,52 @@ class Cookies(Feature):
             'default file locations)' % ', '.join('"%s"' % s for s in
                                                   session_file_map))
 
+    def source_paths(self):
+        paths = super().source_paths()
+        if self.session_file:
+            paths.append(self.profile_path(self.session_file))
+        return paths
+
     def prepare(self):
-        cookies = set()
+        ss_cookies = set()
+        aggregation = self.aggregation()
+        page = self.page()
+        where, params = self.time_window('lastAccessed')
+        timed = where is not None or page is not None and page.latest
+        if timed and (self.want_all_sources or self.session_file):
+            fatal('Cookies from session files have no timestamps, so they '
+                  'can\'t be restricted to a time window or the latest '
+                  'cookies (leave out -a/--all and -S/--session-file).')
         if self.want_all_sources:
             for source in session_file_map.values():
                 try:
-                    cookies |= set(self.load_ss_cookies(source))
+                    ss_cookies |= set(self.load_ss_cookies(source))
                 except FileNotFoundError:
                     pass
         elif self.session_file:
             try:
-                cookies |= set(self.load_ss_cookies(self.session_file))
+                ss_cookies |= set(self.load_ss_cookies(self.session_file))
             except FileNotFoundError as e:
                 fatal('Session file "%s" not found.' % e.filename)
+        if self.host:
+            ss_cookies = {c for c in ss_cookies if fnmatch(c.host, self.host)}
+        cookies = ss_cookies
+        # Session file cookies need to be merged with those from the database
+        # before they can be counted, paged or reduced to the selected fields
+        # (so that distinct cookies don't collapse into one), so only do this
+        # in SQL without them
+        sql_options = (self.fields, aggregation, page) if not cookies else \
+            (None, None, None)
         if not self.session_file:
+            if self.host:
+                # GLOB is case-sensitive like fnmatch on POSIX
+                host_filter = 'host GLOB ?'
+                where = host_filter if where is None else \
+                    '%s AND %s' % (where, host_filter)
+                params = params + [self.host]
             try:
-                db_cookies = self.load_sqlite_cookies(column_map)
+                db_cookies = list(self.load_sqlite_cookies(
+                    column_map, where, params, *sql_options))
             except sqlite3.OperationalError as e:
                 if str(e) == 'no such column: sameSite':
                     new_map = column_map.copy()
@@ -113,20 +150,38 @@ class Cookies(Feature):
                     # XXX This is a bit of a hack to handle a missing sameSite
                     # column. Should be cleaned up.
                     new_map['null'] = 'same_site'
-                    db_cookies = self.load_sqlite_cookies(new_map)
+                    db_cookies = list(self.load_sqlite_cookies(
+                        new_map, where, params, *sql_options))
                 else:
                     raise
+            if not cookies:
+                self.cookies = db_cookies
+                return
             cookies |= set(db_cookies)
-        if self.host:
-            cookies = [c for c in cookies if fnmatch(c.host, self.host)]
+        if aggregation is not None:
+            cookies = aggregation.apply(cookies)
+        else:
+            if page is not None:
+                cookies = page.apply(iter(cookies))
+            cookies = self.project(cookies)
         self.cookies = list(cookies)
 
-    def load_sqlite_cookies(self, column_map):
+    def records(self):
+        return self.cookies
+
+    def load_sqlite_cookies(self, column_map, where=None, params=(),
+                            fields=None, aggregate=None, page=None):
         return self.load_sqlite(
             db='cookies.sqlite',
             table='moz_cookies',
             cls=Cookie,
-            column_map=column_map
+            column_map=column_map,
+            where=where,
+            params=params,
+            order_by='lastAccessed',
+            fields=fields,
+            aggregate=aggregate,
+            page=page,
         )
 
     def load_ss_cookies(self, path):
@@ -166,3 +221,7 @@ class Cookies(Feature):
     @formatter('csv')
     def format_csv(self):
         Feature.csv_from_items(self.cookies)
+
+    @formatter('jsonl')
+    def format_jsonl(self):
+        Feature.jsonl_from_items(self.cookies)
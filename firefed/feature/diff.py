@@ -0,0 +1,183 @@
+from collections import OrderedDict
+import json
+
+import attr
+from attr import attrib, attrs
+
+from firefed.feature import Feature, arg, formatter
+from firefed.feature.addons import Addons
+from firefed.feature.bookmarks import Bookmarks
+from firefed.feature.cookies import Cookies
+from firefed.feature.exportdb import FEATURE_ARGS
+from firefed.feature.forms import Forms
+from firefed.feature.history import History
+from firefed.feature.permissions import Permissions
+from firefed.feature.places import Downloads
+from firefed.feature.preferences import Preferences
+from firefed.output import bad, good, okay, out
+from firefed.session import Session
+from firefed.util import ProfileNotFoundError, fatal, profile_dir
+
+
+# Feature -> fields which identify a record across profiles
+DIFF_KEYS = OrderedDict([
+    (History, ('url',)),
+    (Cookies, ('host', 'name', 'path')),
+    (Bookmarks, ('guid',)),
+    (Preferences, ('key',)),
+    (Permissions, ('host', 'permission')),
+    (Forms, ('fieldname', 'value')),
+    (Downloads, ('filename', 'date')),
+    (Addons, ('id',)),
+])
+# Fields which aren't compared, because they differ between profiles even
+# if the records are the same (e.g. row ids)
+IGNORED_FIELDS = {
+    Bookmarks: ('id', 'parent'),
+}
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+
+
+@attrs
+class Change:
+
+    change = attrib()
+    key = attrib()
+    old = attrib(default=None)
+    new = attrib(default=None)
+    # (field, old value, new value) tuples of a changed record
+    fields = attrib(default=())
+
+
+def sort_key(values):
+    # Missing values sort first, like NULL in SQLite
+    return tuple((v is not None, v) for v in values)
+
+
+@attrs
+class Diff(Feature):
+    """Compare the records of a feature between two profiles.
+
+    Records are matched by their natural key (e.g. the URL of history
+    entries, or host, name and path of cookies). Both sides are read ordered
+    by the key (by the database, where possible) and merged in a single
+    pass, so only the current record of each side is held in memory.
+    Records which are only in profile B are reported as added, those only in
+    profile A as removed.
+    """
+
+    standalone = True
+    profile_a = arg('profile_a', nargs='?', metavar='PROFILE_A',
+                    help='profile to compare (name, directory or archive)')
+    profile_b = arg('profile_b', nargs='?', metavar='PROFILE_B',
+                    help='profile to compare with')
+    feature_name = arg('feature_name', nargs='?', metavar='FEATURE',
+                       choices=[f.__name__.lower() for f in DIFF_KEYS],
+                       help='feature whose records are compared (%s)' %
+                       ', '.join(f.__name__.lower() for f in DIFF_KEYS))
+    counts = attrib(default=attr.Factory(dict), init=False)
+
+    def prepare(self):
+        if not (self.profile_a and self.profile_b and self.feature_name):
+            fatal('Two profiles and a feature need to be given.')
+        try:
+            self.profiles = [profile_dir(p) for p in (self.profile_a,
+                                                      self.profile_b)]
+        except ProfileNotFoundError as e:
+            fatal(e)
+        self.Feature_ = Feature.feature_map()[self.feature_name]
+        self.key = DIFF_KEYS[self.Feature_]
+
+    def run(self):
+        self.build_format()
+
+    def ordered_records(self, profile):
+        """Yield the records of the feature, ordered by their key.
+
+        Records loaded by the database are ordered by it. Records loaded
+        into a list by the feature are sorted, which takes linear time as
+        well if they're already in order.
+        """
+        session = Session(profile, logger=self.session.logger)
+        feature = self.Feature_(session, **FEATURE_ARGS.get(self.Feature_,
+                                                            {}))
+        feature.sort_by = self.key
+        feature.prepare()
+        records = feature.records()
+        if isinstance(records, list):
+            records = sorted(records, key=self.record_key)
+        last_key = None
+        for record in records:
+            key = self.record_key(record)
+            if last_key is not None and key < last_key:
+                fatal('Records of "%s" aren\'t ordered by %s.' % (
+                    profile, ', '.join(self.key)))
+            last_key = key
+            yield record
+
+    def record_key(self, record):
+        return sort_key(getattr(record, f) for f in self.key)
+
+    def changes(self):
+        """Merge the records of both profiles and yield their differences.
+        """
+        ignored = self.key + IGNORED_FIELDS.get(self.Feature_, ())
+        olds, news = (self.ordered_records(p) for p in self.profiles)
+        old = next(olds, None)
+        new = next(news, None)
+        self.counts = dict.fromkeys([ADDED, REMOVED, CHANGED], 0)
+        while old is not None or new is not None:
+            old_key = None if old is None else self.record_key(old)
+            new_key = None if new is None else self.record_key(new)
+            if new is None or (old is not None and old_key < new_key):
+                change = Change(REMOVED, self.key_values(old), old=old)
+                old = next(olds, None)
+            elif old is None or new_key < old_key:
+                change = Change(ADDED, self.key_values(new), new=new)
+                new = next(news, None)
+            else:
+                fields = tuple(
+                    (f.name, getattr(old, f.name), getattr(new, f.name))
+                    for f in attr.fields(type(old)) if f.name not in ignored
+                    and getattr(old, f.name) != getattr(new, f.name))
+                change = Change(CHANGED, self.key_values(new), old, new,
+                                fields) if fields else None
+                old = next(olds, None)
+                new = next(news, None)
+            if change is not None:
+                self.counts[change.change] += 1
+                yield change
+
+    def key_values(self, record):
+        return tuple(getattr(record, f) for f in self.key)
+
+    @formatter('list', default=True)
+    def list(self):
+        markup = {ADDED: ('+', good), REMOVED: ('-', bad),
+                  CHANGED: ('~', okay)}
+        for change in self.changes():
+            sign, color = markup[change.change]
+            out(color('%s %s' % (sign, ' '.join(str(v) for v in
+                                                change.key))))
+            for name, old, new in change.fields:
+                out('    %s: %r -> %r' % (name, old, new))
+        out('%d added, %d removed, %d changed.' % (
+            self.counts[ADDED], self.counts[REMOVED], self.counts[CHANGED]))
+
+    @formatter('jsonl')
+    def jsonl(self):
+        for change in self.changes():
+            obj = OrderedDict([
+                ('change', change.change),
+                ('key', OrderedDict(zip(self.key, change.key))),
+            ])
+            if change.change == CHANGED:
+                obj['fields'] = OrderedDict((name, [old, new]) for
+                                            name, old, new in change.fields)
+            else:
+                record = change.new if change.change == ADDED else change.old
+                obj['record'] = attr.asdict(record, recurse=False,
+                                            dict_factory=OrderedDict)
+            out(json.dumps(obj, default=str))
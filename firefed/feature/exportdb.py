@@ -0,0 +1,191 @@
+from collections import OrderedDict
+from itertools import islice
+import sqlite3
+import time
+
+import attr
+from attr import attrs
+
+from firefed.feature import Feature, arg
+from firefed.feature.addons import Addons
+from firefed.feature.bookmarks import Bookmark, Bookmarks
+from firefed.feature.cookies import Cookies
+from firefed.feature.places import Host, Hosts, Input, InputHistory
+from firefed.feature.preferences import Preference, Preferences
+from firefed.output import out, warn
+from firefed.session import Session
+from firefed.util import FatalError, ProfileNotFoundError, fatal, profile_dir
+
+
+BATCH_SIZE = 5000
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS profiles (id INTEGER PRIMARY KEY, path TEXT,
+    exported INTEGER);
+'''
+# Trade durability for speed while loading. If the export is interrupted,
+# the case database needs to be created again anyway. (The journal is kept in
+# memory, so that the records of a failing feature can be rolled back.)
+BULK_LOAD_PRAGMAS = [
+    'PRAGMA journal_mode = MEMORY',
+    'PRAGMA synchronous = OFF',
+    'PRAGMA cache_size = -65536',
+    'PRAGMA temp_store = MEMORY',
+]
+# Arguments to get all records of a feature, not only the default selection
+FEATURE_ARGS = {
+    Addons: {'show_all': True},
+    Cookies: {'want_all_sources': True},
+}
+# Features which have records, but don't declare their record class (as they
+# don't support selecting fields or aggregating) -> record class
+RECORD_CLASSES = {
+    Bookmarks: Bookmark,
+    Hosts: Host,
+    InputHistory: Input,
+    Preferences: Preference,
+}
+
+
+def sql_value(value):
+    if value is None or isinstance(value, (int, float, str, bytes)):
+        return value
+    return str(value)
+
+
+def quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+@attrs
+class ExportDb(Feature):
+    """Export the records of all features into an SQLite case database.
+
+    Every feature with records (those with a record class, as well as
+    bookmarks, hosts, input history and preferences) gets a table of the
+    same name, with a column per field. All rows are tagged with the id of
+    their profile, which refers to the profiles table. Exporting into an
+    existing case database adds to it, so many profiles can be collected in
+    one database. A feature which fails is left out for its profile.
+    """
+
+    database = arg('database', nargs='?', help='path of the case database')
+    more_profiles = arg('-a', '--add-profiles', nargs='+', metavar='PROFILE',
+                        help='export these profiles as well (names or '
+                        'directories)')
+
+    def prepare(self):
+        if not self.database:
+            fatal('No case database given.')
+        self.profiles = [self.session.profile]
+        for name in self.more_profiles or []:
+            try:
+                self.profiles.append(profile_dir(name))
+            except ProfileNotFoundError as e:
+                fatal(e)
+
+    def run(self):
+        con = sqlite3.connect(self.database, isolation_level=None)
+        for pragma in BULK_LOAD_PRAGMAS:
+            con.execute(pragma)
+        con.executescript(SCHEMA)
+        tables = set()
+        for profile in self.profiles:
+            start = time.monotonic()
+            try:
+                counts = self.export_profile(con, profile, tables)
+            except Exception as e:
+                if con.in_transaction:
+                    con.execute('ROLLBACK')
+                warn('Can\'t export "%s": %s' % (profile, e))
+                continue
+            out('Exported %d records of %d features from "%s" in %.1fs.' % (
+                sum(counts.values()), len(counts), profile,
+                time.monotonic() - start))
+        self.create_indexes(con, tables)
+        con.close()
+
+    @staticmethod
+    def record_features():
+        """Return a mapping of all features with records to their record
+        class."""
+        return OrderedDict(
+            (f, f.record_cls or RECORD_CLASSES.get(f))
+            for f in Feature.feature_map().values()
+            if f.record_cls is not None or f in RECORD_CLASSES)
+
+    def export_profile(self, con, profile, tables):
+        """Export all records of a profile in a single transaction.
+
+        Return a mapping of feature names to the number of exported records.
+        """
+        session = Session(profile, logger=self.session.logger)
+        counts = {}
+        # Tables are only created once the transaction is committed
+        new_tables = set()
+        con.execute('BEGIN')
+        cursor = con.execute('INSERT INTO profiles (path, exported) VALUES '
+                             '(?, ?)', (str(profile), int(time.time())))
+        profile_id = cursor.lastrowid
+        for Feature_, record_cls in self.record_features().items():
+            name = Feature_.__name__.lower()
+            con.execute('SAVEPOINT feature')
+            try:
+                feature = Feature_(session, **FEATURE_ARGS.get(Feature_, {}))
+                feature.prepare()
+                records = iter(feature.records())
+                self.create_table(con, name, record_cls)
+                counts[name] = self.insert_records(con, name, profile_id,
+                                                   records)
+            except (FileNotFoundError, FatalError, sqlite3.DatabaseError) as e:
+                self.session.logger.info('Skipping %s of "%s": %s', name,
+                                         profile, e)
+                con.execute('ROLLBACK TO feature')
+                continue
+            except Exception as e:
+                warn('Can\'t export %s of "%s": %s' % (name, profile, e))
+                con.execute('ROLLBACK TO feature')
+                continue
+            finally:
+                con.execute('RELEASE feature')
+            new_tables.add(name)
+        con.execute('COMMIT')
+        tables |= new_tables
+        return counts
+
+    @staticmethod
+    def create_table(con, name, record_cls):
+        columns = ', '.join(quote(f.name) for f in attr.fields(record_cls))
+        con.execute('CREATE TABLE IF NOT EXISTS %s (profile_id INTEGER '
+                    'REFERENCES profiles(id), %s)' % (quote(name), columns))
+
+    @staticmethod
+    def insert_records(con, name, profile_id, records):
+        """Insert records in batches and return their number."""
+        count = 0
+        query = None
+        while True:
+            batch = list(islice(records, BATCH_SIZE))
+            if not batch:
+                break
+            if query is None:
+                fields = [f.name for f in attr.fields(batch[0].__class__)]
+                query = 'INSERT INTO %s (profile_id, %s) VALUES (?%s)' % (
+                    quote(name), ', '.join(quote(f) for f in fields),
+                    ', ?' * len(fields))
+            con.executemany(query, ([profile_id] +
+                                    [sql_value(v) for v in
+                                     attr.astuple(r, recurse=False)]
+                                    for r in batch))
+            count += len(batch)
+        return count
+
+    @staticmethod
+    def create_indexes(con, tables):
+        """Index the profile ids, after all records are loaded.
+
+        Building an index at once is much faster than updating it with every
+        inserted row.
+        """
+        for name in sorted(tables):
+            con.execute('CREATE INDEX IF NOT EXISTS %s ON %s (profile_id)' % (
+                quote('%s_profile_id' % name), quote(name)))
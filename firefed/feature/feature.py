@@ -1,19 +1,35 @@
 # pylint: disable=protected-access
 from abc import ABC, abstractmethod
 import argparse
-from collections import OrderedDict
+from collections import Counter, OrderedDict, deque
 import csv
 import errno
+from functools import lru_cache
+import heapq
+from itertools import islice
 import json
 import os
-from pathlib import PurePath
-import sqlite3
-import sys
+from pathlib import Path, PurePosixPath
 
 import attr
 from attr import attrib, attrs
 import lz4.block
 
+from firefed import archive, cache, output
+from firefed.archive import ArchivePath
+from firefed.output import out
+from firefed.util import (MICROSECONDS, fatal, parse_date, tabulate,
+                          url_host)
+
+
+# Formats that output exactly the fields of a record (so they support --fields)
+FIELD_FORMATS = ['csv', 'jsonl', 'table']
+# Keys which records can be grouped by in addition to their fields: key ->
+# (field the key is derived from, function to derive it)
+VIRTUAL_KEYS = {
+    'host': ('url', url_host),
+}
+
 
 def arg(*args, **kwargs):
     """Return an attrib() that can be fed as a command-line argument.
@@ -31,6 +47,9 @@ def arg(*args, **kwargs):
     ...         print('Your number:', self.my_number)
 
     Now you could run it like `firefed myfeature --number 5`.
+
+    Positional arguments are supported as well, but need to be optional (e.g.
+    with nargs='?') so a default value can be determined.
     """
     metadata = {'arg_params': (args, kwargs)}
     return attrib(default=arg_default(*args, **kwargs), metadata=metadata)
@@ -66,15 +85,167 @@ class NotMozLz4Error(Exception):
     """Raised when an LZ4 file doesn't use Mozilla's proprietary prefix."""
 
 
+def field_list(text):
+    """Split a comma-separated list of field names."""
+    return [f.strip() for f in text.split(',') if f.strip()]
+
+
+@lru_cache(maxsize=None)
+def project_class(cls, fields, converters=True):
+    """Return an attrs class with only the given fields of cls, in the given
+    order.
+
+    If converters is set, the converters of cls are kept (to create projected
+    records from raw data), otherwise they are dropped (to create projected
+    records from already converted records).
+    """
+    converters_ = {f.name: f.converter if converters else None
+                   for f in attr.fields(cls)}
+    attribs = OrderedDict((name, attrib(converter=converters_[name]))
+                          for name in fields)
+    return attr.make_class(cls.__name__, attribs, hash=True)
+
+
+@lru_cache(maxsize=None)
+def group_class(cls, key, converters=True):
+    """Return an attrs class for the groups of records of cls.
+
+    A group has the key it was grouped by (if any) and its count of records.
+    Keys which are fields of cls keep their converter if converters is set.
+    """
+    attribs = OrderedDict()
+    if key is not None:
+        converter = None
+        if converters and key in attr.fields_dict(cls):
+            converter = attr.fields_dict(cls)[key].converter
+        attribs[key] = attrib(converter=converter)
+    attribs['count'] = attrib()
+    return attr.make_class('Group', attribs)
+
+
+@attrs(frozen=True)
+class Aggregation:
+    """Grouping and counting of records, as given by --group-by and --top.
+
+    Records are grouped by key, which is derived from field by func (or is
+    the field itself if there's no func), and groups are ordered by their
+    count in descending order. Without key, all records form a single group.
+    """
+
+    record_cls = attrib()
+    key = attrib(default=None)
+    field = attrib(default=None)
+    func = attrib(default=None)
+    top = attrib(default=None)
+
+    def apply(self, items):
+        """Aggregate records which aren't loaded from a database.
+
+        The records are counted in a single pass and the largest groups are
+        selected with a heap, so neither the records nor a sorted list of all
+        groups need to be held in memory.
+        """
+        cls = group_class(self.record_cls, self.key, converters=False)
+        if self.key is None:
+            yield cls(count=sum(1 for _ in items))
+            return
+        counts = Counter(self.key_of(item) for item in items)
+        # Same order as in SQL: by count, then by key (NULL first)
+        def order(group):
+            key, count = group
+            return -count, key is not None, key
+        if self.top is None:
+            groups = sorted(counts.items(), key=order)
+        else:
+            groups = heapq.nsmallest(self.top, counts.items(), key=order)
+        for key, count in groups:
+            yield cls(key, count)
+
+    def key_of(self, item):
+        value = getattr(item, self.field)
+        return value if self.func is None else self.func(value)
+
+
+@attrs(frozen=True)
+class Page:
+    """A slice of records, as given by --limit, --offset and --latest.
+
+    If latest is set, the page consists of the last limit records (in their
+    regular order), so the records need to have an ordering.
+    """
+
+    limit = attrib(default=None)
+    offset = attrib(default=0)
+    latest = attrib(default=False)
+
+    def sql(self, order_by):
+        """Return the ORDER BY and LIMIT clauses to select the page.
+
+        Return a tuple of the clauses and their parameters. For the latest
+        records, the ordering is reversed, so the rows need to be reversed
+        again after fetching them.
+        """
+        if self.latest:
+            if not order_by:
+                raise ValueError('Latest records require an ordering')
+            order_by = ', '.join('%s DESC' % c.strip() for c in
+                                 order_by.split(','))
+        clauses = ''
+        if order_by:
+            clauses += ' ORDER BY %s' % order_by
+        clauses += ' LIMIT ? OFFSET ?'
+        limit = -1 if self.limit is None else self.limit
+        return clauses, [limit, self.offset]
+
+    def apply(self, items):
+        """Select the page from records which aren't loaded from a database.
+
+        Reading the records stops once the page is complete. Only the latest
+        records require reading all of them, but then no more than the page
+        is held in memory.
+        """
+        if self.latest:
+            return iter(deque(items, maxlen=self.limit))
+        stop = None if self.limit is None else self.offset + self.limit
+        return islice(items, self.offset, stop)
+
+
 class FeatureHelpersMixin:
     """Helper methods to be used by features which simplify common tasks."""
 
     def load_sqlite(self, db, query=None, table=None, cls=None,
-                    column_map=None):
-        """Load data from sqlite db and return as list of specified objects."""
+                    column_map=None, where=None, params=(), order_by=None,
+                    fields=None, aggregate=None, page=None):
+        """Load data from sqlite db and return as list of specified objects.
+
+        If a where clause or ordering is given, it refers to the columns of
+        the table or to the result columns of a custom query. (In the latter
+        case, the query is used as subquery, which SQLite flattens, so indexes
+        are still used.)
+
+        If fields are given, only these fields of cls are selected, and
+        records of a projected class with only these fields are returned.
+
+        If an Aggregation is given, the records are grouped and counted by
+        the database, and the groups are returned instead of the records.
+
+        If a Page is given, only the records of this page are fetched. The
+        latest records are selected with the reversed ordering, which needs
+        to be given as order_by.
+        """
         if column_map is None:
             column_map = {}
+        if fields:
+            cls = project_class(cls, tuple(fields))
+        if self.sort_by and aggregate is None and page is None:
+            columns = {v: k for k, v in column_map.items()}
+            order_by = ', '.join(columns.get(f, f) for f in self.sort_by)
         db_path = self.profile_path(db, must_exist=True)
+        if aggregate is not None:
+            yield from self._load_sqlite_groups(db_path, query, table,
+                                                column_map, where, params,
+                                                aggregate)
+            return
 
         def obj_factory(cursor, row):
             dict_ = {}
@@ -83,15 +254,32 @@ class FeatureHelpersMixin:
                 dict_[new_name] = row[idx]
             return cls(**dict_)
 
-        con = sqlite3.connect(str(db_path))
+        con = archive.connect(db_path)
         con.row_factory = obj_factory
         cursor = con.cursor()
-        if not query:
+        if not query or fields:
             columns = [f.name for f in attr.fields(cls)]
             for k, v in column_map.items():
-                columns[columns.index(v)] = k
-            query = 'SELECT %s FROM %s' % (','.join(columns), table)
-        cursor.execute(query)
+                if v in columns:
+                    columns[columns.index(v)] = k
+            source = table if not query else '(%s)' % query
+            query = 'SELECT %s FROM %s' % (','.join(columns), source)
+        elif where or order_by or page:
+            query = 'SELECT * FROM (%s)' % query
+        if where:
+            query += ' WHERE %s' % where
+        if page is not None:
+            clauses, page_params = page.sql(order_by)
+            query += clauses
+            params = list(params) + page_params
+        elif order_by:
+            query += ' ORDER BY %s' % order_by
+        cursor.execute(query, params)
+        if page is not None and page.latest:
+            # The page is small, so it can be reversed in memory
+            yield from reversed(cursor.fetchall())
+            con.close()
+            return
         while True:
             item = cursor.fetchone()
             if item is None:
@@ -99,10 +287,37 @@ class FeatureHelpersMixin:
             yield item
         con.close()
 
+    @staticmethod
+    def _load_sqlite_groups(db_path, query, table, column_map, where, params,
+                            aggregate):
+        cls = group_class(aggregate.record_cls, aggregate.key)
+        con = archive.connect(db_path)
+        con.row_factory = lambda cursor, row: cls(*row)
+        source = table if not query else '(%s)' % query
+        columns = {v: k for k, v in column_map.items()}
+        select = 'COUNT(*)'
+        if aggregate.key is not None:
+            key = columns.get(aggregate.field, aggregate.field)
+            if aggregate.func is not None:
+                con.create_function(aggregate.key, 1, aggregate.func)
+                key = '%s(%s)' % (aggregate.key, key)
+            select = '%s, %s' % (key, select)
+        query = 'SELECT %s FROM %s' % (select, source)
+        params = list(params)
+        if where:
+            query += ' WHERE %s' % where
+        if aggregate.key is not None:
+            query += ' GROUP BY 1 ORDER BY 2 DESC, 1'
+        if aggregate.top is not None:
+            query += ' LIMIT ?'
+            params.append(aggregate.top)
+        yield from con.execute(query, params)
+        con.close()
+
     def load_json(self, path):
         """Load a JSON file from the user profile."""
-        with open(self.profile_path(path, must_exist=True),
-                  encoding='utf-8') as f:
+        with self.profile_path(path, must_exist=True).open(
+                encoding='utf-8') as f:
             data = json.load(f)
         return data
 
@@ -111,48 +326,120 @@ class FeatureHelpersMixin:
 
         Mozilla LZ4 is regular LZ4 with a custom string prefix.
         """
-        with open(self.profile_path(path, must_exist=True), 'rb') as f:
+        with self.profile_path(path, must_exist=True).open('rb') as f:
             if f.read(8) != b'mozLz40\0':
                 raise NotMozLz4Error('Not Mozilla LZ4 format.')
             data = lz4.block.decompress(f.read())
         return data
 
     def load_json_mozlz4(self, path):
-        return json.loads(self.load_mozlz4(path), encoding='utf-8')
+        return json.loads(str(self.load_mozlz4(path), 'utf-8'))
 
     def write_mozlz4(self, path, data):
         compressed = lz4.block.compress(bytes(data, 'utf-8'))
-        with open(self.profile_path(path), 'wb') as f:
+        with self.profile_path(path).open('wb') as f:
             f.write(b'mozLz40\0' + compressed)
 
     def write_json_mozlz4(self, path, data):
         self.write_mozlz4(path, json.dumps(data))
 
     @staticmethod
-    def csv_from_items(items, stream=None):
-        """Write a list of items to stream in CSV format.
+    def jsonl_from_items(items):
+        """Output a list of items as JSON lines (one object per item).
 
         The items need to be attrs-decorated.
         """
+        for item in items:
+            out(json.dumps(attr.asdict(item), default=str))
+
+    @staticmethod
+    def table_from_items(items):
+        """Output a list of items as table with a column per field.
+
+        The items need to be attrs-decorated.
+        """
+        items = list(items)
+        if not items:
+            return
+        headers = [f.name.capitalize().replace('_', ' ') for f in
+                   attr.fields(items[0].__class__)]
+        rows = [[str(v) for v in attr.astuple(item)] for item in items]
+        tabulate(rows, headers=headers)
+
+    def project(self, items, cls=None):
+        """Reduce records to the fields given by --fields.
+
+        This is meant for records which aren't loaded via load_sqlite() (which
+        selects only the required fields in the first place). If cls is
+        given, the records are projected like those loaded from a database
+        with that record class, so both can be mixed.
+        """
+        if not self.fields:
+            yield from items
+            return
+        if cls is not None:
+            cls = project_class(cls, tuple(self.fields))
+        for item in items:
+            if cls is None:
+                cls = project_class(item.__class__, tuple(self.fields),
+                                    converters=False)
+            yield cls(**{f: getattr(item, f) for f in self.fields})
+
+    @staticmethod
+    def csv_from_items(items, stream=None, cls=None):
+        """Write a list of items to stream in CSV format.
+
+        The items need to be attrs-decorated. If there are no items, only the
+        header is written (given the item class is passed as cls).
+        """
         items = iter(items)
-        first = next(items)
-        cls = first.__class__
+        first = next(items, None)
+        if first is not None:
+            cls = first.__class__
+        if cls is None:
+            return
         if stream is None:
-            stream = sys.stdout
+            stream = output.stream()
         fields = [f.name for f in attr.fields(cls)]
         writer = csv.DictWriter(stream, fieldnames=fields)
         writer.writeheader()
-        writer.writerow(attr.asdict(first))
+        if first is not None:
+            writer.writerow(attr.asdict(first))
         writer.writerows((attr.asdict(x) for x in items))
 
+    def time_window(self, column, unit=MICROSECONDS):
+        """Return an SQL condition restricting column to the time window.
+
+        The window is given by the --since and --until arguments. Return a
+        tuple of the condition (or None if there's no window) and its
+        parameters. The unit is that of the timestamps in column.
+        """
+        conditions = []
+        params = []
+        if self.since is not None:
+            conditions.append('%s >= ?' % column)
+            params.append(self.since * unit)
+        if self.until is not None:
+            conditions.append('%s < ?' % column)
+            params.append(self.until * unit)
+        return (' AND '.join(conditions) or None), params
+
     def profile_path(self, path, must_exist=False):
-        """Return path from current profile."""
-        full_path = self.session.profile / path
+        """Return path from current profile.
+
+        The profile is either a directory or a directory in an archive, so
+        only the parts of pathlib's API which ArchivePath provides can be used
+        on the returned path.
+        """
+        profile = self.session.profile
+        if not isinstance(profile, ArchivePath):
+            profile = Path(str(profile))
+        full_path = profile / path
         if must_exist and not full_path.exists():
             raise FileNotFoundError(
                 errno.ENOENT,
                 os.strerror(errno.ENOENT),
-                PurePath(full_path).name,
+                full_path.name,
             )
         return full_path
 
@@ -170,15 +457,53 @@ class Feature(FeatureHelpersMixin, ABC):
     """
     format = None
     summary = None
+    since = None
+    until = None
+    fields = None
+    group_by = None
+    count = None
+    top = None
+    limit = None
+    offset = None
+    latest = None
+    # Set to True if the feature can be restricted to a time window
+    time_aware = False
+    # Set to the attrs class of the records a feature outputs to allow
+    # selecting their fields and aggregating them (the records need to be
+    # returned by records())
+    record_cls = None
+    # Set to True if the feature needs a profile directory (it writes to the
+    # profile or needs files outside of it) and can't read an archive
+    needs_directory = False
+    # Profile files the output depends on. If set, the output is cached
+    # (the last path component may be a glob pattern).
+    source_files = ()
+    # Set to False if the output doesn't only depend on the arguments and
+    # the sources (e.g. arbitrary SQL), so it must not be cached
+    cacheable = True
+    # Set to True if the feature doesn't read the profile given by
+    # -p/--profile (e.g. because it takes profiles as arguments)
+    standalone = False
+    # Record fields to order records loaded by load_sqlite() by, instead of
+    # the feature's own ordering
+    sort_by = None
     session = attrib()
 
     def __init_subclass__(cls):
         """Initialize feature subclass with the appropriate arguments.
 
-        If the feature has formatters, a format argument is added. All arg()
+        If the feature has formatters, a format argument is added. Time-aware
+        features get arguments for a time window. Features which declare
+        their record class get arguments to select fields, to aggregate
+        records and to select a page of records (or the latest records, if
+        they are time-aware); they need to override records(). All arg()
         attributes are registered as command-line arguments and converted to
         attrib().
         """
+        if cls.record_cls is not None and \
+           getattr(cls, 'records') is getattr(Feature, 'records'):
+            raise TypeError('Feature %s has a record class, but doesn\'t '
+                            'override records().' % cls.__name__)
         formatters = cls.formatters()
         if formatters:
             choices = formatters.keys()
@@ -190,6 +515,68 @@ class Feature(FeatureHelpersMixin, ABC):
                 help='output format',
                 default=default_format,
             )
+        if cls.time_aware:
+            cls.since = arg(
+                '--since',
+                type=parse_date,
+                metavar='DATE',
+                help='only include entries at or after DATE (YYYY-MM-DD '
+                     '[HH:MM[:SS]] or Unix timestamp)',
+            )
+            cls.until = arg(
+                '--until',
+                type=parse_date,
+                metavar='DATE',
+                help='only include entries before DATE',
+            )
+        if cls.record_cls is not None:
+            cls.fields = arg(
+                '--fields',
+                type=field_list,
+                metavar='FIELD,...',
+                help='only output these fields (%s; requires one of the '
+                     'formats %s)' % (cls.fields_help(),
+                                      ', '.join(FIELD_FORMATS)),
+            )
+            keys = [f.name for f in attr.fields(cls.record_cls)]
+            keys += [k for k, (field, _) in VIRTUAL_KEYS.items()
+                     if field in keys and k not in keys]
+            cls.group_by = arg(
+                '--group-by',
+                choices=keys,
+                metavar='KEY',
+                help='count records per KEY (%s)' % ', '.join(keys),
+            )
+            cls.count = arg(
+                '--count',
+                action='store_true',
+                help='count records (per group with --group-by)',
+            )
+            cls.top = arg(
+                '--top',
+                type=int,
+                metavar='N',
+                help='only output the N largest groups',
+            )
+            cls.limit = arg(
+                '--limit',
+                type=int,
+                metavar='N',
+                help='only output the first N records',
+            )
+            cls.offset = arg(
+                '--offset',
+                type=int,
+                metavar='N',
+                help='skip the first N records',
+            )
+            if cls.time_aware:
+                cls.latest = arg(
+                    '--latest',
+                    type=int,
+                    metavar='N',
+                    help='only output the latest N records',
+                )
         if cls.summarizable():
             cls.summary = arg(
                 '-s', '--summary',
@@ -201,16 +588,76 @@ class Feature(FeatureHelpersMixin, ABC):
         """Execute the feature.
 
         First, prepare() is called. Then either summarize() or run() is called
-        depending on the configuration.
+        depending on the configuration. If records are aggregated, the groups
+        are output instead.
         """
         self.session.logger.info('Profile: %s', self.session.profile)
         self.session.logger.info('Feature: %s', self.__class__.__name__)
+        if self.needs_directory and \
+           isinstance(self.session.profile, ArchivePath):
+            fatal('The %s feature needs a profile directory, not an '
+                  'archive.' % self.__class__.__name__.lower())
+        if self.fields:
+            self.check_fields()
+        aggregation = self.aggregation()
+        key = self.cache_key()
+        if key is None:
+            self.execute(aggregation)
+            return
+        if cache.replay(key, output.stream()):
+            self.session.logger.info('Output cached as %s.', key)
+            return
+        with cache.record(key, output.stream()) as recorder, \
+                output.redirect(recorder):
+            self.execute(aggregation)
+
+    def execute(self, aggregation):
         self.prepare()
-        if self.summary:
+        if aggregation is not None:
+            self.output_groups(self.records())
+        elif self.summary:
             self.summarize()
         else:
             self.run()
 
+    def source_paths(self):
+        """Return the paths of all source files which currently exist."""
+        return self.expand_paths(self.source_files)
+
+    def expand_paths(self, patterns):
+        """Return the profile paths of files given like sources.
+
+        Databases come with their write-ahead log, which holds the latest
+        changes.
+        """
+        paths = []
+        for source in patterns:
+            source = PurePosixPath(source)
+            if any(c in source.name for c in '*?['):
+                paths.extend(self.profile_path(source.parent).glob(
+                    source.name))
+                continue
+            paths.append(self.profile_path(source))
+            if source.suffix == '.sqlite':
+                paths.append(self.profile_path('%s-wal' % source))
+        return paths
+
+    def cache_key(self):
+        """Return the key of the feature's output in the cache.
+
+        The key is derived from the feature name, its arguments and the
+        fingerprints of its sources. If the cache is disabled or the feature
+        has no sources or isn't cacheable, return None.
+        """
+        if not (self.session.cache and self.source_files and self.cacheable):
+            return None
+        args = [(a.name, getattr(self, a.name))
+                for a in attr.fields(type(self))
+                if a.init and a.name != 'session']
+        return cache.make_key(type(self).__name__, args,
+                              [cache.fingerprint(p) for p in
+                               self.source_paths()])
+
     @classmethod
     def description(cls):
         """Return a description of the feature (used in the help message).
@@ -231,7 +678,12 @@ class Feature(FeatureHelpersMixin, ABC):
             except KeyError:
                 continue
             kwargs = kwargs.copy()
-            kwargs['dest'] = field.name
+            if args[0].startswith('-'):
+                kwargs['dest'] = field.name
+            else:
+                # Positional arguments take their destination from the name
+                kwargs.setdefault('metavar', args[0])
+                args = (field.name,)
             yield (args, kwargs)
 
     @classmethod
@@ -250,11 +702,75 @@ class Feature(FeatureHelpersMixin, ABC):
         names_and_features = ((f.__name__.lower(), f) for f in features)
         return OrderedDict(sorted(names_and_features, key=(lambda x: x[0])))
 
+    @classmethod
+    def fields_help(cls):
+        """Return the description of the fields which can be selected."""
+        return ', '.join(f.name for f in attr.fields(cls.record_cls))
+
     @classmethod
     def summarizable(cls):
         """Return whether the feature has overridden the summary method."""
         return getattr(cls, 'summarize') is not getattr(Feature, 'summarize')
 
+    def check_fields(self):
+        """Ensure that the selected fields can be output."""
+        available = [f.name for f in attr.fields(self.record_cls)]
+        unknown = [f for f in self.fields if f not in available]
+        if unknown:
+            fatal('Unknown field(s): %s (available: %s)' % (
+                ', '.join(unknown), ', '.join(available)))
+        if self.format not in FIELD_FORMATS and not self.summary:
+            fatal('Selecting fields requires one of the formats %s.' %
+                  ', '.join(FIELD_FORMATS))
+
+    def aggregation(self):
+        """Return the Aggregation of records as configured (or None)."""
+        if not (self.group_by or self.count or self.top is not None):
+            return None
+        if self.fields:
+            fatal('Fields can\'t be selected when aggregating records.')
+        if self.top is not None and not self.group_by:
+            fatal('Limiting to the top groups requires --group-by.')
+        field, func = self.group_by, None
+        if self.group_by not in attr.fields_dict(self.record_cls):
+            field, func = VIRTUAL_KEYS.get(self.group_by, (field, None))
+        return Aggregation(self.record_cls, self.group_by, field, func,
+                           self.top)
+
+    def page(self):
+        """Return the Page of records as configured (or None)."""
+        if self.limit is None and self.offset is None and self.latest is None:
+            return None
+        if self.aggregation() is not None:
+            fatal('Aggregated records can\'t be paged.')
+        for name in ('limit', 'offset', 'latest'):
+            value = getattr(self, name)
+            if value is not None and value < 0:
+                fatal('--%s must not be negative.' % name)
+        if self.latest is not None:
+            if self.limit is not None or self.offset is not None:
+                fatal('--latest can\'t be combined with --limit or --offset.')
+            return Page(limit=self.latest, latest=True)
+        return Page(limit=self.limit, offset=self.offset or 0)
+
+    def records(self):
+        """Return the records loaded by prepare().
+
+        Features with a record class need to override this (which is checked
+        when the feature class is created). If records are aggregated, these
+        are the groups. Features without records have none.
+        """
+        return None
+
+    def output_groups(self, groups):
+        if self.format == 'csv':
+            Feature.csv_from_items(groups, cls=group_class(self.record_cls,
+                                                           self.group_by))
+        elif self.format == 'jsonl':
+            Feature.jsonl_from_items(groups)
+        else:
+            Feature.table_from_items(groups)
+
     def build_format(self):
         """Call the configured formatter method.
 
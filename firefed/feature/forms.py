@@ -1,27 +1,57 @@
 import attr
 from attr import attrs
 
-from firefed.feature import Feature
+from firefed.feature import Feature, formatter
 from firefed.output import out
 
 
+FormEntry = attr.make_class('FormEntry', ['fieldname', 'value'])
+
+
 @attrs
 class Forms(Feature):
     """List form input history (search terms, address fields, etc.).
 
-    Searches in the browser's searchbar have the key "searchar-history".
+    Searches in the browser's searchbar have the key "searchar-history". The
+    time window applies to the last use of an entry.
     """
 
+    time_aware = True
+    record_cls = FormEntry
+    source_files = ('formhistory.sqlite',)
+
     def prepare(self):
+        where, params = self.time_window('lastUsed')
         self.entries = self.load_sqlite(
             db='formhistory.sqlite',
             table='moz_formhistory',
-            cls=attr.make_class('FormEntry', ['fieldname', 'value']),
+            cls=FormEntry,
+            where=where,
+            params=params,
+            order_by='lastUsed',
+            fields=self.fields,
+            aggregate=self.aggregation(),
+            page=self.page(),
         )
 
+    def records(self):
+        return self.entries
+
     def summarize(self):
         out('%d form entries found.' % len(list(self.entries)))
 
     def run(self):
+        self.build_format()
+
+    @formatter('list', default=True)
+    def list(self):
         for entry in self.entries:
             out('%s=%s' % (entry.fieldname, entry.value))
+
+    @formatter('csv')
+    def csv(self):
+        Feature.csv_from_items(self.entries)
+
+    @formatter('jsonl')
+    def jsonl(self):
+        Feature.jsonl_from_items(self.entries)
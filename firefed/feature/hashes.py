@@ -0,0 +1,78 @@
+from collections import OrderedDict
+
+from attr import attrib, attrs
+
+from firefed.feature import Feature, arg, formatter
+from firefed.hashing import hash_files
+from firefed.output import out
+
+
+# Profile files which firefed reads, besides the sources of features
+ARTIFACTS = ('logins.json', 'key4.db', 'key3.db', 'prefs.js', 'user.js',
+             'sessionstore-backups/*.jsonlz4', 'extensions/*.xpi')
+
+
+@attrs
+class FileHash:
+
+    path = attrib()
+    size = attrib()
+    sha256 = attrib()
+
+
+@attrs
+class Hashes(Feature):
+    """Hash the profile files firefed reads, for an integrity baseline.
+
+    These are the databases (with their write-ahead logs), JSON and session
+    files and addon packages. Files are hashed with SHA-256, in parallel.
+    The list format is that of sha256sum, so the hashes can be verified
+    with `sha256sum -c` in the profile directory.
+    """
+
+    record_cls = FileHash
+    workers = arg('-w', '--workers', type=int, help='number of files to hash '
+                  'in parallel (default: number of CPUs + 4)')
+
+    def prepare(self):
+        hashes = (FileHash(self.relative_name(path), size, digest)
+                  for path, size, digest in
+                  hash_files(self.artifact_paths(), self.workers))
+        aggregation = self.aggregation()
+        page = self.page()
+        if aggregation is not None:
+            hashes = aggregation.apply(hashes)
+        elif page is not None:
+            hashes = page.apply(hashes)
+        self.hashes = list(hashes)
+
+    def records(self):
+        return self.hashes
+
+    def run(self):
+        self.build_format()
+
+    def artifact_paths(self):
+        """Return the paths of all existing artifacts, sorted."""
+        patterns = [str(s) for F in Feature.feature_map().values()
+                    for s in F.source_files]
+        patterns.extend(ARTIFACTS)
+        paths = self.expand_paths(OrderedDict.fromkeys(patterns))
+        return sorted({p for p in paths if p.is_file()}, key=str)
+
+    def relative_name(self, path):
+        # Paths in archives start with the profile's path as well
+        return str(path)[len(str(self.session.profile)):].lstrip('/\\')
+
+    @formatter('list', default=True)
+    def list(self):
+        for file_hash in self.hashes:
+            out('%s  %s' % (file_hash.sha256, file_hash.path))
+
+    @formatter('csv')
+    def csv(self):
+        Feature.csv_from_items(self.project(self.hashes), cls=FileHash)
+
+    @formatter('jsonl')
+    def jsonl(self):
+        Feature.jsonl_from_items(self.project(self.hashes))
@@ -1,10 +1,25 @@
+from collections import OrderedDict
 from datetime import datetime
+from pathlib import Path
+import sqlite3
 
+import attr
 from attr import attrib, attrs
 
-from firefed.feature import Feature, formatter
+from firefed.feature import Feature, arg, formatter
 from firefed.output import out, outitem
-from firefed.util import moz_to_unix_timestamp
+from firefed.util import fatal, moz_to_unix_timestamp, moz_url_hash
+
+
+# Each URL takes two query parameters (hash and URL), so stay well below
+# SQLite's default limit of 999 parameters
+LOOKUP_BATCH_SIZE = 400
+LOOKUP_QUERY = '''SELECT p.url, p.visit_count, v.visit_date FROM moz_places p
+LEFT JOIN moz_historyvisits v ON v.place_id = p.id %s WHERE %s
+ORDER BY v.visit_date'''
+
+
+LookupRow = attr.make_class('LookupRow', ['url', 'visit_count', 'visit_date'])
 
 
 @attrs
@@ -16,29 +31,150 @@ class HistoryEntry:
     visit_count = attrib()
 
 
+@attrs
+class UrlLookup:
+
+    url = attrib()
+    visit_count = attrib(default=0)
+    visit_dates = attrib(default=attr.Factory(list))
+
+
 @attrs
 class History(Feature):
     """List history."""
 
+    time_aware = True
+    record_cls = HistoryEntry
+    source_files = ('places.sqlite',)
+    lookup_urls = arg('-u', '--url', nargs='+', metavar='URL',
+                      help='only look up the given URLs')
+    lookup_file = arg('-U', '--url-file', metavar='PATH',
+                      help='only look up the URLs listed in a file (one per '
+                      'line)')
     entries = attrib(default=None, init=False)
+    lookups = attrib(default=None, init=False)
 
     def prepare(self):
-        entries = self.load_sqlite(
+        if self.lookup_urls or self.lookup_file:
+            if self.aggregation() is not None:
+                fatal('URL lookups can\'t be aggregated.')
+            self.lookups = list(self.lookup(self.urls_to_look_up()))
+            return
+        # Entries without last visit date can be dropped (e.g. bookmarks)
+        where = 'last_visit_date IS NOT NULL'
+        window, params = self.time_window('last_visit_date')
+        if window:
+            where += ' AND %s' % window
+        self.entries = list(self.load_sqlite(
             db='places.sqlite',
             table='moz_places',
             cls=HistoryEntry,
+            where=where,
+            params=params,
+            order_by='last_visit_date',
+            fields=self.fields,
+            aggregate=self.aggregation(),
+            page=self.page(),
+        ))
+
+    def source_paths(self):
+        # Looked up URLs depend on the URL file as well
+        paths = super().source_paths()
+        if self.lookup_file:
+            paths.append(Path(self.lookup_file))
+        return paths
+
+    def records(self):
+        return self.entries
+
+    def urls_to_look_up(self):
+        urls = list(self.lookup_urls or [])
+        if self.lookup_file:
+            try:
+                with open(self.lookup_file, encoding='utf-8') as f:
+                    urls.extend(line.strip() for line in f if line.strip())
+            except FileNotFoundError:
+                fatal('URL file "%s" not found.' % self.lookup_file)
+        # Remove duplicates, but keep the order
+        return list(OrderedDict.fromkeys(urls))
+
+    def lookup(self, urls):
+        """Look up visits of the given URLs and return a UrlLookup for each.
+
+        The URLs are matched via the index on moz_places.url_hash, so that
+        looking up many URLs doesn't require a scan of the whole table.
+        Databases from before the url_hash column existed are queried by URL.
+        """
+        results = OrderedDict((url, UrlLookup(url)) for url in urls)
+        window, window_params = self.time_window('v.visit_date')
+        for i in range(0, len(urls), LOOKUP_BATCH_SIZE):
+            batch = urls[i:i + LOOKUP_BATCH_SIZE]
+            try:
+                rows = list(self.lookup_batch(batch, window, window_params,
+                                              use_hash=True))
+            except sqlite3.OperationalError as e:
+                if 'url_hash' not in str(e):
+                    raise
+                rows = list(self.lookup_batch(batch, window, window_params,
+                                              use_hash=False))
+            for row in rows:
+                result = results[row.url]
+                result.visit_count = row.visit_count
+                if row.visit_date is not None:
+                    result.visit_dates.append(
+                        moz_to_unix_timestamp(row.visit_date))
+        return results.values()
+
+    def lookup_batch(self, urls, window, window_params, use_hash):
+        placeholders = ','.join('?' * len(urls))
+        condition = 'p.url IN (%s)' % placeholders
+        params = urls
+        if use_hash:
+            condition = 'p.url_hash IN (%s) AND %s' % (placeholders, condition)
+            params = [moz_url_hash(url) for url in urls] + urls
+        join_condition = ''
+        if window:
+            # Restrict the visits, but still report all looked up URLs
+            join_condition = 'AND %s' % window
+            params = window_params + params
+        return self.load_sqlite(
+            db='places.sqlite',
+            query=LOOKUP_QUERY % (join_condition, condition),
+            cls=LookupRow,
+            params=params,
         )
-        # Entries without last visit date can be dropped (e.g. bookmarks)
-        entries = [e for e in entries if e.last_visit_date is not None]
-        entries.sort(key=lambda x: x.last_visit_date)
-        self.entries = entries
 
     def summarize(self):
+        if self.lookups is not None:
+            out('%d of %d URLs visited.' % (
+                sum(bool(lookup.visit_count) for lookup in self.lookups),
+                len(self.lookups)))
+            return
         out('%d history entries found.' % len(self.entries))
 
     def run(self):
+        if self.lookups is not None:
+            self.format_lookups()
+            return
         self.build_format()
 
+    def format_lookups(self):
+        if self.format == 'csv':
+            Feature.csv_from_items((attr.evolve(
+                lookup,
+                visit_dates=' '.join(str(d) for d in lookup.visit_dates),
+            ) for lookup in self.lookups), cls=UrlLookup)
+            return
+        for lookup in self.lookups:
+            if not lookup.visit_count:
+                out('%s\n    (not visited)\n' % lookup.url)
+                continue
+            dates = [datetime.fromtimestamp(d) for d in lookup.visit_dates]
+            outitem(lookup.url, [
+                ('Visits', lookup.visit_count),
+                ('Visit dates', ', '.join(str(d) for d in dates)),
+            ])
+
     @formatter('list', default=True)
     def list(self):
         for entry in self.entries:
@@ -57,3 +193,7 @@ class History(Feature):
     @formatter('csv')
     def format_csv(self):
         Feature.csv_from_items(self.entries)
+
+    @formatter('jsonl')
+    def format_jsonl(self):
+        Feature.jsonl_from_items(self.entries)
@@ -100,6 +100,7 @@ class Infect(Feature):
     a JS REPL with system principal privileges.
     """
 
+    needs_directory = True
     want_uninstall = arg('-u', '--uninstall', help='uninstall malicious addon',
                          action='store_true', default=False)
     want_check = arg('-c', '--check', help='check if profile appears infected',
@@ -0,0 +1,323 @@
+from collections import OrderedDict, deque
+from datetime import datetime
+from pathlib import Path
+import re
+import sqlite3
+
+import attr
+from attr import attrib, attrs
+
+from firefed.feature import Feature, arg, formatter
+from firefed.feature.feature import project_class
+from firefed.feature.places import DOWNLOAD_TYPE
+from firefed.output import out
+from firefed.util import (MICROSECONDS, MILLISECONDS, fatal, normalize_url,
+                          url_host)
+
+
+URL = 'url'
+DOMAIN = 'domain'
+SUBSTRING = 'substring'
+# Source name -> (database, tables, value column, timestamp column, timestamp
+# unit, whether the values are URLs (or else hosts))
+SOURCES = OrderedDict([
+    ('history', ('places.sqlite', 'moz_places', 'url', 'last_visit_date',
+                 MICROSECONDS, True)),
+    ('visits', ('places.sqlite', 'moz_historyvisits v JOIN moz_places p ON '
+                'v.place_id = p.id', 'p.url', 'v.visit_date', MICROSECONDS,
+                True)),
+    ('cookies', ('cookies.sqlite', 'moz_cookies', 'host', 'lastAccessed',
+                 MICROSECONDS, False)),
+    ('permissions', ('permissions.sqlite', 'moz_perms', 'origin',
+                     'modificationTime', MILLISECONDS, True)),
+    # The annotation holds the destination file, the place the source URL
+    ('downloads', ('places.sqlite', 'moz_annos a JOIN moz_places p ON '
+                   'a.place_id = p.id', 'p.url', 'a.dateAdded', MICROSECONDS,
+                   True)),
+])
+SOURCE_FILTERS = {
+    'downloads': 'a.anno_attribute_id = %d' % DOWNLOAD_TYPE,
+}
+domain_regex = re.compile(r'^(\*?\.)?([a-z0-9_-]+\.)+[a-z0-9_-]+\.?$')
+# Defanged notations, as used in threat reports
+DEFANGED = [('[.]', '.'), ('(.)', '.'), ('[:]', ':')]
+# A defanged scheme (e.g. "hxxps://"), optionally after the type prefix
+defanged_scheme_regex = re.compile(r'^(%s:)?hxxp(s?)://' % URL, re.I)
+
+
+class DomainSet:
+    """A set of domains which also matches their subdomains.
+
+    This is a reverse-domain trie, flattened into a set: each domain is a
+    path of labels from the TLD, and a host is matched by looking up each of
+    its label suffixes, i.e. each node on its path. A set of strings takes
+    a fraction of the memory of nested nodes.
+    """
+
+    def __init__(self):
+        self.domains = set()
+
+    def __len__(self):
+        return len(self.domains)
+
+    def add(self, domain):
+        self.domains.add(domain.strip('.').lower())
+
+    def matches(self, host):
+        """Yield the domains which host is equal to or a subdomain of."""
+        start = 0
+        while True:
+            if host[start:] in self.domains:
+                yield host[start:]
+            start = host.find('.', start) + 1
+            if not start:
+                return
+
+
+class AhoCorasick:
+    """Automaton to find all occurrences of many substrings in one pass.
+
+    The trie of all substrings is extended with failure links, which point
+    to the longest suffix of a node that is a node as well. Searching a text
+    takes linear time in its length (plus the matches), regardless of the
+    number of substrings. Nodes are indexes into flat lists.
+    """
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [()]
+        # Node -> substring ending there
+        self.terminals = {}
+        self.built = True
+
+    def __len__(self):
+        return len(self.terminals)
+
+    def add(self, word):
+        node = 0
+        for char in word:
+            next_node = self.goto[node].get(char)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][char] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+            node = next_node
+        self.terminals[node] = word
+        self.built = False
+
+    def build(self):
+        """Compute the failure links and outputs, breadth-first.
+
+        The outputs of a node are its own substring and the outputs of the
+        node its failure link points to.
+        """
+        self.outputs = [()] * len(self.goto)
+        for node, word in self.terminals.items():
+            self.outputs[node] = (word,)
+        queue = deque(self.goto[0].values())
+        for child in queue:
+            self.fail[child] = 0
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fail = self.fail[node]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(char, 0)
+                self.outputs[child] += self.outputs[self.fail[child]]
+        self.built = True
+
+    def search(self, text):
+        """Yield all substrings found in text (once per occurrence)."""
+        if not self.built:
+            self.build()
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            yield from outputs[node]
+
+
+@attrs
+class Indicators:
+    """Indicators of compromise, by type."""
+
+    urls = attrib(default=attr.Factory(set))
+    domains = attrib(default=attr.Factory(DomainSet))
+    substrings = attrib(default=attr.Factory(AhoCorasick))
+
+    @classmethod
+    def from_lines(cls, lines):
+        """Parse indicators, one per line.
+
+        A line can be prefixed with its type ("url:", "domain:" or
+        "substring:"). Otherwise, lines with a scheme are URLs, lines which
+        look like a domain (optionally starting with "*." or ".") are
+        domains, and all others substrings. Defanged indicators (e.g.
+        "hxxp://evil[.]example") are refanged. URLs are normalized, so that
+        e.g. "HTTP://Evil.example" matches "http://evil.example/". Lines
+        starting with "#" are comments.
+        """
+        indicators = cls()
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            for defanged, refanged in DEFANGED:
+                line = line.replace(defanged, refanged)
+            line = defanged_scheme_regex.sub(r'\1http\2://', line)
+            type_, sep, value = line.partition(':')
+            if not sep or type_ not in (URL, DOMAIN, SUBSTRING):
+                type_, value = cls.classify(line), line
+            if type_ == URL:
+                indicators.urls.add(normalize_url(value))
+            elif type_ == DOMAIN:
+                indicators.domains.add(value.lstrip('*'))
+            else:
+                indicators.substrings.add(value.lower())
+        return indicators
+
+    @staticmethod
+    def classify(value):
+        if '://' in value:
+            return URL
+        if domain_regex.match(value.lower()):
+            return DOMAIN
+        return SUBSTRING
+
+    def __len__(self):
+        return len(self.urls) + len(self.domains) + len(self.substrings)
+
+    def match(self, value, is_url):
+        """Yield (type, indicator) tuples of all indicators value matches.
+
+        URLs are compared in their normalized form (see normalize_url()).
+        """
+        if is_url:
+            if self.urls:
+                url = normalize_url(value)
+                if url in self.urls:
+                    yield URL, url
+            host = url_host(value)
+        else:
+            # Domain cookies start with a dot
+            host = value.lstrip('.').lower()
+        if host:
+            for domain in self.domains.matches(host):
+                yield DOMAIN, domain
+        if self.substrings:
+            for substring in OrderedDict.fromkeys(
+                    self.substrings.search(value.lower())):
+                yield SUBSTRING, substring
+
+
+@attrs
+class Hit:
+
+    date = attrib()
+    source = attrib()
+    value = attrib()
+    type = attrib()
+    indicator = attrib()
+
+
+@attrs
+class Ioc(Feature):
+    """Match URLs and hosts against a list of indicators of compromise.
+
+    History, visits, cookies, permissions and downloads (by their source
+    URL) are scanned in one pass, each value being matched against all
+    indicators at once: URLs exactly, domains including their subdomains,
+    and substrings anywhere (case-insensitively). Matching takes constant
+    time per URL and domain indicator, so lists of millions of indicators
+    are fine.
+
+    The time window applies to the timestamp of each source (the last
+    visit, visit, last access, modification or download date).
+    """
+
+    time_aware = True
+    record_cls = Hit
+    source_files = tuple(OrderedDict.fromkeys(s[0] for s in
+                                              SOURCES.values()))
+    indicator_file = arg('-l', '--list', metavar='FILE', help='file with '
+                         'indicators (URLs, domains or substrings, one per '
+                         'line)')
+
+    def prepare(self):
+        if not self.indicator_file:
+            fatal('No indicator list given.')
+        try:
+            with open(self.indicator_file, encoding='utf-8') as f:
+                self.indicators = Indicators.from_lines(f)
+        except FileNotFoundError:
+            fatal('Indicator list "%s" not found.' % self.indicator_file)
+        self.session.logger.info('%d indicators loaded.',
+                                 len(self.indicators))
+        hits = self.scan()
+        aggregation = self.aggregation()
+        page = self.page()
+        if aggregation is not None:
+            hits = aggregation.apply(hits)
+        elif page is not None:
+            hits = page.apply(hits)
+        self.hits = hits
+
+    def source_paths(self):
+        # The output depends on the indicators as well
+        paths = super().source_paths()
+        if self.indicator_file:
+            paths.append(Path(self.indicator_file))
+        return paths
+
+    def records(self):
+        return self.hits
+
+    def run(self):
+        self.build_format()
+
+    def scan(self):
+        for name, (db, tables, column, date_column, unit,
+                   is_url) in SOURCES.items():
+            conditions = ['%s IS NOT NULL' % column]
+            if name in SOURCE_FILTERS:
+                conditions.append(SOURCE_FILTERS[name])
+            window, params = self.time_window(date_column, unit)
+            if window:
+                conditions.append(window)
+            query = 'SELECT %s AS value, %s / %d AS date FROM %s WHERE %s' % (
+                column, date_column, unit, tables, ' AND '.join(conditions))
+            try:
+                rows = self.load_sqlite(db, query=query, params=params,
+                                        cls=lambda value, date: (value, date))
+                for value, date in rows:
+                    for type_, indicator in self.indicators.match(value,
+                                                                  is_url):
+                        yield Hit(date, name, value, type_, indicator)
+            except (FileNotFoundError, sqlite3.OperationalError) as e:
+                self.session.logger.info('Skipping %s: %s', name, e)
+
+    @formatter('list', default=True)
+    def list(self):
+        count = 0
+        for hit in self.hits:
+            date = '-' if hit.date is None else \
+                datetime.fromtimestamp(hit.date)
+            out('%s [%s] %s (%s: %s)' % (date, hit.source, hit.value,
+                                         hit.type, hit.indicator))
+            count += 1
+        out('%d hits found.' % count)
+
+    @formatter('csv')
+    def csv(self):
+        cls = project_class(Hit, tuple(self.fields)) if self.fields else Hit
+        Feature.csv_from_items(self.project(self.hits), cls=cls)
+
+    @formatter('jsonl')
+    def jsonl(self):
+        Feature.jsonl_from_items(self.project(self.hits))
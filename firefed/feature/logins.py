@@ -2,6 +2,8 @@ import base64
 import ctypes
 from ctypes import CDLL, byref, c_char_p, c_void_p, cast, string_at
 import getpass
+import hashlib
+import mmap
 
 import attr
 from attr import attrib, attrs
@@ -77,6 +79,54 @@ class NSSWrapper:
         raise NSSError(error_name, error_str)
 
 
+class HashFile:
+    """A sorted list of SHA-1 hashes, searched in a memory-mapped file.
+
+    The file has a hash in hex per line, optionally followed by a colon and
+    a count (like the Pwned Passwords list, ordered by hash). A lookup is a
+    binary search over the bytes of the file, so only the pages of the lines
+    it compares are read, and the file can be much larger than memory.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def count(self, digest):
+        """Return how often a hash (in hex) is listed, 0 if it isn't.
+
+        Lines without count are counted once.
+        """
+        target = bytes(digest.upper(), 'ascii')
+        map_ = self.map
+        # Both bounds are always at the start of a line
+        low, high = 0, len(map_)
+        while low < high:
+            middle = (low + high) // 2
+            start = map_.rfind(b'\n', low, middle) + 1 or low
+            end = map_.find(b'\n', start, high)
+            if end == -1:
+                end = high
+            line_hash = map_[start:start + len(target)].upper()
+            if line_hash == target:
+                _, _, count = map_[start:end].partition(b':')
+                return int(count.strip() or 1)
+            if line_hash < target:
+                low = end + 1
+            else:
+                high = start
+        return 0
+
+
 @attrs
 class Login:
 
@@ -85,6 +135,14 @@ class Login:
     password = attrib()
 
 
+@attrs
+class BreachedLogin:
+
+    host = attrib()
+    username = attrib()
+    breach_count = attrib()
+
+
 @attrs
 class Logins(Feature):
     """List saved logins.
@@ -93,16 +151,22 @@ class Logins(Feature):
     cracking an unkown password.
     """
 
+    needs_directory = True
     libnss = arg('-l', '--libnss', default='libnss3.so',
                  help='path to libnss3')
     password = arg('-p', '--master-password',
                    help='profile\'s master password (If not set, an empty '
                         'password is tried. If that fails, you\'re prompted.)')
+    hash_file = arg('-b', '--breached', metavar='FILE',
+                    help='only list logins whose password is in a sorted '
+                    'SHA-1 hash file (e.g. Pwned Passwords, ordered by '
+                    'hash), without showing the passwords')
 
     def prepare(self):
         self.nss = NSSWrapper(self.libnss, self.session.profile)
         logins_json = self.load_json('logins.json')['logins']
         self.logins = logins_json
+        self.total = len(self.logins)
 
     def summarize(self):
         out('%d logins found.' % len(self.logins))
@@ -123,26 +187,63 @@ class Logins(Feature):
             nss.check_password(self.password)
         except NSSError as e:
             fatal(e)
-        self.logins = [Login(
-            host=login['hostname'],
-            username=nss.decrypt(login['encryptedUsername']),
-            password=nss.decrypt(login['encryptedPassword']),
-        ) for login in self.logins]
+        if self.hash_file is not None:
+            self.logins = self.breached_logins()
+        else:
+            self.logins = [Login(
+                host=login['hostname'],
+                username=nss.decrypt(login['encryptedUsername']),
+                password=nss.decrypt(login['encryptedPassword']),
+            ) for login in self.logins]
         self.build_format()
 
+    def breached_logins(self):
+        """Return the logins whose password is in the hash file.
+
+        Passwords are hashed right after decryption and never output.
+        """
+        try:
+            hashes = HashFile(self.hash_file)
+        except (OSError, ValueError) as e:
+            fatal('Can\'t open hash file: %s' % e)
+        breached = []
+        with hashes:
+            for login in self.logins:
+                digest = hashlib.sha1(bytes(self.nss.decrypt(
+                    login['encryptedPassword']), 'utf-8')).hexdigest()
+                count = hashes.count(digest)
+                if count:
+                    breached.append(BreachedLogin(
+                        host=login['hostname'],
+                        username=self.nss.decrypt(
+                            login['encryptedUsername']),
+                        breach_count=count,
+                    ))
+        return breached
+
+    def summarize_breached(self):
+        if self.hash_file is not None:
+            out('%d of %d logins use breached passwords.' % (
+                len(self.logins), self.total))
+
     @formatter('table', default=True)
     def table(self):
-        rows = [attr.astuple(x) for x in self.logins]
-        tabulate(rows, headers=['Host', 'Username', 'Password'])
+        rows = [[str(v) for v in attr.astuple(x)] for x in self.logins]
+        last_header = 'Password' if self.hash_file is None else 'Breaches'
+        tabulate(rows, headers=['Host', 'Username', last_header])
+        self.summarize_breached()
 
     @formatter('list')
     def list(self):
         for login in self.logins:
-            outitem(login.host, [
-                ('Username', login.username),
-                ('Password', login.password),
-            ])
+            if self.hash_file is None:
+                last_item = ('Password', login.password)
+            else:
+                last_item = ('Breaches', login.breach_count)
+            outitem(login.host, [('Username', login.username), last_item])
+        self.summarize_breached()
 
     @formatter('csv')
     def csv(self):
-        Feature.csv_from_items(self.logins)
+        Feature.csv_from_items(self.logins, cls=Login if self.hash_file is
+                               None else BreachedLogin)
@@ -3,7 +3,9 @@ from attr import attrib, attrs
 
 from firefed.feature import Feature, formatter
 from firefed.output import out
-from firefed.util import tabulate
+
+
+Permission = attr.make_class('Permission', ['host', 'permission'])
 
 
 @attrs
@@ -14,16 +16,24 @@ class Permissions(Feature):
     particular hosts (e.g. popups, location sharing, desktop notifications).
     """
 
+    record_cls = Permission
+    source_files = ('permissions.sqlite',)
     perms = attrib(default=None, init=False)
 
     def prepare(self):
         self.perms = self.load_sqlite(
             db='permissions.sqlite',
             table='moz_perms',
-            cls=attr.make_class('Permission', ['host', 'permission']),
+            cls=Permission,
             column_map={'origin': 'host', 'type': 'permission'},
+            fields=self.fields,
+            aggregate=self.aggregation(),
+            page=self.page(),
         )
 
+    def records(self):
+        return self.perms
+
     def summarize(self):
         out('%d permissions found.' % len(list(self.perms)))
 
@@ -32,9 +42,12 @@ class Permissions(Feature):
 
     @formatter('table', default=True)
     def table(self):
-        rows = [attr.astuple(p) for p in self.perms]
-        tabulate(rows, headers=('Host', 'Permission'))
+        Feature.table_from_items(self.perms)
 
     @formatter('csv')
     def csv(self):
         Feature.csv_from_items(self.perms)
+
+    @formatter('jsonl')
+    def jsonl(self):
+        Feature.jsonl_from_items(self.perms)
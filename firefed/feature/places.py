@@ -3,7 +3,7 @@ from datetime import datetime
 import attr
 from attr import attrs, attrib
 
-from firefed.feature import Feature
+from firefed.feature import Feature, formatter
 from firefed.output import out
 from firefed.util import moz_to_unix_timestamp
 
@@ -20,40 +20,75 @@ class Download:
     anno_attribute_id = attrib()
 
 
+Host = attr.make_class('Host', ['host'])
+Input = attr.make_class('Input', ['input'])
+
 @attrs
 class Downloads(Feature):
     """List downloaded files."""
 
+    time_aware = True
+    record_cls = Download
+    source_files = (DB,)
+
     def prepare(self):
+        where = 'anno_attribute_id = %d' % DOWNLOAD_TYPE
+        window, params = self.time_window('dateAdded')
+        if window:
+            where += ' AND %s' % window
         self.data = self.load_sqlite(
             db=DB,
             table='moz_annos',
             cls=Download,
-            column_map={'dateAdded': 'date', 'content': 'filename'}
+            column_map={'dateAdded': 'date', 'content': 'filename'},
+            where=where,
+            params=params,
+            order_by='dateAdded',
+            fields=self.fields,
+            aggregate=self.aggregation(),
+            page=self.page(),
         )
 
+    def records(self):
+        return self.data
+
     def summarize(self):
         out('%d downloads found.' % len(list(self.data)))
 
     def run(self):
+        self.build_format()
+
+    @formatter('list', default=True)
+    def list(self):
         for download in self.data:
-            if download.anno_attribute_id != DOWNLOAD_TYPE:
-                continue
             out('%s %s' % (datetime.fromtimestamp(download.date),
                            download.filename))
 
+    @formatter('csv')
+    def csv(self):
+        Feature.csv_from_items(self.data)
+
+    @formatter('jsonl')
+    def jsonl(self):
+        Feature.jsonl_from_items(self.data)
+
 
 @attrs
 class Hosts(Feature):
     """List known hosts."""
 
+    source_files = (DB,)
+
     def prepare(self):
         self.data = self.load_sqlite(
             db=DB,
             table='moz_hosts',
-            cls=attr.make_class('Host', ['host']),
+            cls=Host,
         )
 
+    def records(self):
+        return self.data
+
     def summarize(self):
         out('%d hosts found.' % len(list(self.data)))
 
@@ -66,13 +101,18 @@ class Hosts(Feature):
 class InputHistory(Feature):
     """List history of urlbar inputs (typed URLs)."""
 
+    source_files = (DB,)
+
     def prepare(self):
         self.data = self.load_sqlite(
             db=DB,
             table='moz_inputhistory',
-            cls=attr.make_class('Input', ['input']),
+            cls=Input,
         )
 
+    def records(self):
+        return self.data
+
     def summarize(self):
         out('%d input history entries found.' % len(list(self.data)))
 
@@ -1,13 +1,51 @@
+import json
+import os
 import re
+import time
 
 from attr import attrib, attrs
 import requests
 
 from firefed.feature import Feature, arg
-from firefed.output import bad, good, out, outitem
+from firefed.output import bad, good, out, outitem, warn
+from firefed.util import cache_dir, fatal
 
-pref_regex = r'\s*user_pref\((["\'])(.+?)\1,\s*(.+?)\);'
+# Functions which set a preference, and the attributes they accept
+PREF_FUNCTIONS = {'pref', 'user_pref', 'sticky_pref', 'lockPref'}
+PREF_ATTRIBUTES = {'sticky', 'locked'}
+# Contents of a double-quoted string, unrolled to avoid backtracking
+string_pattern = r'"([^"\\]*(?:\\.[^"\\]*)*)"'
+# A line with a single statement (as written by Firefox), in one match
+line_regex = re.compile(
+    r'\s*(?:user_pref|pref|sticky_pref|lockPref)\(\s*%s\s*,\s*'
+    r'(?:(true|false)|(-?\d+)|%s)\s*\)\s*;\s*$' % (
+        string_pattern, string_pattern))
+SPACE = 'space'
+COMMENT = 'comment'
+BLOCK_COMMENT = 'block_comment'
+STRING = 'string'
+NUMBER = 'number'
+WORD = 'word'
+token_regex = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<comment>(?://|\#).*)
+  | (?P<block_comment>/\*)
+  | (?P<string>"[^"\\]*(?:\\.[^"\\]*)*"|'[^'\\]*(?:\\.[^'\\]*)*')
+  | (?P<number>[+-]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<word>[A-Za-z_]\w*)
+  | (?P<punctuation>.)
+''', re.VERBOSE)
+escape_regex = re.compile(r'\\(x[0-9a-fA-F]{2}|u[0-9a-fA-F]{4}|.)')
+ESCAPES = {'n': '\n', 'r': '\r', 't': '\t'}
 userjs_url = 'https://raw.githubusercontent.com/pyllyukko/user.js/%s/user.js'
+userjs_sources = ['userjs-master', 'userjs-relaxed']
+# Seconds a fetched user.js is used before checking for a newer version
+USERJS_TTL = 24 * 60 * 60
+# Seconds to wait for GitHub to respond
+USERJS_TIMEOUT = 10
+# Version of the parser output. Bump this whenever preferences are parsed
+# differently, so that cached userjs configs are parsed again.
+PARSER_VERSION = 1
 pref_files = ['prefs.js', 'user.js']
 
 
@@ -26,20 +64,146 @@ class Preference:
         if val is None:
             return 'undefined'
         if isinstance(val, str):
-            return '"%s"' % val
+            return '"%s"' % val.replace('\\', '\\\\').replace('"', '\\"')
         if isinstance(val, bool):
             return repr(val).lower()
         return str(val)
 
     @staticmethod
     def repr_to_type(val):
-        if val in ['true', 'false']:
-            return val == 'true'
+        """Convert a value in prefs.js syntax (None if it's invalid)."""
+        match = token_regex.fullmatch(val)
+        return None if match is None else pref_value(match.lastgroup, val)
+
+
+def unescape(text):
+    """Resolve the escape sequences of a string in prefs.js syntax."""
+    if '\\' not in text:
+        return text
+    text = escape_regex.sub(lambda m: chr(int(m[1][1:], 16)) if len(m[1]) > 1
+                            else ESCAPES.get(m[1], m[1]), text)
+    # Characters beyond the BMP are escaped as surrogate pairs
+    return text.encode('utf-16', 'surrogatepass').decode('utf-16', 'replace')
+
+
+def pref_value(kind, text):
+    """Return the value of a token (None if it's not a valid value)."""
+    if kind == STRING:
+        return unescape(text[1:-1])
+    if kind == NUMBER:
         try:
-            return int(val)
+            return int(text)
         except ValueError:
-            # Value will be a string, so just cut the surrounding quotes
-            return val[1:-1]
+            return float(text)
+    if text in ('true', 'false'):
+        return text == 'true'
+    return None
+
+
+class PrefsParser:
+    """Parser of the prefs.js syntax, which user.js uses as well.
+
+    Preferences are set by calls of pref(), user_pref(), sticky_pref() or
+    lockPref() with a name and a boolean, number or string value (and
+    optionally the attributes sticky and locked). Comments start with //, #
+    or /*.
+
+    The input is read line by line. A line with a single statement, like
+    all lines Firefox writes, is parsed with one regex match. Other lines
+    are split into tokens, so statements can span lines or be followed by
+    comments. Malformed statements are skipped up to the next semicolon, as
+    Firefox does.
+    """
+
+    def __init__(self, descriptions=False):
+        # Whether to keep the descriptions of the userjs config, i.e.
+        # comments with "PREF:" which describe the preferences up to the
+        # next blank line
+        self.descriptions = descriptions
+        self.description = None
+        self.in_comment = False
+        # Tokens of the current statement
+        self.statement = []
+
+    def parse(self, lines):
+        """Yield the preferences set by lines, in order."""
+        match_line = line_regex.match
+        for line in lines:
+            if not (self.in_comment or self.statement):
+                match = match_line(line)
+                if match is not None:
+                    key, boolean, number, string = match.groups()
+                    if boolean is not None:
+                        value = boolean == 'true'
+                    elif number is not None:
+                        value = int(number)
+                    else:
+                        value = unescape(string)
+                    yield Preference(unescape(key), value, self.description)
+                    continue
+                if not line.strip():
+                    self.description = None
+                    continue
+            yield from self.parse_line(line)
+        # The last statement may lack its semicolon
+        if self.statement:
+            pref = self.parse_statement()
+            if pref is not None:
+                yield pref
+
+    def parse_line(self, line):
+        pos = 0
+        if self.in_comment:
+            end = line.find('*/')
+            if end == -1:
+                return
+            self.in_comment = False
+            pos = end + 2
+        while True:
+            match = token_regex.match(line, pos)
+            if match is None:
+                return
+            kind, text = match.lastgroup, match.group()
+            pos = match.end()
+            if kind == SPACE:
+                continue
+            if kind == COMMENT:
+                if self.descriptions and 'PREF:' in text:
+                    self.description = text.split('PREF:', 1)[1].strip()
+            elif kind == BLOCK_COMMENT:
+                end = line.find('*/', pos)
+                if end == -1:
+                    self.in_comment = True
+                    return
+                pos = end + 2
+            elif text == ';':
+                pref = self.parse_statement()
+                if pref is not None:
+                    yield pref
+            else:
+                self.statement.append((kind, text))
+
+    def parse_statement(self):
+        """Return the preference the current statement sets.
+
+        Return None if the statement is malformed.
+        """
+        tokens, self.statement = self.statement, []
+        # Function, "(", name, ",", value, (",", attribute)*, ")"
+        if len(tokens) < 6 or len(tokens) % 2:
+            return None
+        texts = [text for _, text in tokens]
+        if texts[0] not in PREF_FUNCTIONS or texts[1] != '(' or \
+                tokens[2][0] != STRING or texts[3] != ',' or \
+                texts[-1] != ')' or \
+                any(t != ',' for t in texts[5:-1:2]) or \
+                any(t not in PREF_ATTRIBUTES for t in texts[6:-1:2]):
+            return None
+        value = pref_value(*tokens[4])
+        if value is None:
+            return None
+        return Preference(unescape(texts[2][1:-1]), value,
+                          info=self.description)
 
 
 @attrs
@@ -62,6 +226,9 @@ class Preferences(Feature):
         arg('-S', '--source', default='userjs-relaxed', metavar='PATH',
             help='path to file with recommended settings (use "userjs-master" '
             'or "userjs-relaxed" to load userjs config from Github)')
+    offline = \
+        arg('--offline', action='store_true', help='don\'t fetch the userjs '
+            'config, but use the copy cached by a previous run')
     bad_only = \
         arg('-b', '--bad-only', action='store_true', help='when comparing with'
             ' recommendations, show only bad values')
@@ -73,6 +240,9 @@ class Preferences(Feature):
     def prepare(self):
         self.prefs = list(self.parse_prefs())
 
+    def records(self):
+        return self.prefs
+
     def summarize(self):
         out('%d custom preferences found.' % len(self.prefs))
 
@@ -87,13 +257,15 @@ class Preferences(Feature):
 
     def check_recommended(self):
         self.summarize()
-        prefs_rec = list(self.parse_userjs(self.recommended_source))
+        prefs_rec = list(self.parse_userjs(self.recommended_source,
+                                           offline=self.offline))
         out('%d recommendeded values read.\n' % len(prefs_rec))
+        prefs = {p.key: p for p in self.prefs}
         bad_num = 0
         for pref_rec in prefs_rec:
             try:
-                pref = next(p for p in self.prefs if p.key == pref_rec.key)
-            except StopIteration:
+                pref = prefs[pref_rec.key]
+            except KeyError:
                 if self.include_undefined:
                     # Create a fake preference with an undefined value
                     pref = Preference(pref_rec.key, None)
@@ -120,32 +292,104 @@ class Preferences(Feature):
         prefs = {}
         for pref_file in pref_files:
             try:
-                with open(self.profile_path(pref_file), encoding='utf-8') as f:
-                    data = f.read()
+                f = self.profile_path(pref_file).open(encoding='utf-8')
             except FileNotFoundError:
-                data = ''
-            matches = re.findall(pref_regex, data)
-            for _, key, val in matches:
-                # With allow_duplicates we don't actually want unique pref keys
-                dict_key = key + val if self.allow_duplicates else key
-                prefs[dict_key] = Preference(key, Preference.repr_to_type(val))
+                continue
+            with f:
+                for pref in PrefsParser().parse(f):
+                    # With allow_duplicates we don't actually want unique
+                    # pref keys
+                    dict_key = (pref.key, Preference.type_to_repr(
+                        pref.value)) if self.allow_duplicates else pref.key
+                    prefs[dict_key] = pref
         return prefs.values()
 
     @staticmethod
-    def parse_userjs(filename):
-        if filename in ['userjs-master', 'userjs-relaxed']:
-            branch = filename.split('-')[-1]
-            data = requests.get(userjs_url % branch).text
-        else:
-            with open(filename, encoding='utf-8') as f:
-                data = f.read()
-        description = None
-        for line in data.split('\n'):
-            match = re.match(pref_regex, line)
-            if match is not None:
-                key, val = match[2], Preference.repr_to_type(match[3])
-                yield Preference(key, val, info=description)
-            elif 'PREF:' in line:
-                description = line[9:]
-            elif not line:
-                description = None
+    def parse_userjs(filename, offline=False):
+        if filename in userjs_sources:
+            return fetch_userjs(filename.split('-')[-1], offline=offline)
+        with open(filename, encoding='utf-8') as f:
+            return list(PrefsParser(descriptions=True).parse(f))
+
+
+def parse_userjs_data(data):
+    """Yield the preferences of a user.js, with their descriptions."""
+    return PrefsParser(descriptions=True).parse(data.splitlines())
+
+
+def fetch_userjs(branch, offline=False):
+    """Return the preferences of the userjs config from Github.
+
+    The config is cached, along with its ETag and Last-Modified headers and
+    its parsed preferences. Within USERJS_TTL of the last fetch (or if
+    offline), the cached copy is used without a request. After that, it's
+    only downloaded again if it has changed. If Github can't be reached, a
+    stale copy is used as well.
+    """
+    raw_path = cache_dir('userjs') / ('%s.js' % branch)
+    meta_path = raw_path.with_suffix('.json')
+    try:
+        with meta_path.open(encoding='utf-8') as f:
+            meta = json.load(f)
+        data = raw_path.read_text(encoding='utf-8')
+    except (OSError, ValueError):
+        meta = data = None
+    if meta is not None and (offline or
+                             time.time() - meta['fetched'] < USERJS_TTL):
+        return cached_userjs(meta, data, meta_path)
+    if offline:
+        fatal('The userjs config hasn\'t been cached yet. Run once without '
+              '--offline, or pass a local copy with -S/--source.')
+    headers = {}
+    if meta is not None:
+        if meta['etag']:
+            headers['If-None-Match'] = meta['etag']
+        if meta['last_modified']:
+            headers['If-Modified-Since'] = meta['last_modified']
+    try:
+        response = requests.get(userjs_url % branch, headers=headers,
+                                timeout=USERJS_TIMEOUT)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        if meta is None:
+            fatal('Can\'t fetch the userjs config: %s' % e)
+        warn('Can\'t fetch the userjs config, using the cached copy: %s' % e)
+        return cached_userjs(meta, data, meta_path)
+    if response.status_code == 304:
+        meta['fetched'] = time.time()
+        write_json(meta_path, meta)
+        return cached_userjs(meta, data, meta_path)
+    data = response.text
+    write_text(raw_path, data)
+    prefs = list(parse_userjs_data(data))
+    write_json(meta_path, {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'fetched': time.time(),
+        'parser_version': PARSER_VERSION,
+        'prefs': [[p.key, p.value, p.info] for p in prefs],
+    })
+    return prefs
+
+
+def cached_userjs(meta, data, meta_path):
+    """Return the cached preferences, parsed again by a newer parser."""
+    if meta.get('parser_version') != PARSER_VERSION:
+        prefs = list(parse_userjs_data(data))
+        meta['parser_version'] = PARSER_VERSION
+        meta['prefs'] = [[p.key, p.value, p.info] for p in prefs]
+        write_json(meta_path, meta)
+        return prefs
+    return [Preference(*p) for p in meta['prefs']]
+
+
+def write_text(path, text):
+    # Written to a temporary file first, so a concurrent run never reads a
+    # partial file
+    tmp_path = path.with_name('%s.%d.tmp' % (path.name, os.getpid()))
+    tmp_path.write_text(text, encoding='utf-8')
+    os.replace(str(tmp_path), str(path))
+
+
+def write_json(path, obj):
+    write_text(path, json.dumps(obj))
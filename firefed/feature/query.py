@@ -0,0 +1,100 @@
+from collections import OrderedDict
+import json
+import sqlite3
+
+from attr import attrib, attrs
+
+from firefed.archive import ArchivePath
+from firefed.feature import Feature, arg, formatter
+from firefed.output import csv_writer, out
+from firefed.util import fatal, tabulate
+
+
+# Schema name -> database file
+DATABASES = OrderedDict([
+    ('places', 'places.sqlite'),
+    ('cookies', 'cookies.sqlite'),
+    ('forms', 'formhistory.sqlite'),
+    ('permissions', 'permissions.sqlite'),
+    ('favicons', 'favicons.sqlite'),
+])
+
+
+@attrs
+class Query(Feature):
+    """Run an SQL query across the profile databases.
+
+    The databases are attached read-only to a single connection under the
+    schema names places, cookies, forms, permissions and favicons, so that
+    queries can join tables of different databases, e.g.:
+
+        SELECT p.url, c.name FROM places.moz_places p
+        JOIN cookies.moz_cookies c ON p.url LIKE '%' || c.host || '/%'
+
+    Missing databases are skipped.
+    """
+
+    source_files = tuple(DATABASES.values())
+    # Queries may be non-deterministic (e.g. datetime('now') or random())
+    cacheable = False
+    sql = arg('sql', nargs='?', help='SQL query')
+    con = attrib(default=None, init=False)
+
+    def prepare(self):
+        if not self.sql:
+            fatal('No query given.')
+        self.con = self.connect()
+
+    def run(self):
+        self.build_format()
+
+    def connect(self):
+        """Open an in-memory connection with all databases attached.
+
+        The databases are opened via URIs with mode=ro, and the connection
+        is set to query_only, so neither the databases nor the temporary
+        schema can be modified.
+        """
+        con = sqlite3.connect('file::memory:', uri=True)
+        for schema, db in DATABASES.items():
+            try:
+                path = self.profile_path(db, must_exist=True)
+            except FileNotFoundError:
+                self.session.logger.info('Skipping missing "%s".', db)
+                continue
+            if isinstance(path, ArchivePath):
+                path.attach(con, schema)
+                continue
+            con.execute('ATTACH DATABASE ? AS %s' % schema,
+                        ('%s?mode=ro' % path.resolve().as_uri(),))
+        con.execute('PRAGMA query_only = 1')
+        return con
+
+    def rows(self):
+        """Execute the query and return the column names and a row cursor."""
+        try:
+            cursor = self.con.execute(self.sql)
+        except sqlite3.Error as e:
+            fatal('Query failed: %s' % e)
+        columns = [c[0] for c in cursor.description or []]
+        return columns, cursor
+
+    @formatter('table', default=True)
+    def table(self):
+        columns, rows = self.rows()
+        rows = [[str(v) for v in row] for row in rows]
+        if columns:
+            tabulate(rows, headers=columns)
+
+    @formatter('csv')
+    def csv(self):
+        columns, rows = self.rows()
+        writer = csv_writer()
+        writer.writerow(columns)
+        writer.writerows(rows)
+
+    @formatter('jsonl')
+    def jsonl(self):
+        columns, rows = self.rows()
+        for row in rows:
+            out(json.dumps(OrderedDict(zip(columns, row)), default=str))
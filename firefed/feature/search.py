@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+import attr
+from attr import attrib, attrs
+
+from firefed.feature import Feature, arg, formatter
+from firefed.output import out
+from firefed.util import cache_dir, fatal
+
+
+# Bump this whenever the schema changes, so that old indexes are rebuilt
+INDEX_VERSION = 2
+INDEX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sources (name PRIMARY KEY, device, inode, size,
+    mtime);
+CREATE TABLE IF NOT EXISTS rows (rowid INTEGER PRIMARY KEY, source, id,
+    digest, UNIQUE (source, id));
+CREATE VIRTUAL TABLE IF NOT EXISTS entries USING fts5(source UNINDEXED, url,
+    title, fieldname, value);
+PRAGMA user_version = %d;
+''' % INDEX_VERSION
+# Source name -> (database, query for all rows, ordered by id)
+SOURCES = {
+    'history': ('places.sqlite', '''SELECT id, url, title, NULL AS fieldname,
+        NULL AS value FROM moz_places ORDER BY id'''),
+    'forms': ('formhistory.sqlite', '''SELECT id, NULL AS url, NULL AS title,
+        fieldname, value FROM moz_formhistory ORDER BY id'''),
+}
+BATCH_SIZE = 10000
+
+
+IndexRow = attr.make_class('IndexRow', ['id', 'url', 'title', 'fieldname',
+                                        'value'])
+
+
+def row_digest(row):
+    """Return a digest of the indexed values of a row."""
+    values = json.dumps([row.url, row.title, row.fieldname, row.value])
+    return hashlib.sha1(bytes(values, 'utf-8')).hexdigest()
+
+
+@attrs
+class SearchResult:
+
+    source = attrib()
+    url = attrib()
+    title = attrib()
+    fieldname = attrib()
+    value = attrib()
+
+
+@attrs
+class Search(Feature):
+    """Search history and form history.
+
+    Matching is done on a full-text index of URLs, titles and form values.
+    The index is built on the first search and stored in the cache directory.
+    Subsequent searches only index rows which have been added or changed
+    since, and remove those which have been deleted.
+    """
+
+    term = arg('term', nargs='?', help='search term')
+    raw = arg('-r', '--raw', action='store_true', help='pass the term as '
+              'FTS5 query (e.g. "foo OR bar*")')
+    rebuild = arg('-R', '--rebuild', action='store_true', help='rebuild the '
+                  'search index from scratch')
+    index = attrib(default=None, init=False)
+
+    def prepare(self):
+        if not self.term:
+            fatal('No search term given.')
+        self.index = self.open_index()
+        for name, (db, query) in SOURCES.items():
+            try:
+                self.update_index(name, db, query)
+            except FileNotFoundError:
+                self.session.logger.info('Skipping missing "%s".', db)
+
+    def execute(self, aggregation):
+        try:
+            super().execute(aggregation)
+        finally:
+            if self.index is not None:
+                self.index.close()
+
+    def run(self):
+        self.build_format()
+
+    def index_path(self):
+        """Return the index path for the current profile."""
+        profile = os.path.realpath(str(self.session.profile))
+        key = hashlib.sha1(bytes(profile, 'utf-8')).hexdigest()
+        return cache_dir('search') / ('%s.sqlite' % key)
+
+    def open_index(self):
+        path = self.index_path()
+        if self.rebuild and path.exists():
+            path.unlink()
+        con = sqlite3.connect(str(path))
+        version, = con.execute('PRAGMA user_version').fetchone()
+        if version != INDEX_VERSION:
+            # New, or built by an older version, so start from scratch
+            con.close()
+            if path.exists():
+                path.unlink()
+            con = sqlite3.connect(str(path))
+        try:
+            con.executescript(INDEX_SCHEMA)
+        except sqlite3.OperationalError as e:
+            fatal('Can\'t create search index: %s' % e)
+        return con
+
+    def update_index(self, name, db, query):
+        """Bring the index of a source up to date.
+
+        The source file is identified by device, inode, size and mtime. If
+        it's unchanged, nothing is done. Otherwise, all its rows are read
+        and compared with the digests of the indexed rows (by id): only new
+        and changed rows are indexed (again), and rows which are gone are
+        removed from the index. Reading rows is cheap compared to indexing
+        them.
+        """
+        stat = self.profile_path(db, must_exist=True).stat()
+        fingerprint = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime)
+        row = self.index.execute('SELECT device, inode, size, mtime FROM '
+                                 'sources WHERE name = ?', (name,)).fetchone()
+        if row == fingerprint:
+            return
+        self.session.logger.info('Updating the index of "%s".', db)
+        # Id -> (index rowid, digest) of the indexed rows
+        indexed = {id_: (rowid, digest) for rowid, id_, digest in
+                   self.index.execute('SELECT rowid, id, digest FROM rows '
+                                      'WHERE source = ?', (name,))}
+        with self.index:
+            batch = []
+            for row in self.load_sqlite(db, query=query, cls=IndexRow):
+                digest = row_digest(row)
+                rowid, old_digest = indexed.pop(row.id, (None, None))
+                if digest == old_digest:
+                    continue
+                if rowid is not None:
+                    self.delete_rows([rowid])
+                batch.append((name, row, digest))
+                if len(batch) >= BATCH_SIZE:
+                    self.insert_rows(batch)
+                    batch = []
+            self.insert_rows(batch)
+            # Rows which have been deleted from the source
+            self.delete_rows(rowid for rowid, _ in indexed.values())
+            self.index.execute('INSERT OR REPLACE INTO sources VALUES '
+                               '(?, ?, ?, ?, ?)', (name, *fingerprint))
+
+    def insert_rows(self, batch):
+        start, = self.index.execute('SELECT COALESCE(MAX(rowid), 0) + 1 '
+                                    'FROM rows').fetchone()
+        rowids = range(start, start + len(batch))
+        self.index.executemany(
+            'INSERT INTO rows (rowid, source, id, digest) VALUES (?, ?, ?, ?)',
+            ((rowid, name, row.id, digest)
+             for rowid, (name, row, digest) in zip(rowids, batch)))
+        self.index.executemany(
+            'INSERT INTO entries (rowid, source, url, title, fieldname, '
+            'value) VALUES (?, ?, ?, ?, ?, ?)',
+            ((rowid, name, row.url, row.title, row.fieldname, row.value)
+             for rowid, (name, row, _) in zip(rowids, batch)))
+
+    def delete_rows(self, rowids):
+        rowids = [(r,) for r in rowids]
+        self.index.executemany('DELETE FROM entries WHERE rowid = ?', rowids)
+        self.index.executemany('DELETE FROM rows WHERE rowid = ?', rowids)
+
+    def match_expression(self):
+        if self.raw:
+            return self.term
+        # Quote all tokens so that punctuation (e.g. in URLs) is matched
+        # literally
+        return ' '.join('"%s"' % t.replace('"', '""')
+                        for t in self.term.split())
+
+    def results(self):
+        try:
+            cursor = self.index.execute(
+                'SELECT source, url, title, fieldname, value FROM entries '
+                'WHERE entries MATCH ? ORDER BY rank',
+                (self.match_expression(),),
+            )
+        except sqlite3.OperationalError as e:
+            fatal('Invalid search term: %s' % e)
+        for row in cursor:
+            yield SearchResult(*row)
+
+    @formatter('list', default=True)
+    def list(self):
+        for result in self.results():
+            if result.source == 'forms':
+                out('[%s] %s=%s' % (result.source, result.fieldname,
+                                    result.value))
+            else:
+                out('[%s] %s' % (result.source, result.url))
+                if result.title:
+                    out('    %s' % result.title)
+
+    @formatter('csv')
+    def csv(self):
+        Feature.csv_from_items(self.results(), cls=SearchResult)
@@ -19,6 +19,7 @@ class Summary(Feature):
         features = Feature.__subclasses__()
         features.remove(Summary)
         for Feature_ in features:
-            if not Feature_.summarizable():
+            # Standalone features don't summarize this profile
+            if Feature_.standalone or not Feature_.summarizable():
                 continue
             Feature_(self.session, summary=True)()
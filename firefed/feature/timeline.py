@@ -0,0 +1,157 @@
+from datetime import datetime
+import heapq
+import sqlite3
+
+from attr import attrib, attrs
+
+from firefed.feature import Feature, arg, formatter
+from firefed.feature.feature import Page, project_class
+from firefed.feature.places import DOWNLOAD_TYPE
+from firefed.output import out
+from firefed.util import MICROSECONDS, MILLISECONDS, SECONDS
+
+
+# Source name -> (database, tables, timestamp column, timestamp unit,
+# description)
+SOURCES = {
+    'visit': ('places.sqlite', 'moz_historyvisits v JOIN moz_places p ON '
+              'v.place_id = p.id', 'v.visit_date', MICROSECONDS, 'p.url'),
+    'download': ('places.sqlite', 'moz_annos', 'dateAdded', MICROSECONDS,
+                 'content'),
+    'bookmark': ('places.sqlite', 'moz_bookmarks b LEFT JOIN moz_places p ON '
+                 'b.fk = p.id', 'b.dateAdded', MICROSECONDS,
+                 'COALESCE(p.url, b.title)'),
+    'form-first-use': ('formhistory.sqlite', 'moz_formhistory', 'firstUsed',
+                       MICROSECONDS, 'fieldname || \'=\' || value'),
+    'form-last-use': ('formhistory.sqlite', 'moz_formhistory', 'lastUsed',
+                      MICROSECONDS, 'fieldname || \'=\' || value'),
+    'cookie-expiry': ('cookies.sqlite', 'moz_cookies', 'expiry', SECONDS,
+                      'host || \' \' || name'),
+    'permission': ('permissions.sqlite', 'moz_perms', 'modificationTime',
+                   MILLISECONDS, 'origin || \' \' || type'),
+}
+SOURCE_FILTERS = {
+    'download': 'anno_attribute_id = %d' % DOWNLOAD_TYPE,
+}
+PROFILE_SOURCE = 'profile-created'
+
+
+@attrs
+class Event:
+
+    date = attrib()
+    source = attrib()
+    description = attrib()
+
+
+@attrs
+class Timeline(Feature):
+    """List events from all time-stamped sources in chronological order.
+
+    This includes visits, downloads, bookmark additions, form history usage,
+    cookie expiries, permission changes and the profile creation.
+    """
+
+    time_aware = True
+    record_cls = Event
+    source_files = (*sorted({db for db, *_ in SOURCES.values()}),
+                    'times.json')
+
+    sources = arg('-S', '--sources', nargs='+', metavar='SOURCE',
+                  choices=[*SOURCES, PROFILE_SOURCE],
+                  help='only include events from these sources (%s)' %
+                  ', '.join([*SOURCES, PROFILE_SOURCE]))
+
+    def run(self):
+        self.build_format()
+
+    def records(self):
+        aggregation = self.aggregation()
+        if aggregation is not None:
+            return aggregation.apply(self.events())
+        return self.project(self.events())
+
+    def events(self):
+        """Merge the events of all sources into a single stream.
+
+        Every source is read as an ordered stream, and the streams are merged
+        lazily, so only one pending event per source is held in memory.
+
+        If only a page of events is requested, no source needs to provide
+        more events than the page extends to (or, for the latest events, more
+        than the page size).
+        """
+        page = self.page()
+        source_page = None
+        if page is not None and page.latest:
+            source_page = page
+        elif page is not None and page.limit is not None:
+            source_page = Page(limit=page.offset + page.limit)
+        streams = [self.load_source(name, *source, page=source_page) for
+                   name, source in SOURCES.items() if self.wants_source(name)]
+        if self.wants_source(PROFILE_SOURCE):
+            streams.append(self.load_profile_creation())
+        events = heapq.merge(*streams, key=lambda e: e.date)
+        if page is not None:
+            events = page.apply(events)
+        return events
+
+    def wants_source(self, name):
+        return not self.sources or name in self.sources
+
+    def load_source(self, name, db, tables, column, unit, description,
+                    page=None):
+        """Load the events of a source, ordered by their timestamp.
+
+        Events are filtered and ordered on the native timestamp column, so
+        indexes can be used, and converted to Unix timestamps.
+        """
+        def make_event(timestamp, date, description):
+            return Event(date, name, description)
+        conditions = ['%s IS NOT NULL' % column]
+        if name in SOURCE_FILTERS:
+            conditions.append(SOURCE_FILTERS[name])
+        window, params = self.time_window(column, unit)
+        if window:
+            conditions.append(window)
+        query = 'SELECT %s AS timestamp, %s / %d AS date, %s AS description ' \
+                'FROM %s WHERE %s' % (column, column, unit, description,
+                                      tables, ' AND '.join(conditions))
+        try:
+            yield from self.load_sqlite(db, query=query, cls=make_event,
+                                        params=params, order_by='timestamp',
+                                        page=page)
+        except (FileNotFoundError, sqlite3.OperationalError) as e:
+            self.session.logger.info('Skipping %s events: %s', name, e)
+
+    def load_profile_creation(self):
+        try:
+            created = self.load_json('times.json')['created']
+        except (FileNotFoundError, KeyError) as e:
+            self.session.logger.info('Skipping %s event: %s', PROFILE_SOURCE,
+                                     e)
+            return
+        date = created // MILLISECONDS
+        if (self.since is None or date >= self.since) and \
+           (self.until is None or date < self.until):
+            yield Event(date, PROFILE_SOURCE, 'times.json')
+
+    @formatter('list', default=True)
+    def list(self):
+        for event in self.events():
+            try:
+                date = datetime.fromtimestamp(event.date)
+            except (OverflowError, OSError, ValueError):
+                # E.g. cookies expiring in the far future
+                date = event.date
+            out('%s [%s] %s' % (date, event.source, event.description))
+
+    @formatter('csv')
+    def csv(self):
+        cls = project_class(Event, tuple(self.fields)) if self.fields else \
+            Event
+        Feature.csv_from_items(self.project(self.events()), cls=cls)
+
+    @formatter('jsonl')
+    def jsonl(self):
+        Feature.jsonl_from_items(self.project(self.events()))
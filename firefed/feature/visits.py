@@ -2,11 +2,25 @@ from datetime import datetime
 
 from attr import attrib, attrs
 
-from firefed.feature import Feature, formatter
+from firefed.feature import Feature, arg, formatter
 from firefed.output import out
 from firefed.util import moz_to_unix_timestamp
 
 
+# See the TRANSITION_* constants in nsINavHistoryService.idl
+VISIT_TYPES = {
+    1: 'link',
+    2: 'typed',
+    3: 'bookmark',
+    4: 'embed',
+    5: 'redirect (permanent)',
+    6: 'redirect (temporary)',
+    7: 'download',
+    8: 'framed link',
+    9: 'reload',
+}
+
+
 @attrs
 class Visit:
 
@@ -16,6 +30,12 @@ class Visit:
     url = attrib()
 
 
+@attrs
+class TypedVisit(Visit):
+
+    type = attrib()
+
+
 @attrs
 class Visits(Feature):
     """List history of visited URLs.
@@ -25,16 +45,38 @@ class Visits(Feature):
     same.
     """
 
+    time_aware = True
+    record_cls = Visit
+    source_files = ('places.sqlite',)
+    max_depth = arg('-d', '--max-depth', type=int, default=100,
+                    help='maximum length of referrer chains (default: 100)')
+
     def prepare(self):
-        visits = list(self.load_sqlite(
-            db='places.sqlite',
-            query='''SELECT v.id, v.from_visit, v.visit_date, p.url FROM
+        if self.format == 'chains':
+            query = '''SELECT v.id, v.from_visit, v.visit_date, p.url,
+            v.visit_type AS type FROM moz_historyvisits v JOIN moz_places p
+            ON v.place_id = p.id'''
+            cls = TypedVisit
+        else:
+            query = '''SELECT v.id, v.from_visit, v.visit_date, p.url FROM
             moz_historyvisits v JOIN moz_places p ON v.place_id = p.id
-            ''',
-            cls=Visit,
+            '''
+            cls = Visit
+        where, params = self.time_window('visit_date')
+        self.visits = list(self.load_sqlite(
+            db='places.sqlite',
+            query=query,
+            cls=cls,
+            where=where,
+            params=params,
+            order_by='visit_date, id',
+            fields=self.fields,
+            aggregate=self.aggregation(),
+            page=self.page(),
         ))
-        visits.sort(key=lambda x: x.visit_date)
-        self.visits = visits
+
+    def records(self):
+        return self.visits
 
     def summarize(self):
         out('%d visits found.' % len(self.visits))
@@ -42,11 +84,84 @@ class Visits(Feature):
     def run(self):
         self.build_format()
 
+    def chains(self):
+        """Yield all referrer chains, ordered from origin to final visit.
+
+        A chain ends at each visit which isn't the referrer of another visit.
+        Chains are followed through an index of visit ids, stopping at visits
+        already seen (to break cycles) and at the maximum depth. Visits
+        without any referrer don't form a chain and are skipped.
+        """
+        index = {v.id: v for v in self.visits}
+        referrers = {v.from_visit for v in self.visits}
+        # Visit id -> length of the chain up to that visit
+        lengths = {}
+        for visit in self.visits:
+            if visit.id in referrers:
+                continue
+            length = min(self.chain_length(visit, index, lengths),
+                         self.max_depth)
+            if length < 2:
+                continue
+            chain = [visit]
+            while len(chain) < length:
+                chain.append(index[chain[-1].from_visit])
+            yield chain[::-1]
+
+    @staticmethod
+    def chain_length(visit, index, lengths):
+        """Return the length of the referrer chain which ends at a visit.
+
+        The lengths of all referrers on the way are memoized, so that visits
+        which share referrers only follow them once. The chain itself is
+        rebuilt by following that many referrers.
+        """
+        path = []
+        positions = {}
+        referrer = visit
+        while referrer is not None and referrer.id not in lengths and \
+                referrer.id not in positions:
+            positions[referrer.id] = len(path)
+            path.append(referrer)
+            referrer = index.get(referrer.from_visit)
+        start = len(path)
+        if referrer is None:
+            length = 0
+        elif referrer.id in lengths:
+            length = lengths[referrer.id]
+        else:
+            # The referrers run into a cycle. The chain of a visit in the
+            # cycle goes around it once.
+            start = positions[referrer.id]
+            length = len(path) - start
+            for v in path[start:]:
+                lengths[v.id] = length
+        for v in reversed(path[:start]):
+            length += 1
+            lengths[v.id] = length
+        return lengths[visit.id]
+
     @formatter('list', default=True)
     def list(self):
         for visit in self.visits:
             out(datetime.fromtimestamp(visit.visit_date), visit.url)
 
+    @formatter('chains')
+    def format_chains(self):
+        for chain in self.chains():
+            out(datetime.fromtimestamp(chain[-1].visit_date), chain[-1].url)
+            for visit in chain:
+                out('    %s [%s] %s' % (
+                    datetime.fromtimestamp(visit.visit_date),
+                    VISIT_TYPES.get(visit.type, visit.type),
+                    visit.url,
+                ))
+            out()
+
     @formatter('csv')
     def csv(self):
         Feature.csv_from_items(self.visits)
+
+    @formatter('jsonl')
+    def jsonl(self):
+        Feature.jsonl_from_items(self.visits)
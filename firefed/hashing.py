@@ -0,0 +1,54 @@
+"""SHA-256 hashes of files, for integrity baselines.
+
+A file is memory-mapped and hashed in a single call, during which hashlib
+releases the GIL. So files hashed in a thread pool are hashed in parallel,
+alongside whatever else the process does.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import mmap
+
+from firefed.archive import ArchivePath
+
+
+# Size of the chunks members of archives are read in
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    """Return the SHA-256 hash of a file, in hex."""
+    return sized_hash(path)[1]
+
+
+def sized_hash(path):
+    """Return the size of a file and its SHA-256 hash, in hex.
+
+    The size is that of the content which was hashed, so the two agree even
+    if the file changes meanwhile.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    if isinstance(path, ArchivePath):
+        with path.open('rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                size += len(chunk)
+        return size, digest.hexdigest()
+    with open(str(path), 'rb') as f:
+        try:
+            map_ = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped
+            return size, digest.hexdigest()
+        with map_:
+            digest.update(map_)
+            size = len(map_)
+    return size, digest.hexdigest()
+
+
+def hash_files(paths, workers=None):
+    """Hash files in a thread pool and yield (path, size, hash), in order."""
+    with ThreadPoolExecutor(workers) as executor:
+        for path, (size, digest) in zip(paths,
+                                        executor.map(sized_hash, paths)):
+            yield path, size, digest
@@ -1,11 +1,131 @@
+import bz2
+from contextlib import contextmanager
 import csv
+import gzip
+import lzma
+import queue
 import sys
+import threading
+
+import lz4.frame
 
 import colorama
 from colorama import Fore, Style
 
 
+# Compression formats of output files by file extension
+COMPRESSORS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+    '.lz4': lz4.frame.open,
+}
+# Size of the chunks of output handed over to the compression thread
+CHUNK_SIZE = 1 << 20
+# Number of chunks which may wait for compression before writing blocks
+MAX_PENDING_CHUNKS = 4
+
+_local = threading.local()
+
+
+def stream():
+    """Return the stream output is written to.
+
+    This is stdout, unless output of the current thread is redirected.
+    """
+    return getattr(_local, 'stream', None) or sys.stdout
+
+
+@contextmanager
+def redirect(stream_):
+    """Redirect all output of the current thread to stream_."""
+    previous = getattr(_local, 'stream', None)
+    _local.stream = stream_
+    try:
+        yield stream_
+    finally:
+        _local.stream = previous
+
+
+class CompressingWriter:
+    """Text stream which writes to a compressed file in a background thread.
+
+    Written text is collected in chunks, which are compressed and written by
+    a separate thread. The compression libraries release the GIL, so the
+    output is compressed while the next chunk is produced. Errors of the
+    thread are raised on the next write or on close().
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.chunk = []
+        self.chunk_size = 0
+        self.error = None
+        self.queue = queue.Queue(MAX_PENDING_CHUNKS)
+        self.thread = threading.Thread(target=self.compress, daemon=True)
+        self.thread.start()
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        self.chunk.append(data)
+        self.chunk_size += len(data)
+        if self.chunk_size >= CHUNK_SIZE:
+            self.hand_over()
+        return len(text)
+
+    def flush(self):
+        if self.chunk:
+            self.hand_over()
+
+    def hand_over(self):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(b''.join(self.chunk))
+        self.chunk = []
+        self.chunk_size = 0
+
+    def compress(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            # After an error, keep taking chunks so that writers don't block
+            if self.error is None:
+                try:
+                    self.file.write(data)
+                except Exception as e:  # pylint: disable=broad-except
+                    self.error = e
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.queue.put(None)
+            self.thread.join()
+            self.file.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_output(path):
+    """Open a file for text output, compressed according to its extension.
+
+    Compressed files are written by a CompressingWriter.
+    """
+    open_ = COMPRESSORS.get(path.suffix)
+    if open_ is None:
+        return open(str(path), 'w', encoding='utf-8', newline='')
+    return CompressingWriter(open_(str(path), 'wb'))
+
+
 def out(*args, **kwargs):
+    kwargs.setdefault('file', stream())
     print(*args, **kwargs)
 
 
@@ -44,7 +164,7 @@ def outitem(title, elems, indent=4):
 
 
 def csv_writer():
-    return csv.writer(sys.stdout)
+    return csv.writer(stream())
 
 
 colorama.init()
@@ -13,6 +13,7 @@ class Session:
     logger = attrib(default=attr.Factory(lambda x: x.make_logger(),
                                          takes_self=True))
     verbosity = attrib(default=0)
+    cache = attrib(default=False)
 
     def __attrs_post_init__(self):
         if self.verbosity > 0:
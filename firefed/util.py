@@ -2,12 +2,16 @@ import argparse
 from configparser import ConfigParser
 from datetime import datetime
 from itertools import chain
+import os
 from pathlib import Path
 import re
+from urllib.parse import urlsplit, urlunsplit
 
 from attr import attrib, attrs
 
 import firefed.__version__ as version
+from firefed.archive import archive_profile
+from firefed.output import out
 
 
 PROFILES_INI_PATHS = [
@@ -18,6 +22,15 @@ PROFILES_INI_PATHS = [
     '~/Library/Mozilla/Firefox/Profiles',
 ]
 PROFILES_INI = 'profiles.ini'
+DATE_FORMATS = ['%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S',
+                '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S']
+# Units of timestamps in Mozilla's databases, as fractions of a second
+SECONDS = 1
+MILLISECONDS = 1000
+MICROSECONDS = 1000000
+GOLDEN_RATIO_U32 = 0x9e3779b9
+URL_HASH_MAX_CHARS = 1500
+URL_HASH_SCHEME_CHARS = 50
 
 
 @attrs
@@ -68,9 +81,18 @@ def read_profiles():
 
 
 def profile_dir(name):
-    """Return path to FF profile for a given profile name or path."""
+    """Return path to FF profile for a given profile name or path.
+
+    The path can also be a zip or tar archive, or a directory inside of one.
+    """
     if name:
         possible_path = Path(name)
+        try:
+            profile = archive_profile(possible_path)
+        except ValueError as e:
+            fatal(e)
+        if profile is not None:
+            return profile
         if possible_path.exists():
             return possible_path
     profiles = list(read_profiles())
@@ -84,6 +106,14 @@ def profile_dir(name):
     return profile.path
 
 
+def cache_dir(*parts):
+    """Return (and create) a directory inside firefed's cache directory."""
+    root = os.environ.get('XDG_CACHE_HOME') or '~/.cache'
+    path = Path(root).expanduser().joinpath(version.__title__, *parts)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
 def moz_datetime(ts):
     """Convert Mozilla timestamp to datetime."""
     return datetime.fromtimestamp(moz_to_unix_timestamp(ts))
@@ -97,6 +127,77 @@ def moz_to_unix_timestamp(ts):
         return 0
 
 
+def parse_date(text):
+    """Parse a local date (e.g. "2018-01-31 12:00") or Unix timestamp.
+
+    Return the date as Unix timestamp. This function can be used as type of a
+    command-line argument.
+    """
+    if text.isdigit():
+        return int(text)
+    for format_ in DATE_FORMATS:
+        try:
+            return int(datetime.strptime(text, format_).timestamp())
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(
+        'invalid date: "%s" (use YYYY-MM-DD [HH:MM[:SS]] or a Unix '
+        'timestamp)' % text)
+
+
+def moz_hash_string(data):
+    """Compute Mozilla's 32-bit string hash (mozilla::HashString)."""
+    h = 0
+    for byte in data:
+        rotated = ((h << 5) | (h >> 27)) & 0xffffffff
+        h = (GOLDEN_RATIO_U32 * (rotated ^ byte)) & 0xffffffff
+    return h
+
+
+def moz_url_hash(url):
+    """Compute the url_hash of a URL as stored in moz_places.
+
+    This mirrors HashURL() in toolkit/components/places/Helpers.cpp: The
+    lower 32 bits are the hash of the URL (or its first 1500 chars), the
+    upper 16 bits are taken from the hash of the scheme.
+    """
+    data = bytes(url, 'utf-8')
+    url_hash = moz_hash_string(data[:URL_HASH_MAX_CHARS])
+    scheme_end = data.find(b':', 0, URL_HASH_SCHEME_CHARS)
+    if scheme_end == -1:
+        return url_hash
+    scheme_hash = moz_hash_string(data[:scheme_end]) & 0xffff
+    return (scheme_hash << 32) + url_hash
+
+
+def url_host(url):
+    """Return the lowercased hostname of a URL (or None if it has none)."""
+    if url is None:
+        return None
+    try:
+        return urlsplit(url).hostname
+    except ValueError:
+        return None
+
+
+def normalize_url(url):
+    """Return a URL in a form to compare it with others.
+
+    The scheme and host are lowercased, and an empty path is "/" (like
+    browsers store URLs). Invalid URLs are returned as they are.
+    """
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    # Keep the case of user info
+    user_info, at, host = parts.netloc.rpartition('@')
+    netloc = user_info + at + host.lower()
+    path = parts.path or ('/' if netloc else '')
+    return urlunsplit((parts.scheme.lower(), netloc, path, parts.query,
+                       parts.fragment))
+
+
 def make_parser():
     from firefed.feature import Feature
     parser = argparse.ArgumentParser(
@@ -119,7 +220,8 @@ def make_parser():
     parser.add_argument(
         '-p',
         '--profile',
-        help='profile name or directory to be used when running a feature',
+        help='profile name, directory or archive (zip or tar) to be used '
+        'when running a feature',
     )
     parser.add_argument(
         '-v',
@@ -129,6 +231,19 @@ def make_parser():
         dest='verbosity',
         default=0,
     )
+    parser.add_argument(
+        '-o',
+        '--output',
+        help='write output to a file instead of stdout (compressed if the '
+             'name ends with .gz, .bz2, .xz or .lz4)',
+        metavar='PATH',
+    )
+    parser.add_argument(
+        '--no-cache',
+        help='don\'t use cached outputs of earlier runs on unchanged files',
+        action='store_true',
+        default=False,
+    )
     parser.add_argument(
         '-f',
         '--force',
@@ -161,7 +276,7 @@ class Tabulate:
     maximums = attrib(init=False)
 
     def __attrs_post_init__(self):
-        maxs = [0] * len(self.rows[0])
+        maxs = [0] * len(self.headers)
         for row in chain([self.headers], self.rows):
             for i, column in enumerate(row):
                 maxs[i] = max(maxs[i], len(self.strip_invisible(column)))
@@ -178,8 +293,8 @@ class Tabulate:
         return s + missing * ch
 
     def print_row(self, row, ch=' '):
-        print('  '.join([self.pad(c, self.maximums[i], ch) for i, c in
-                         enumerate(row)]))
+        out('  '.join([self.pad(c, self.maximums[i], ch) for i, c in
+                       enumerate(row)]))
 
     @staticmethod
     def strip_invisible(s):
@@ -10,7 +10,7 @@ from pytest import fixture
 
 from firefed import Session
 from firefed.feature import Feature
-from firefed.util import make_parser
+from firefed.util import make_parser, moz_url_hash
 
 
 def write_data_to(data, path):
@@ -63,17 +63,19 @@ def make_formhistory_sqlite(profile_dir):
 def make_places_sqlite(profile_dir):
     path = Path(profile_dir) / 'places.sqlite'
     con = sqlite3.connect(str(path))
+    con.create_function('hash', 1, moz_url_hash)
     cursor = con.cursor()
     cursor.executescript('''
-    CREATE TABLE moz_places (id, url, title, visit_count, last_visit_date);
-    INSERT INTO moz_places VALUES(1, 'http://one.example/', 'one', 100, 1000000);
-    INSERT INTO moz_places VALUES(2, 'http://two.example/', 'two', 200, 2000000);
-    INSERT INTO moz_places VALUES(3, 'http://three.example/', 'three', 300, 3000000);
+    CREATE TABLE moz_places (id, url, title, visit_count, last_visit_date, url_hash);
+    CREATE INDEX moz_places_url_hashindex ON moz_places (url_hash);
+    INSERT INTO moz_places VALUES(1, 'http://one.example/', 'one', 100, 1000000, hash('http://one.example/'));
+    INSERT INTO moz_places VALUES(2, 'http://two.example/', 'two', 200, 2000000, hash('http://two.example/'));
+    INSERT INTO moz_places VALUES(3, 'http://three.example/', 'three', 300, 3000000, hash('http://three.example/'));
 
-    CREATE TABLE moz_annos (anno_attribute_id, dateAdded, content);
-    INSERT INTO moz_annos VALUES(10, 1000000, 'file:///foo/bar');
-    INSERT INTO moz_annos VALUES(12, 2000000, 'nodownload');
-    INSERT INTO moz_annos VALUES(10, 3000000, 'file:///baz');
+    CREATE TABLE moz_annos (anno_attribute_id, dateAdded, content, place_id);
+    INSERT INTO moz_annos VALUES(10, 1000000, 'file:///foo/bar', 2);
+    INSERT INTO moz_annos VALUES(12, 2000000, 'nodownload', 1);
+    INSERT INTO moz_annos VALUES(10, 3000000, 'file:///baz', 3);
 
     CREATE TABLE moz_hosts (host);
     INSERT INTO moz_hosts VALUES('one.example');
@@ -83,9 +85,10 @@ def make_places_sqlite(profile_dir):
     INSERT INTO moz_inputhistory VALUES('foo');
     INSERT INTO moz_inputhistory VALUES('bar');
 
-    CREATE TABLE moz_historyvisits (id, from_visit, visit_date, place_id);
-    INSERT INTO moz_historyvisits VALUES(1, 2, 1000000, 1);
-    INSERT INTO moz_historyvisits VALUES(2, 0, 1000000, 2);
+    CREATE TABLE moz_historyvisits (id, from_visit, visit_date, place_id, visit_type);
+    INSERT INTO moz_historyvisits VALUES(1, 2, 1000000, 1, 1);
+    INSERT INTO moz_historyvisits VALUES(2, 0, 1000000, 2, 2);
+    INSERT INTO moz_historyvisits VALUES(3, 1, 3000000, 3, 5);
 
     CREATE TABLE moz_bookmarks (id, parent, type, fk, title, guid, dateAdded, lastModified);
     INSERT INTO moz_bookmarks VALUES(1, 0, 2, 0, '', 'root________', 1000000, 11000000);
@@ -103,9 +106,9 @@ def make_cookies_sqlite(profile_dir):
     con = sqlite3.connect(str(path))
     cursor = con.cursor()
     cursor.executescript('''
-    CREATE TABLE moz_cookies (name, value, host, path, isSecure, isHttpOnly, sameSite, expiry);
-    INSERT INTO moz_cookies VALUES('k1', 'v1', 'one.example', '/', 1, 0, 0, 1000);
-    INSERT INTO moz_cookies VALUES('k2', 'v2', 'two.example', '/p2', 0, 1, 1, 449410533679);
+    CREATE TABLE moz_cookies (name, value, host, path, isSecure, isHttpOnly, sameSite, expiry, lastAccessed);
+    INSERT INTO moz_cookies VALUES('k1', 'v1', 'one.example', '/', 1, 0, 0, 1000, 1000000);
+    INSERT INTO moz_cookies VALUES('k2', 'v2', 'two.example', '/p2', 0, 1, 1, 449410533679, 2000000);
     ''')
 
 @profile_file
@@ -137,6 +140,38 @@ def make_sessionstore_jsonlz4(profile_dir):
     with open(path, 'wb') as f:
         f.write(b'mozLz40\0' + compressed)
 
+@profile_file
+def make_bookmark_backups(profile_dir):
+    backup_dir = Path(profile_dir) / 'bookmarkbackups'
+    backup_dir.mkdir()
+    def bookmark(guid, title, uri):
+        return {'guid': guid, 'title': title, 'typeCode': 1, 'uri': uri}
+    backups = {
+        'bookmarks-2018-01-01_2_abc.jsonlz4': [
+            bookmark('guid1', 'one', 'http://one.example/'),
+            bookmark('guid2', 'two', 'http://two.example/'),
+        ],
+        'bookmarks-2018-01-02_3_def.jsonlz4': [
+            bookmark('guid2', 'two', 'http://two.example/'),
+            bookmark('guid3', 'three', 'http://three.example/'),
+        ],
+    }
+    for name, bookmarks in backups.items():
+        data = {
+            'guid': 'root________',
+            'title': '',
+            'typeCode': 2,
+            'children': [{
+                'guid': 'menu________',
+                'title': 'menu',
+                'typeCode': 2,
+                'children': bookmarks,
+            }],
+        }
+        compressed = lz4.block.compress(bytes(json.dumps(data), 'utf-8'))
+        with open(backup_dir / name, 'wb') as f:
+            f.write(b'mozLz40\0' + compressed)
+
 @profile_file
 def make_addon_startup_jsonlz4(profile_dir):
     path = Path(profile_dir) / 'addonStartup.json.lz4'
@@ -271,6 +306,12 @@ def make_prefs_js(profile_dir):
     '''
     write_data_to(data, Path(profile_dir) / 'user.js')
 
+@fixture(autouse=True)
+def cache_home(tmpdir_factory, monkeypatch):
+    path = tmpdir_factory.getbasetemp() / 'cache'
+    monkeypatch.setenv('XDG_CACHE_HOME', str(path))
+    return path
+
 @fixture
 def parser():
     return make_parser()
@@ -1,3 +1,4 @@
+import gzip
 import os
 import re
 import sys
@@ -53,6 +54,30 @@ class TestMain:
             firefed.__main__.main()
         assert 'Profile created' in stdout()
 
+    def test_output(self, mock_profile, tmpdir, stdout):
+        path = str(tmpdir / 'hosts.txt.gz')
+        argv = ['firefed', '--profile', str(mock_profile), '--output', path,
+                'hosts']
+        with mock.patch.object(sys, 'argv', argv):
+            firefed.__main__.main()
+        assert stdout() == ''
+        with gzip.open(path, 'rt') as f:
+            assert f.read() == 'one.example\ntwo.example\n'
+
+    def test_standalone_feature(self, mock_profile, stdout):
+        argv = ['firefed', '--profile', '/nonexistent', 'diff',
+                str(mock_profile), str(mock_profile), 'cookies']
+        with mock.patch.object(sys, 'argv', argv):
+            firefed.__main__.run()
+        assert stdout() == '0 added, 0 removed, 0 changed.\n'
+
+    def test_bad_output(self, mock_profile, tmpdir):
+        argv = ['firefed', '--profile', str(mock_profile), '--output',
+                str(tmpdir / 'nonexistent/out.txt'), 'hosts']
+        with mock.patch.object(sys, 'argv', argv):
+            with pytest.raises(FatalError, match='output file'):
+                firefed.__main__.run()
+
     # TODO This may only fail in a 3.7 alpha. Need to revisit.
     @pytest.mark.xfail(sys.version_info >= (3, 7), reason='API change')
     def test_show_profiles(self, stdout, monkeypatch, mock_home):
@@ -0,0 +1,152 @@
+import os
+from pathlib import Path
+import sqlite3
+import tarfile
+import zipfile
+
+import pytest
+
+from firefed import Session, archive
+from firefed.archive import Archive, ArchivePath
+from firefed.feature import (BookmarkBackups, Cookies, History, Logins,
+                             Preferences, Query)
+from firefed.util import FatalError, profile_dir
+
+
+ROOT = 'home/user/.mozilla/firefox/x.default'
+
+
+def make_archive(path, files):
+    """Write files (archive names -> local paths) to a zip or tar archive."""
+    if path.suffix == '.zip':
+        with zipfile.ZipFile(str(path), 'w') as f:
+            for name, local in files.items():
+                f.write(str(local), name)
+    else:
+        with tarfile.open(str(path), 'w:gz') as f:
+            for name, local in files.items():
+                f.add(str(local), name)
+    return path
+
+
+def profile_files(profile, root):
+    return {'%s/%s' % (root, p.relative_to(profile).as_posix()): p
+            for p in Path(str(profile)).rglob('*') if p.is_file()}
+
+
+@pytest.fixture(params=['zip', 'tar.gz'])
+def archive_file(request, mock_profile, tmpdir):
+    return make_archive(Path(str(tmpdir)) / ('profile.%s' % request.param),
+                        profile_files(mock_profile, ROOT))
+
+
+@pytest.fixture
+def archive_session(archive_file):
+    return Session(profile_dir(str(archive_file)))
+
+
+def make_wal_db(path):
+    """Create a database in WAL mode whose rows are only in the WAL.
+
+    Return the connection, which needs to stay open to keep the WAL.
+    """
+    con = sqlite3.connect(str(path))
+    con.execute('PRAGMA journal_mode = WAL')
+    con.execute('PRAGMA wal_autocheckpoint = 0')
+    con.execute('CREATE TABLE t (x)')
+    con.executemany('INSERT INTO t VALUES (?)', [(1,), (2,)])
+    con.commit()
+    return con
+
+
+class TestArchive:
+
+    def test_profile_dir(self, archive_file):
+        profile = profile_dir(str(archive_file))
+        assert isinstance(profile, ArchivePath)
+        assert profile.member == ROOT
+        assert profile == profile_dir(str(archive_file / ROOT))
+        assert (profile / 'times.json').is_file()
+        assert str(profile) == str(archive_file / ROOT)
+
+    def test_profile_dir_missing(self, archive_file):
+        with pytest.raises(FatalError, match='not found in archive'):
+            profile_dir(str(archive_file / 'nonexistent'))
+
+    def test_several_profiles(self, mock_profile, tmpdir):
+        files = profile_files(mock_profile, 'a')
+        files.update(profile_files(mock_profile, 'b'))
+        path = make_archive(Path(str(tmpdir)) / 'profiles.zip', files)
+        with pytest.raises(FatalError, match='several profiles: a, b'):
+            profile_dir(str(path))
+        assert profile_dir(str(path / 'b')).member == 'b'
+
+    def test_features(self, archive_session, mock_session, capsys):
+        for feature in [History, Cookies, BookmarkBackups, Preferences]:
+            feature(mock_session)()
+            expected, _ = capsys.readouterr()
+            feature(archive_session)()
+            actual, _ = capsys.readouterr()
+            assert actual == expected
+
+    def test_query(self, archive_session, capsys):
+        Query(archive_session, format='csv',
+              sql='SELECT COUNT(*) FROM places.moz_places')()
+        out, _ = capsys.readouterr()
+        assert out.split() == ['COUNT(*)', '3']
+
+    def test_needs_directory(self, archive_session):
+        with pytest.raises(FatalError, match='needs a profile directory'):
+            Logins(archive_session)()
+
+    def test_path(self, archive_session):
+        profile = archive_session.profile
+        assert profile.is_dir() and not profile.is_file()
+        path = profile / 'places.sqlite'
+        assert path.is_file() and path.name == 'places.sqlite'
+        assert path.stat().st_size == len(path.read_bytes())
+        assert [p.name for p in profile.glob('*.json')] == [
+            'addons.json', 'extensions.json', 'logins.json',
+            'test_json.json', 'times.json']
+        with pytest.raises(FileNotFoundError):
+            (profile / 'nonexistent').open()
+        with pytest.raises(ValueError):
+            path.open('wb')
+
+    @pytest.mark.parametrize('suffix', ['zip', 'tar'])
+    def test_wal(self, suffix, tmpdir):
+        db = Path(str(tmpdir)) / 'wal.sqlite'
+        con = make_wal_db(db)
+        path = make_archive(Path(str(tmpdir)) / ('wal.%s' % suffix), {
+            'wal.sqlite': db,
+            'wal.sqlite-wal': Path('%s-wal' % db),
+        })
+        con.close()
+        # The WAL was checkpointed on close
+        path_checkpointed = make_archive(
+            Path(str(tmpdir)) / ('checkpointed.%s' % suffix),
+            {'wal.sqlite': db})
+        for path_ in [path, path_checkpointed]:
+            con = archive.connect(ArchivePath(Archive(path_), 'wal.sqlite'))
+            assert con.execute('SELECT x FROM t').fetchall() == [(1,), (2,)]
+
+    def test_spill(self, archive_session, monkeypatch):
+        monkeypatch.setattr(archive, 'DESERIALIZE_MAX_SIZE', 0)
+        path = archive_session.profile / 'places.sqlite'
+        con = archive.connect(path)
+        assert con.execute('SELECT COUNT(*) FROM moz_places').fetchone() == \
+            (3,)
+        spilled = path.archive.spilled(path.member)
+        assert spilled.read_bytes() == path.read_bytes()
+        # Spilled only once
+        assert path.archive.spilled(path.member) == spilled
+        assert str(spilled).startswith(archive.SPILL_DIRS[0]) or \
+            not os.path.isdir(archive.SPILL_DIRS[0])
+
+
+def test_not_an_archive(tmpdir):
+    path = tmpdir / 'file'
+    path.write('foo')
+    assert archive.archive_profile(Path(str(path))) is None
+    assert archive.archive_profile(Path(str(path / 'foo'))) is None
+    assert not archive.is_archive(Path(str(tmpdir)))
@@ -0,0 +1,127 @@
+import os
+from pathlib import Path
+import shutil
+import sqlite3
+import sys
+from unittest import mock
+
+import pytest
+
+from firefed import Session, cache
+from firefed.feature import Cookies, History, Hosts, Query, Timeline
+from firefed.util import FatalError, cache_dir
+import firefed.__main__
+
+
+def entries():
+    return sorted(p.name for p in cache_dir('results').iterdir())
+
+
+@pytest.fixture
+def profile(mock_profile, tmpdir):
+    path = Path(str(tmpdir)) / 'profile'
+    shutil.copytree(str(mock_profile), str(path))
+    return path
+
+
+@pytest.fixture
+def session(profile, cache_home):
+    shutil.rmtree(str(cache_home / 'firefed/results'), ignore_errors=True)
+    return Session(profile, cache=True)
+
+
+class TestCache:
+
+    def test_replay(self, session, stdout, monkeypatch):
+        History(session, format='csv')()
+        expected = stdout()
+        assert len(entries()) == 1
+
+        def fail(self):
+            raise AssertionError('Feature was executed')
+        monkeypatch.setattr(History, 'prepare', fail)
+        History(session, format='csv')()
+        assert stdout() == expected
+        with pytest.raises(AssertionError, match='executed'):
+            History(session, format='list')()
+
+    def test_source_changed(self, session, profile, stdout):
+        Hosts(session)()
+        assert stdout() == 'one.example\ntwo.example\n'
+        con = sqlite3.connect(str(profile / 'places.sqlite'))
+        with con:
+            con.execute('DELETE FROM moz_hosts WHERE host = ?',
+                        ('two.example',))
+        con.close()
+        Hosts(session)()
+        assert stdout() == 'one.example\n'
+        assert len(entries()) == 2
+
+    def test_timeline_source_changed(self, session, profile, stdout):
+        # Timeline's -S/--sources argument doesn't replace its source files
+        Timeline(session, sources=['form-first-use'], format='csv')()
+        assert len(stdout().splitlines()) == 3
+        con = sqlite3.connect(str(profile / 'formhistory.sqlite'))
+        with con:
+            con.execute('INSERT INTO moz_formhistory VALUES (8, ?, ?, 1, '
+                        '1500000000000000, 1500000000000000, ?)',
+                        ('eee', 'fff', 'guid3'))
+        con.close()
+        Timeline(session, sources=['form-first-use'], format='csv')()
+        assert 'eee=fff' in stdout()
+
+    def test_url_file_changed(self, session, tmpdir, stdout):
+        url_file = tmpdir.join('urls.txt')
+        url_file.write('http://one.example/\n')
+        History(session, lookup_file=str(url_file), format='csv')()
+        assert 'http://one.example/' in stdout()
+        url_file.write('http://two.example/\n')
+        History(session, lookup_file=str(url_file), format='csv')()
+        output = stdout()
+        assert 'http://two.example/' in output
+        assert 'http://one.example/' not in output
+
+    def test_source_paths(self, session, profile):
+        paths = Cookies(session, session_file='foo.jsonlz4').source_paths()
+        assert paths[0] == profile / 'cookies.sqlite'
+        assert paths[1] == profile / 'cookies.sqlite-wal'
+        assert paths[-1] == profile / 'foo.jsonlz4'
+        assert cache.fingerprint(paths[1]) is None
+
+    def test_disabled(self, profile, session, stdout):
+        Hosts(Session(profile))()
+        assert entries() == []
+
+    def test_query_not_cached(self, session, stdout):
+        Query(session, sql='SELECT random()', format='csv')()
+        first = stdout()
+        Query(session, sql='SELECT random()', format='csv')()
+        assert stdout() != first
+        assert entries() == []
+
+    def test_failure(self, session):
+        with pytest.raises(FatalError):
+            History(session, format='csv', fields=['nonexistent'])()
+        with mock.patch.object(History, 'prepare', side_effect=ValueError):
+            with pytest.raises(ValueError):
+                History(session)()
+        assert entries() == []
+
+    def test_prune(self, session, stdout):
+        for feature in [Hosts, History]:
+            feature(session)()
+        oldest, newest = sorted(cache_dir('results').iterdir(),
+                                key=lambda p: p.stat().st_mtime)
+        os.utime(str(oldest), (0, 0))
+        cache.prune(newest.stat().st_size)
+        assert entries() == [newest.name]
+
+    def test_no_cache(self, profile, session, stdout):
+        argv = ['firefed', '--profile', str(profile), '--no-cache', 'hosts']
+        with mock.patch.object(sys, 'argv', argv):
+            firefed.__main__.main()
+        assert entries() == []
+        with mock.patch.object(sys, 'argv', [a for a in argv
+                                             if a != '--no-cache']):
+            firefed.__main__.main()
+        assert len(entries()) == 1
@@ -1,26 +1,42 @@
 import csv
+import gzip
+import hashlib
+import json
 import os
 import re
+import shutil
+import sqlite3
 import subprocess
 import time
+import zipfile
 from datetime import datetime
 from io import StringIO
 from pathlib import Path
 from socket import AF_INET, SO_REUSEADDR, SOCK_STREAM, SOL_SOCKET, socket
 from textwrap import dedent
+from unittest import mock
 
 import attr
 import pytest
+import requests
 from attr import attrs
 from firefed import Session
-from firefed.feature import (Addons, Bookmarks, Cookies, Downloads, Feature,
-                             Forms, History, Hosts, Infect, InputHistory,
-                             Logins, Permissions, Preferences, Summary, Visits,
-                             arg, formatter)
+from firefed.feature import (Addons, BookmarkBackups, Bookmarks, Collect,
+                             Compliance, Cookies, Diff, Downloads, ExportDb,
+                             Feature, Forms, Hashes, History, Hosts, Infect,
+                             InputHistory, Ioc, Logins, Permissions,
+                             Preferences, Query, Search, Summary, Timeline,
+                             Visits, arg, formatter)
 from firefed.feature.cookies import Cookie, session_file_type
-from firefed.feature.feature import NotMozLz4Error
-from firefed.feature.preferences import Preference
-from firefed.util import FatalError
+from firefed.feature.feature import Aggregation, NotMozLz4Error, Page
+from firefed.feature.ioc import AhoCorasick, Indicators
+from firefed.feature.logins import HashFile
+from firefed.feature.permissions import Permission
+from firefed.feature.preferences import (USERJS_TIMEOUT, Preference,
+                                         PrefsParser, fetch_userjs)
+from firefed.feature.visits import TypedVisit
+from firefed.output import bad, good, okay
+from firefed.util import FatalError, cache_dir
 from pytest import mark
 
 
@@ -62,6 +78,13 @@ class TestFeature:
         assert not has_run
         assert has_summarized
 
+    def test_records_required(self):
+        Record = attr.make_class('Record', ['x'])
+        with pytest.raises(TypeError, match='override records'):
+            @attrs
+            class SomeFeature(Feature):
+                record_cls = Record
+
     def test_prepare(self, mock_session):
         has_prepared = has_run = False
         @attrs
@@ -93,6 +116,37 @@ class TestFeature:
             my_foo = arg('-f', '--foo', default=2)
         assert SomeFeature(mock_session).my_foo == 2
 
+    def test_positional_arguments(self, mock_session, MockFeature):
+        @attrs
+        class SomeFeature(MockFeature):
+            my_pos = arg('pos', nargs='?')
+        assert SomeFeature(mock_session).my_pos is None
+        assert list(SomeFeature.cli_args()) == \
+            [(('my_pos',), {'nargs': '?', 'metavar': 'pos'})]
+
+    def test_time_window(self, mock_session, MockFeature):
+        @attrs
+        class SomeFeature(MockFeature):
+            time_aware = True
+        feature = SomeFeature(mock_session)
+        assert feature.time_window('c') == (None, [])
+        feature = SomeFeature(mock_session, since=1, until=2)
+        assert feature.time_window('c') == ('c >= ? AND c < ?',
+                                            [1000000, 2000000])
+        assert feature.time_window('c', unit=1000) == \
+            ('c >= ? AND c < ?', [1000, 2000])
+        assert SomeFeature(mock_session, until=2).time_window('c') == \
+            ('c < ?', [2000000])
+        args = {a[0][0] for a in SomeFeature.cli_args()}
+        assert {'--since', '--until'} <= args
+        assert '--since' not in {a[0][0] for a in MockFeature.cli_args()}
+
+    def test_time_window_cli(self, parser):
+        args = parser.parse_args(['visits', '--since', '1', '--until',
+                                  '2018-01-01'])
+        assert args.since == 1
+        assert args.until == datetime(2018, 1, 1).timestamp()
+
     def test_wrong_argument(self, mock_session, MockFeature):
         with pytest.raises(TypeError):
             MockFeature(unknown_argument=1)
@@ -156,16 +210,200 @@ class TestFeature:
         assert not F1.summarizable()
         assert F2.summarizable()
 
-    def test_all_csvs(self, mock_session, stdout):
+    def test_all_csvs(self, mock_session, tmpdir, stdout):
         """All features with a CSV formatter should be CSV-parseable."""
+        indicators = tmpdir / 'iocs.txt'
+        indicators.write('one.example\n')
+        recommended = tmpdir / 'user.js'
+        recommended.write('user_pref("baz", 456);\n')
+        feature_kwargs = {
+            Compliance: {'profiles': [str(mock_session.profile)],
+                         'recommended_source': str(recommended)},
+            Ioc: {'indicator_file': str(indicators)},
+            Logins: {'password': 'master'},
+            Search: {'term': 'example'},
+            Query: {'sql': 'SELECT 1'},
+        }
         for Feature_ in Feature.feature_map().values():
             if 'csv' in Feature_.formatters():
-                kwargs = {'password': 'master'} if Feature_ is Logins else {}
+                kwargs = feature_kwargs.get(Feature_, {})
                 Feature_(mock_session, format='csv', **kwargs)()
                 res = parse_csv(stdout())
                 assert len(set(len(row) for row in res)) == 1
 
 
+class TestFields:
+
+    def test_csv(self, mock_session, stdout):
+        History(mock_session, format='csv', fields=['visit_count', 'url'])()
+        data = parse_csv(stdout())
+        assert data[0] == ['visit_count', 'url']
+        assert ['200', 'http://two.example/'] in data
+
+    def test_jsonl(self, mock_session, stdout):
+        Visits(mock_session, format='jsonl', fields=['id', 'url'])()
+        records = [json.loads(l) for l in stdout().splitlines()]
+        assert records[0] == {'id': 1, 'url': 'http://one.example/'}
+        assert len(records) == 3
+
+    def test_table(self, mock_session, stdout):
+        Permissions(mock_session, format='table', fields=['permission'])()
+        lines = stdout().split('\n')
+        assert lines[0].strip() == 'Permission'
+        assert 'https://two.example/' not in stdout()
+
+    def test_cookies(self, mock_session, stdout):
+        feature = Cookies(mock_session, want_all_sources=True, format='csv',
+                          fields=['host'], host='two.*')
+        feature()
+        assert parse_csv(stdout()) == [['host'], ['two.example'],
+                                       ['two.example']]
+
+    def test_cookies_all_sources(self, mock_session, stdout):
+        # Distinct cookies of the same host are all kept
+        Cookies(mock_session, want_all_sources=True, format='csv',
+                fields=['host'])()
+        assert sorted(parse_csv(stdout())[1:]) == [
+            ['one.example'], ['one.example'], ['two.example'],
+            ['two.example']]
+        Cookies(mock_session, want_all_sources=True, format='csv',
+                fields=['host'], limit=3)()
+        assert len(parse_csv(stdout())) == 4
+
+    def test_unknown_field(self, mock_session):
+        with pytest.raises(FatalError, match='Unknown field'):
+            History(mock_session, format='csv', fields=['nonexistent'])()
+
+    def test_unsupported_format(self, mock_session):
+        with pytest.raises(FatalError, match='requires one of the formats'):
+            History(mock_session, format='list', fields=['url'])()
+
+    def test_cli(self, parser):
+        args = parser.parse_args(['history', '--fields', 'url,title'])
+        assert args.fields == ['url', 'title']
+        with pytest.raises(SystemExit):
+            parser.parse_args(['hosts', '--fields', 'host'])
+
+
+class TestAggregation:
+
+    def test_group_by(self, mock_session, stdout):
+        Visits(mock_session, format='csv', group_by='visit_date')()
+        assert parse_csv(stdout()) == [['visit_date', 'count'], ['1', '2'],
+                                       ['3', '1']]
+
+    def test_virtual_key(self, mock_session, stdout):
+        History(mock_session, format='csv', group_by='host', top=2)()
+        assert parse_csv(stdout()) == [['host', 'count'],
+                                       ['one.example', '1'],
+                                       ['three.example', '1']]
+
+    def test_count(self, mock_session, stdout):
+        Downloads(mock_session, format='jsonl', count=True)()
+        assert json.loads(stdout()) == {'count': 2}
+
+    def test_table(self, mock_session, stdout):
+        Forms(mock_session, group_by='fieldname')()
+        lines = stdout().split('\n')
+        assert lines[0].split() == ['Fieldname', 'Count']
+        assert ['aaa', '1'] in (line.split() for line in lines)
+
+    def test_fallback(self, mock_session, stdout):
+        feature = Cookies(mock_session, want_all_sources=True, format='csv',
+                          group_by='host')
+        feature()
+        sql_feature = Cookies(mock_session, format='csv', group_by='host')
+        sql_feature()
+        assert parse_csv(stdout()) == [
+            ['host', 'count'], ['one.example', '2'], ['two.example', '2'],
+            ['host', 'count'], ['one.example', '1'], ['two.example', '1'],
+        ]
+
+    def test_apply(self):
+        aggregation = Aggregation(Cookie, 'host', 'host', top=2)
+        cookies = [Cookie('k', 'v', host) for host in 'abcbcc'] + \
+            [Cookie('k', 'v', None)] * 2
+        groups = list(aggregation.apply(cookies))
+        assert [(g.host, g.count) for g in groups] == [('c', 3), (None, 2)]
+        total, = Aggregation(Cookie).apply(iter(cookies))
+        assert total.count == 8
+
+    def test_invalid(self, mock_session, parser):
+        with pytest.raises(FatalError, match='requires --group-by'):
+            History(mock_session, top=3)()
+        with pytest.raises(FatalError, match='aggregating'):
+            History(mock_session, format='csv', fields=['url'], count=True)()
+        with pytest.raises(FatalError, match='lookups'):
+            History(mock_session, lookup_urls=['x'], count=True)()
+        with pytest.raises(SystemExit):
+            parser.parse_args(['cookies', '--group-by', 'url'])
+        args = parser.parse_args(['visits', '--group-by', 'host', '--top',
+                                  '5'])
+        assert (args.group_by, args.top) == ('host', 5)
+
+
+class TestPaging:
+
+    def test_limit_offset(self, mock_session, stdout):
+        History(mock_session, format='short', limit=1, offset=1)()
+        assert stdout() == 'http://two.example/\n'
+        Permissions(mock_session, format='csv', offset=2)()
+        assert parse_csv(stdout())[1:] == [['https://three.example/',
+                                            'permission3']]
+
+    def test_latest(self, mock_session, stdout):
+        Visits(mock_session, format='csv', fields=['id'], latest=2)()
+        assert parse_csv(stdout()) == [['id'], ['2'], ['3']]
+        Downloads(mock_session, latest=1)()
+        assert stdout().strip().endswith('file:///baz')
+
+    def test_cookies(self, mock_session):
+        feature = Cookies(mock_session, want_all_sources=True, limit=3)
+        feature()
+        assert len(feature.cookies) == 3
+        feature = Cookies(mock_session, latest=5)
+        feature()
+        assert {c.name for c in feature.cookies} == {'k1', 'k2'}
+        with pytest.raises(FatalError, match='no timestamps'):
+            Cookies(mock_session, want_all_sources=True, latest=5)()
+
+    def test_addons(self, mock_session, stdout):
+        ids = [a.id for a in Addons(mock_session).load_addons()]
+        feature = Addons(mock_session, show_all=True, offset=1, limit=1)
+        feature()
+        assert [a.id for a in feature.addons] == ids[1:2]
+
+    def test_timeline(self, mock_session, stdout):
+        Timeline(mock_session, format='csv')()
+        events = parse_csv(stdout())[1:]
+        Timeline(mock_session, format='csv', offset=2, limit=3)()
+        assert parse_csv(stdout())[1:] == events[2:5]
+        Timeline(mock_session, format='csv', latest=3)()
+        assert parse_csv(stdout())[1:] == events[-3:]
+
+    def test_page(self):
+        assert list(Page(limit=2, offset=1).apply(iter(range(5)))) == [1, 2]
+        assert list(Page(offset=3).apply(iter(range(5)))) == [3, 4]
+        assert list(Page(limit=2, latest=True).apply(iter(range(5)))) == \
+            [3, 4]
+        with pytest.raises(ValueError):
+            Page(limit=2, latest=True).sql(None)
+
+    def test_invalid(self, mock_session):
+        with pytest.raises(FatalError, match='combined'):
+            Visits(mock_session, latest=2, limit=1)()
+        with pytest.raises(FatalError, match='negative'):
+            Visits(mock_session, limit=-1)()
+        with pytest.raises(FatalError, match='paged'):
+            Visits(mock_session, group_by='url', limit=1)()
+
+    def test_cli(self, parser):
+        args = parser.parse_args(['visits', '--latest', '20'])
+        assert args.latest == 20
+        with pytest.raises(SystemExit):
+            parser.parse_args(['permissions', '--latest', '20'])
+
+
 class TestFeatureHelpers:
 
     def test_profile_path(self, MockFeature):
@@ -198,6 +436,25 @@ class TestFeatureHelpers:
         )
         assert Foo(obj_c1='r1v1', c2='r1v2') in foos
 
+    def test_load_sqlite_where(self, mock_feature):
+        Foo = attr.make_class('Foo', ['c1', 'c2'])
+        foos = list(mock_feature.load_sqlite(
+            'test_sqlite.sqlite',
+            table='t1',
+            cls=Foo,
+            where='c1 = ?',
+            params=['r2v1'],
+        ))
+        assert foos == [Foo(c1='r2v1', c2='r2v2')]
+        foos = list(mock_feature.load_sqlite(
+            'test_sqlite.sqlite',
+            query='SELECT c2 AS c1, c1 AS c2 FROM t1',
+            cls=Foo,
+            where='c1 = ?',
+            params=['r2v2'],
+        ))
+        assert foos == [Foo(c1='r2v2', c2='r2v1')]
+
     def test_load_sqlite_missing_file(self, mock_feature):
         Foo = attr.make_class('Foo', ['c1', 'c2'])
         with pytest.raises(FileNotFoundError):
@@ -243,6 +500,53 @@ class TestSmallFeatures:
         assert 'ccc=ddd' in stdout().split('\n')
 
 
+class TestTimeWindows:
+
+    def test_history(self, mock_session, stdout):
+        History(mock_session, format='short', since=2, until=3)()
+        assert stdout() == 'http://two.example/\n'
+
+    def test_visits(self, mock_session, stdout):
+        Visits(mock_session, format='csv', since=2)()
+        assert [r[0] for r in parse_csv(stdout())] == ['id', '3']
+
+    def test_downloads(self, mock_session, stdout):
+        Downloads(mock_session, until=2)()
+        assert stdout().strip().endswith('file:///foo/bar')
+
+    def test_bookmarks(self, mock_session, stdout):
+        Bookmarks(mock_session, format='list', since=5)()
+        assert stdout().split('\n')[:2] == ['bookmark in level2',
+                                            '    http://two.example/']
+        Bookmarks(mock_session, format='tree', until=3)()
+        out = stdout()
+        assert 'level2' in out
+        assert 'bookmark in rootfolder' in out
+        assert 'bookmark in level2' not in out
+
+    def test_forms(self, mock_session, stdout):
+        Forms(mock_session, since=1500000000)()
+        assert stdout() == 'ccc=ddd\n'
+
+    def test_cookies(self, mock_session, stdout):
+        Cookies(mock_session, format='setcookie', since=2)()
+        assert stdout().startswith('k2=v2')
+        with pytest.raises(FatalError, match='no timestamps'):
+            Cookies(mock_session, format='setcookie', since=2,
+                    want_all_sources=True)()
+        with pytest.raises(FatalError, match='no timestamps'):
+            Cookies(mock_session, until=2, session_file='recovery')()
+
+    def test_timeline(self, mock_session, stdout):
+        Timeline(mock_session, format='csv', since=2, until=1461787590)()
+        data = parse_csv(stdout())[1:]
+        dates = [int(row[0]) for row in data]
+        assert min(dates) == 2
+        assert max(dates) == 1461787589
+        assert ['1461787589', 'permission', 'http://one.example/ '
+                'permission1'] in data
+
+
 class TestPermissionsFeature:
 
     def test_table(self, mock_session, stdout):
@@ -279,6 +583,37 @@ class TestHistoryFeature:
         History(mock_session, format='short')()
         assert 'http://one.example/' in stdout().split('\n')
 
+    def test_lookup(self, mock_session, stdout, tmpdir):
+        url_file = tmpdir.join('urls.txt')
+        url_file.write('http://two.example/\nhttp://unknown.example/\n')
+        History(mock_session, lookup_urls=['http://one.example/'],
+                lookup_file=str(url_file), format='csv')()
+        data = parse_csv(stdout())
+        assert data == [
+            ['url', 'visit_count', 'visit_dates'],
+            ['http://one.example/', '100', '1'],
+            ['http://two.example/', '200', '1'],
+            ['http://unknown.example/', '0', ''],
+        ]
+        History(mock_session, lookup_urls=['http://unknown.example/'])()
+        assert '(not visited)' in stdout()
+        History(mock_session, lookup_urls=['http://one.example/'],
+                summary=True)()
+        assert stdout() == '1 of 1 URLs visited.\n'
+
+    def test_lookup_without_url_hash(self, tmpdir, stdout):
+        con = sqlite3.connect(str(tmpdir / 'places.sqlite'))
+        con.executescript('''
+        CREATE TABLE moz_places (id, url, visit_count);
+        CREATE TABLE moz_historyvisits (place_id, visit_date);
+        INSERT INTO moz_places VALUES(1, 'http://a.example/', 1);
+        INSERT INTO moz_historyvisits VALUES(1, 5000000);
+        ''')
+        con.close()
+        History(Session(tmpdir), lookup_urls=['http://a.example/'],
+                format='csv')()
+        assert ['http://a.example/', '1', '5'] in parse_csv(stdout())
+
 
 class TestVisitsFeature:
 
@@ -293,6 +628,50 @@ class TestVisitsFeature:
         assert data[0] == ['id', 'from_visit', 'visit_date', 'url']
         assert data[1] == ['1', '2', '1', 'http://one.example/']
 
+    def test_chains(self, mock_session, stdout):
+        Visits(mock_session, format='chains')()
+        lines = stdout().split('\n')
+        assert lines[0] == '%s http://three.example/' % \
+            datetime.fromtimestamp(3)
+        assert [l.split(' [', 1)[1] for l in lines[1:4]] == [
+            'typed] http://two.example/',
+            'link] http://one.example/',
+            'redirect (permanent)] http://three.example/',
+        ]
+
+    def test_chains_cycle_and_depth(self, mock_session):
+        feature = Visits(mock_session, format='chains', max_depth=3)
+        feature.visits = [
+            TypedVisit(1, 2, 0, 'a', 1),
+            TypedVisit(2, 1, 0, 'b', 1),
+            TypedVisit(3, 2, 0, 'c', 1),
+            TypedVisit(4, 3, 0, 'd', 1),
+        ]
+        chains = [[v.id for v in c] for c in feature.chains()]
+        assert chains == [[2, 3, 4]]
+        feature.max_depth = 10
+        chains = [[v.id for v in c] for c in feature.chains()]
+        assert chains == [[1, 2, 3, 4]]
+
+    def test_chains_shared_referrers(self, mock_session):
+        feature = Visits(mock_session, format='chains', max_depth=3)
+        feature.visits = [
+            TypedVisit(1, 0, 0, 'a', 1),
+            TypedVisit(2, 1, 0, 'b', 1),
+            TypedVisit(3, 2, 0, 'c', 1),
+            TypedVisit(4, 2, 0, 'd', 1),
+            TypedVisit(5, 1, 0, 'e', 1),
+            TypedVisit(6, 7, 0, 'f', 1),
+            TypedVisit(7, 6, 0, 'g', 1),
+            TypedVisit(8, 7, 0, 'h', 1),
+            TypedVisit(9, 6, 0, 'i', 1),
+        ]
+        chains = [[v.id for v in c] for c in feature.chains()]
+        assert chains == [[1, 2, 3], [1, 2, 4], [1, 5], [6, 7, 8], [7, 6, 9]]
+        feature.max_depth = 2
+        chains = [[v.id for v in c] for c in feature.chains()]
+        assert chains == [[2, 3], [2, 4], [1, 5], [7, 8], [6, 9]]
+
 
 class TestCookiesFeature:
 
@@ -352,12 +731,65 @@ class TestBookmarksFeature:
 
         Bookmarks(mock_session, format='csv')()
         data = parse_csv(stdout())
-        assert ['bookmark in level2', 'http://two.example/', '5', '55'] in data
+        assert ['bookmark in level2', 'http://two.example/', '5', '55',
+                'rootfolder/level2'] in data
 
         Bookmarks(mock_session, format='tree')()
         assert 'http://one.example' in stdout()
         # TODO Tests could be improved, esp. for tree output
 
+    def test_tree(self, mock_session):
+        feature = Bookmarks(mock_session)
+        feature.prepare()
+        tree = feature.bmarks
+        assert [n.id for n in tree.roots] == [1]
+        assert [n.title for n in tree.top_level] == ['rootfolder']
+        assert [(d, n.id) for d, n in tree.walk(tree.top_level)] == \
+            [(0, 2), (1, 3), (1, 4), (2, 5), (2, 6)]
+        assert tree.nodes[2].path == ''
+        assert tree.nodes[3].path == 'rootfolder'
+        assert tree.nodes[6].path == 'rootfolder/level2'
+
+    def test_json(self, mock_session, stdout):
+        Bookmarks(mock_session, format='json')()
+        data = json.loads(stdout())
+        assert len(data) == 1
+        folder = data[0]
+        assert (folder['type'], folder['title']) == ('folder', 'rootfolder')
+        assert [c['title'] for c in folder['children']] == \
+            ['bookmark in rootfolder', 'level2']
+        level2 = folder['children'][1]
+        assert level2['children'][0]['url'] == 'http://two.example/'
+        assert len(level2['children']) == 2
+
+
+class TestBookmarkBackupsFeature:
+
+    def test_list(self, mock_session, stdout):
+        BookmarkBackups(mock_session)()
+        lines = stdout().split('\n')
+        assert '2018-01-01 (bookmarks-2018-01-01_2_abc.jsonlz4): 4 entries' \
+            in lines
+        assert '    + [bookmark] three' in lines
+        assert '    - [bookmark] one' in lines
+        assert '    - [bookmark] two' not in lines
+
+    def test_csv(self, mock_session, stdout):
+        BookmarkBackups(mock_session, format='csv')()
+        data = parse_csv(stdout())
+        assert data[0] == ['backup', 'date', 'change', 'guid', 'type',
+                           'title', 'url']
+        assert data[1:] == [
+            ['bookmarks-2018-01-02_3_def.jsonlz4', '2018-01-02', 'added',
+             'guid3', 'bookmark', 'three', 'http://three.example/'],
+            ['bookmarks-2018-01-02_3_def.jsonlz4', '2018-01-02', 'removed',
+             'guid1', 'bookmark', 'one', 'http://one.example/'],
+        ]
+
+    def test_summary(self, mock_session, stdout):
+        BookmarkBackups(mock_session, summary=True)()
+        assert stdout() == '2 bookmark backups found.\n'
+
 
 class TestAddonsFeature:
 
@@ -381,6 +813,131 @@ class TestAddonsFeature:
         Addons(mock_session, format='short')()
         assert 'foo@bar \'fooextension\'' in stdout()
 
+    @pytest.fixture
+    def manifest_session(self, mock_profile, tmpdir):
+        profile = Path(str(tmpdir)) / 'profile'
+        shutil.copytree(str(mock_profile), str(profile))
+        extensions = profile / 'extensions'
+        extensions.mkdir(exist_ok=True)
+        with zipfile.ZipFile(str(extensions / 'bar'), 'w',
+                             zipfile.ZIP_DEFLATED) as xpi:
+            xpi.writestr('manifest.json', json.dumps({
+                'manifest_version': 2,
+                'permissions': ['tabs', '<all_urls>', 'https://*.example/*'],
+                'optional_permissions': ['history', '*://a.example/*'],
+                'content_scripts': [{'matches': ['*://*/*'], 'js': ['a.js']}],
+            }))
+            xpi.writestr('large.js', '0' * 100000)
+        (extensions / 'baz').mkdir()
+        (extensions / 'baz' / 'manifest.json').write_text(json.dumps({
+            'manifest_version': 3,
+            'permissions': ['storage'],
+            'host_permissions': ['https://b.example/*'],
+        }))
+        return Session(profile)
+
+    def test_manifests(self, manifest_session, stdout):
+        Addons(manifest_session, inspect_manifests=True, format='jsonl',
+               fields=['id', 'manifest_version', 'permissions',
+                       'optional_permissions', 'host_permissions',
+                       'content_scripts'])()
+        addons = [json.loads(l) for l in stdout().splitlines()]
+        assert addons == [{
+            'id': 'foo@bar',
+            'manifest_version': 2,
+            'permissions': ['tabs'],
+            'optional_permissions': ['history'],
+            'host_permissions': ['<all_urls>', 'https://*.example/*',
+                                 '*://a.example/*'],
+            'content_scripts': ['*://*/*'],
+        }, {
+            'id': '3@three',
+            'manifest_version': None,
+            'permissions': None,
+            'optional_permissions': None,
+            'host_permissions': None,
+            'content_scripts': None,
+        }, {
+            'id': 'bar@baz',
+            'manifest_version': 3,
+            'permissions': ['storage'],
+            'optional_permissions': [],
+            'host_permissions': ['https://b.example/*'],
+            'content_scripts': [],
+        }]
+
+    def test_manifests_csv(self, manifest_session, stdout):
+        Addons(manifest_session, inspect_manifests=True, format='csv',
+               fields=['id', 'permissions', 'host_permissions',
+                       'content_scripts'])()
+        assert parse_csv(stdout()) == [
+            ['id', 'permissions', 'host_permissions', 'content_scripts'],
+            ['foo@bar', 'tabs', '<all_urls> https://*.example/* '
+             '*://a.example/*', '*://*/*'],
+            ['3@three', '', '', ''],
+            ['bar@baz', 'storage', 'https://b.example/*', ''],
+        ]
+
+    def test_manifests_fields_help(self):
+        assert Addons.fields_help().endswith(
+            'location; with --manifests also manifest_version, permissions, '
+            'optional_permissions, host_permissions, content_scripts')
+
+    def test_manifests_list(self, manifest_session, stdout):
+        Addons(manifest_session, inspect_manifests=True)()
+        out = stdout()
+        assert 'Permissions: tabs\n' in out
+        assert 'Hosts:       https://b.example/*\n' in out
+        assert 'Manifest: (unreadable)' in out
+        with pytest.raises(FatalError):
+            Addons(manifest_session, fields=['permissions'])()
+
+    def test_manifests_cached(self, manifest_session, stdout):
+        session = Session(manifest_session.profile, cache=True)
+        feature = Addons(session, inspect_manifests=True)
+        paths = feature.source_paths()
+        assert session.profile / 'extensions' / 'bar' in paths
+        feature()
+        out = stdout()
+        xpi = session.profile / 'extensions' / 'bar'
+        with zipfile.ZipFile(str(xpi), 'w') as f:
+            f.writestr('manifest.json', '{"permissions": ["cookies"]}')
+        Addons(session, inspect_manifests=True)()
+        assert stdout() != out
+
+    def test_manifests_outside_profile(self, manifest_session, tmpdir,
+                                       stdout):
+        # Packages at the absolute path are on the host, not in the profile
+        host_package = Path(str(tmpdir)) / 'abc'
+        host_package.mkdir()
+        (host_package / 'manifest.json').write_text('{"permissions": []}')
+        extensions_json = manifest_session.profile / 'extensions.json'
+        data = json.loads(extensions_json.read_text())
+        data['addons'][2]['path'] = str(host_package)
+        extensions_json.write_text(json.dumps(data))
+        feature = Addons(manifest_session, inspect_manifests=True,
+                         format='csv', fields=['id', 'permissions'])
+        assert host_package / 'manifest.json' not in feature.source_paths()
+        feature()
+        assert ['3@three', ''] in parse_csv(stdout())
+
+    @pytest.mark.parametrize('manifest', [
+        {'permissions': 'tabs'},
+        {'permissions': [1]},
+        {'host_permissions': [None]},
+        {'content_scripts': ['*://*/*']},
+        {'content_scripts': [{'matches': '*://*/*'}]},
+        ['tabs'],
+    ])
+    def test_manifests_malformed(self, manifest_session, manifest, stdout):
+        package = manifest_session.profile / 'extensions' / 'abc'
+        package.mkdir()
+        (package / 'manifest.json').write_text(json.dumps(manifest))
+        Addons(manifest_session, inspect_manifests=True, format='jsonl',
+               fields=['id', 'permissions'])()
+        addons = [json.loads(l) for l in stdout().splitlines()]
+        assert {'id': '3@three', 'permissions': None} in addons
+
     def test_addons_json(self, mock_session, stdout):
         Addons(mock_session, show_addons_json=True)()
         assert 'fooextension (foo@bar)' in stdout()
@@ -425,6 +982,52 @@ class TestLoginsFeature:
         with pytest.raises(FatalError, match='SEC_ERROR_BAD_PASSWORD'):
             Logins(mock_session, password='wrong', format='csv')()
 
+    @pytest.fixture
+    def hash_file(self, tmpdir):
+        # SHA-1 hashes of "foo", "bar" and "baz", sorted
+        path = tmpdir / 'hashes.txt'
+        path.write('0BEEC7B5EA3F0FDBC95D0DD47F3C5BC275DA8A33:7\r\n'
+                   '62CDB7020FF920E5AA642C3D4066950DD1F01F4D:42\r\n'
+                   'BBE960A25EA311D21D40669E93DF2003BA9B90A2:1\r\n')
+        return str(path)
+
+    def test_breached(self, mock_session, stdout, hash_file):
+        Logins(mock_session, password='master', hash_file=hash_file,
+               format='csv')()
+        data = parse_csv(stdout())
+        assert data == [['host', 'username', 'breach_count'],
+                        ['http://one.example', 'foo', '42']]
+        for format in ['table', 'list']:
+            Logins(mock_session, password='master', hash_file=hash_file,
+                   format=format)()
+            out = stdout()
+            assert 'foo' in out and '42' in out and 'bar' not in out
+            assert out.endswith('1 of 1 logins use breached passwords.\n')
+
+    def test_not_breached(self, mock_session, stdout, tmpdir):
+        path = tmpdir / 'hashes.txt'
+        path.write('0BEEC7B5EA3F0FDBC95D0DD47F3C5BC275DA8A33\n')
+        Logins(mock_session, password='master', hash_file=str(path),
+               format='list')()
+        assert stdout() == '0 of 1 logins use breached passwords.\n'
+
+    def test_no_hash_file(self, mock_session):
+        with pytest.raises(FatalError, match='Can\'t open hash file'):
+            Logins(mock_session, password='master',
+                   hash_file='nonexistent')()
+
+    def test_hash_file(self, hash_file):
+        with HashFile(hash_file) as hashes:
+            assert hashes.count(
+                '0beec7b5ea3f0fdbc95d0dd47f3c5bc275da8a33') == 7
+            assert hashes.count(
+                '62CDB7020FF920E5AA642C3D4066950DD1F01F4D') == 42
+            assert hashes.count(
+                'BBE960A25EA311D21D40669E93DF2003BA9B90A2') == 1
+            for digest in ['0' * 40, '7' * 40, 'F' * 40]:
+                assert hashes.count(digest) == 0
+        assert hashes.map.closed
+
 
 class TestPreferencesFeature:
 
@@ -510,6 +1113,215 @@ class TestPreferencesFeature:
         Preferences(session)()
         assert 'No preferences found.' in stdout()
 
+    def test_parser(self):
+        lines = dedent(r'''
+        # Comment with user_pref("commented.out", 1);
+        pref("a", 1.5);
+        sticky_pref("b", -3, sticky);
+        lockPref('c', 'single \'quoted\'');
+        user_pref("d", "esc\"aped\\path\n\x41é😀\ud83d\ude00");
+        user_pref("e", true); // trailing comment
+        /* block comment
+        user_pref("commented.out", 2);
+        */ user_pref("f",
+                     false);
+        user_pref("malformed", nonsense);
+        user_pref("g", 1e3); user_pref("h", "x", locked, sticky)
+        ''').splitlines()
+        prefs = list(PrefsParser().parse(lines))
+        assert prefs == [
+            Preference('a', 1.5),
+            Preference('b', -3),
+            Preference('c', "single 'quoted'"),
+            Preference('d', 'esc"aped\\path\nA\xe9' + '\U0001f600' * 2),
+            Preference('e', True),
+            Preference('f', False),
+            Preference('g', 1000.0),
+            Preference('h', 'x'),
+        ]
+        assert Preference.repr_to_type(Preference.type_to_repr(
+            prefs[3].value)) == prefs[3].value
+
+    def test_parser_descriptions(self):
+        lines = dedent('''
+        // PREF: Foo
+        user_pref("foo", 1);
+        /* bar */ user_pref("bar", 2);
+
+        user_pref("baz", 3);
+        ''').splitlines()
+        prefs = PrefsParser(descriptions=True).parse(lines)
+        assert [p.info for p in prefs] == ['Foo', 'Foo', None]
+        prefs = PrefsParser().parse(lines)
+        assert [p.info for p in prefs] == [None, None, None]
+
+
+class TestUserjsCache:
+
+    USERJS = dedent('''
+    // PREF: Disable foo
+    user_pref("foo.bar", true);
+    ''')
+
+    @pytest.fixture
+    def requests_get(self, monkeypatch):
+        responses = []
+        get = mock.Mock(side_effect=lambda *args, **kwargs: responses.pop(0))
+        get.responses = responses
+        monkeypatch.setattr('requests.get', get)
+        shutil.rmtree(str(cache_dir('userjs')))
+        return get
+
+    @staticmethod
+    def response(status_code=200, text='', headers=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = bytes(text, 'utf-8')
+        response.encoding = 'utf-8'
+        response.headers.update(headers or {})
+        return response
+
+    def test_fetch(self, requests_get, monkeypatch):
+        requests_get.responses.append(self.response(
+            text=self.USERJS, headers={'ETag': '"abc"'}))
+        expected = [Preference('foo.bar', True, info='Disable foo')]
+        assert fetch_userjs('master') == expected
+        assert requests_get.call_args[1]['timeout'] == USERJS_TIMEOUT
+        # Cached within the TTL
+        assert fetch_userjs('master') == expected
+        assert requests_get.call_count == 1
+        # Revalidated after it
+        monkeypatch.setattr('firefed.feature.preferences.USERJS_TTL', 0)
+        requests_get.responses.append(self.response(304))
+        assert fetch_userjs('master') == expected
+        assert requests_get.call_args[1]['headers'] == {
+            'If-None-Match': '"abc"'}
+        requests_get.responses.append(self.response(
+            text='user_pref("foo.bar", false);\n'))
+        assert fetch_userjs('master') == [Preference('foo.bar', False)]
+
+    def test_offline(self, requests_get, mock_session, stdout):
+        with pytest.raises(FatalError, match='hasn\'t been cached yet'):
+            fetch_userjs('relaxed', offline=True)
+        requests_get.responses.append(self.response(text=self.USERJS))
+        fetch_userjs('relaxed')
+        Preferences(mock_session, want_check_recommended=True,
+                    offline=True)()
+        assert 'Should: true' in nomarkup(stdout())
+        assert requests_get.call_count == 1
+
+    def test_unreachable(self, requests_get, monkeypatch, stderr):
+        requests_get.responses.append(self.response(text=self.USERJS))
+        fetch_userjs('master')
+        monkeypatch.setattr('firefed.feature.preferences.USERJS_TTL', 0)
+        requests_get.responses.append(self.response(500))
+        assert fetch_userjs('master')[0].key == 'foo.bar'
+        assert 'using the cached copy' in stderr()
+        with pytest.raises(FatalError, match='Can\'t fetch'):
+            requests_get.responses.append(self.response(500))
+            fetch_userjs('relaxed')
+
+    def test_reparse(self, requests_get, monkeypatch):
+        requests_get.responses.append(self.response(text=self.USERJS))
+        fetch_userjs('master')
+        meta_path = cache_dir('userjs') / 'master.json'
+        meta = json.loads(meta_path.read_text())
+        meta['prefs'] = []
+        meta_path.write_text(json.dumps(meta))
+        # A new release with the same parser uses the parsed preferences
+        monkeypatch.setattr('firefed.__version__.__version__', 'new')
+        assert fetch_userjs('master') == []
+        monkeypatch.setattr('firefed.feature.preferences.PARSER_VERSION',
+                            'new')
+        assert len(fetch_userjs('master')) == 1
+        assert json.loads(meta_path.read_text())['parser_version'] == 'new'
+
+
+class TestComplianceFeature:
+
+    @pytest.fixture
+    def profiles(self, mock_profile, tmpdir):
+        compliant = tmpdir / 'compliant'
+        shutil.copytree(str(mock_profile), str(compliant))
+        (compliant / 'user.js').write('user_pref("baz", 123);\n',
+                                      mode='a')
+        return [str(mock_profile), str(compliant)]
+
+    @pytest.fixture
+    def recommended(self, tmpdir):
+        path = tmpdir / 'recommended.js'
+        path.write(dedent('''
+        user_pref("baz", 0);
+        user_pref("baz", 123);
+        user_pref("goodkey", "goodval");
+        user_pref("pref2", true);
+        '''))
+        return str(path)
+
+    def test_csv(self, profiles, recommended, stdout):
+        Compliance(Session(None), profiles, recommended_source=recommended,
+                   jobs=2)()
+        assert parse_csv(stdout()) == [
+            ['profile', 'good', 'bad', 'undefined', 'baz', 'goodkey',
+             'pref2', 'error'],
+            [profiles[0], '1', '1', '1', 'bad', 'good', 'undefined', ''],
+            [profiles[1], '2', '0', '1', 'good', 'good', 'undefined', ''],
+        ]
+
+    def test_jsonl(self, profiles, recommended, stdout):
+        Compliance(Session(None), profiles, recommended_source=recommended,
+                   include_undefined=True, format='jsonl')()
+        results = [json.loads(l) for l in stdout().splitlines()]
+        assert results[1] == {
+            'profile': profiles[1],
+            'good': 2,
+            'bad': 1,
+            'undefined': 0,
+            'preferences': {'baz': 'good', 'goodkey': 'good',
+                            'pref2': 'bad'},
+        }
+
+    def test_summary(self, profiles, recommended, stdout):
+        Compliance(Session(None), profiles * 3,
+                   recommended_source=recommended, summary=True)()
+        assert stdout() == ('3 of 6 profiles compliant (9 good, 3 bad, 6 '
+                            'undefined values).\n')
+
+    def test_failed_profile(self, profiles, recommended, tmpdir, stdout):
+        broken = tmpdir.mkdir('broken')
+        (broken / 'prefs.js').write_binary(b'user_pref("baz", "\xff");\n')
+        profiles.insert(1, str(broken))
+        Compliance(Session(None), profiles, recommended_source=recommended)()
+        rows = parse_csv(stdout())
+        assert rows[2][:4] == [str(broken), '', '', '']
+        assert rows[2][-1].startswith('UnicodeDecodeError: ')
+        assert rows[3][:4] == [profiles[2], '2', '0', '1']
+        Compliance(Session(None), profiles, recommended_source=recommended,
+                   format='jsonl')()
+        result = json.loads(stdout().splitlines()[1])
+        assert result['profile'] == str(broken)
+        assert 'error' in result
+        Compliance(Session(None), profiles, recommended_source=recommended,
+                   summary=True)()
+        assert stdout() == ('1 of 3 profiles compliant (3 good, 1 bad, 2 '
+                            'undefined values). 1 failed.\n')
+
+    def test_invalid_args(self, mock_profile, recommended, tmpdir, stdout):
+        with pytest.raises(FatalError, match='No profiles given'):
+            Compliance(Session(None))()
+        # Unknown profiles and bad archives don't stop the others
+        archive = tmpdir / 'broken.zip'
+        archive.write('no zip')
+        Compliance(Session(None), ['nonexistent', str(archive),
+                                   str(mock_profile)],
+                   recommended_source=recommended)()
+        rows = parse_csv(stdout())
+        assert rows[1][0] == 'nonexistent'
+        assert rows[1][-1]
+        assert rows[2][0] == str(archive)
+        assert rows[2][-1]
+        assert rows[3][:4] == [str(mock_profile), '1', '1', '1']
+
 
 class TestInfectFeature:
 
@@ -637,6 +1449,519 @@ class TestInfectFeature:
         p.terminate()
 
 
+class TestSearchFeature:
+
+    def test_list(self, mock_session, stdout):
+        Search(mock_session, term='two.example')()
+        lines = stdout().split('\n')
+        assert lines[:2] == ['[history] http://two.example/', '    two']
+        Search(mock_session, term='ddd')()
+        assert stdout() == '[forms] ccc=ddd\n'
+
+    def test_raw(self, mock_session, stdout):
+        Search(mock_session, term='one OR thr*', raw=True)()
+        urls = stdout().split('\n')
+        assert '[history] http://one.example/' in urls
+        assert '[history] http://three.example/' in urls
+        with pytest.raises(FatalError, match='Invalid search term'):
+            Search(mock_session, term='(', raw=True)()
+
+    def test_no_term(self, mock_session):
+        with pytest.raises(FatalError, match='No search term'):
+            Search(mock_session)()
+
+    def test_incremental_update(self, mock_session, tmpdir, stdout):
+        profile = tmpdir.mkdir('profile')
+        con = sqlite3.connect(str(profile / 'places.sqlite'))
+        con.executescript('''
+        CREATE TABLE moz_places (id, url, title);
+        INSERT INTO moz_places VALUES(1, 'http://a.example/', 'a');
+        ''')
+        con.commit()
+        session = Session(profile)
+        Search(session, term='example')()
+        assert stdout() == '[history] http://a.example/\n    a\n'
+        con.execute('INSERT INTO moz_places VALUES(2, \'http://b.example/\','
+                    '\'b\')')
+        con.commit()
+        feature = Search(session, term='example')
+        feature()
+        assert 'http://b.example/' in stdout()
+        index = sqlite3.connect(str(feature.index_path()))
+        # The first row wasn't indexed again
+        assert index.execute('SELECT rowid, id FROM rows').fetchall() == [
+            (1, 1), (2, 2)]
+        assert index.execute('SELECT COUNT(*) FROM entries').fetchone() == \
+            (2,)
+        index.close()
+
+    def test_deleted_rows(self, mock_session, tmpdir, stdout):
+        profile = tmpdir.mkdir('profile')
+        con = sqlite3.connect(str(profile / 'places.sqlite'))
+        con.executescript('''
+        CREATE TABLE moz_places (id, url, title);
+        INSERT INTO moz_places VALUES(1, 'http://a.example/', 'a');
+        ''')
+        con.commit()
+        session = Session(profile)
+        Search(session, term='example')()
+        assert 'http://a.example/' in stdout()
+        # The file grows at the same time
+        con.execute('DELETE FROM moz_places WHERE id = 1')
+        con.execute('INSERT INTO moz_places VALUES(2, ?, ?)',
+                    ('http://b.example/', 'b' * 10000))
+        con.commit()
+        con.close()
+        Search(session, term='example')()
+        assert stdout().startswith('[history] http://b.example/\n')
+
+    def test_update_in_place(self, mock_session, tmpdir, stdout):
+        profile = tmpdir.mkdir('profile')
+        con = sqlite3.connect(str(profile / 'places.sqlite'))
+        con.executescript('''
+        CREATE TABLE moz_places (id, url, title);
+        INSERT INTO moz_places VALUES(1, 'http://a.example/', 'old');
+        ''')
+        con.commit()
+        session = Session(profile)
+        Search(session, term='example')()
+        assert 'old' in stdout()
+        con.execute('UPDATE moz_places SET title = \'new\' WHERE id = 1')
+        con.commit()
+        con.close()
+        # Make sure the modification time differs
+        path = str(profile / 'places.sqlite')
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        Search(session, term='example')()
+        assert stdout() == '[history] http://a.example/\n    new\n'
+
+
+class TestQueryFeature:
+
+    def test_join(self, mock_session, stdout):
+        Query(mock_session, format='csv', sql='''
+              SELECT p.url, c.name FROM places.moz_places p
+              JOIN cookies.moz_cookies c ON p.url LIKE '%//' || c.host || '/'
+              ORDER BY p.url''')()
+        assert parse_csv(stdout()) == [['url', 'name'],
+                                       ['http://one.example/', 'k1'],
+                                       ['http://two.example/', 'k2']]
+
+    def test_table(self, mock_session, stdout):
+        Query(mock_session, sql='SELECT fieldname, value FROM '
+              'forms.moz_formhistory WHERE 0')()
+        assert stdout().split()[:2] == ['fieldname', 'value']
+
+    def test_jsonl(self, mock_session, stdout):
+        Query(mock_session, format='jsonl',
+              sql='SELECT origin, type FROM permissions.moz_perms '
+                  'ORDER BY id LIMIT 1')()
+        assert json.loads(stdout()) == {'origin': 'http://one.example/',
+                                        'type': 'permission1'}
+
+    def test_read_only(self, mock_session):
+        with pytest.raises(FatalError, match='readonly'):
+            Query(mock_session, sql='DELETE FROM places.moz_places')()
+        with pytest.raises(FatalError, match='readonly'):
+            Query(mock_session, sql='CREATE TEMP TABLE t (x)')()
+
+    def test_invalid(self, mock_session):
+        with pytest.raises(FatalError, match='No query'):
+            Query(mock_session)()
+        with pytest.raises(FatalError, match='no such table'):
+            Query(mock_session, sql='SELECT * FROM favicons.moz_icons')()
+
+
+class TestExportDbFeature:
+
+    def test_export(self, mock_session, tmpdir, stdout):
+        db = str(tmpdir / 'case.sqlite')
+        empty_profile = tmpdir.mkdir('empty')
+        ExportDb(mock_session, database=db,
+                 more_profiles=[str(mock_session.profile),
+                                str(empty_profile)])()
+        lines = stdout().splitlines()
+        assert len(lines) == 3
+        assert lines[2].startswith('Exported 0 records')
+        con = sqlite3.connect(db)
+        assert con.execute('SELECT id, path FROM profiles').fetchall() == [
+            (1, str(mock_session.profile)), (2, str(mock_session.profile)),
+            (3, str(empty_profile))]
+        assert con.execute('SELECT profile_id, url, visit_count FROM '
+                           'history WHERE url = ?',
+                           ('http://two.example/',)).fetchall() == [
+            (1, 'http://two.example/', 200), (2, 'http://two.example/', 200)]
+        # Session file cookies are included
+        assert con.execute('SELECT COUNT(*) FROM cookies WHERE '
+                           'profile_id = 1').fetchone() == (4,)
+        # Features without a declared record class are included as well
+        assert ('bookmark in level2', 'rootfolder/level2') in con.execute(
+            'SELECT title, path FROM bookmarks WHERE profile_id = 1')
+        assert con.execute('SELECT COUNT(*) FROM preferences WHERE '
+                           'profile_id = 1').fetchone()[0] > 0
+        indexes = {r[0] for r in con.execute(
+            'SELECT name FROM sqlite_master WHERE type = "index"')}
+        assert {'history_profile_id', 'visits_profile_id',
+                'bookmarks_profile_id'} <= indexes
+
+    def test_append(self, mock_session, tmpdir, stdout):
+        db = str(tmpdir / 'case.sqlite')
+        ExportDb(mock_session, database=db)()
+        ExportDb(mock_session, database=db)()
+        con = sqlite3.connect(db)
+        assert con.execute('SELECT DISTINCT profile_id FROM '
+                           'permissions').fetchall() == [(1,), (2,)]
+
+    def test_no_database(self, mock_session):
+        with pytest.raises(FatalError, match='No case database'):
+            ExportDb(mock_session)()
+
+    def test_failing_feature(self, mock_session, tmpdir, stdouterr):
+        db = str(tmpdir / 'case.sqlite')
+
+        def fail(self):
+            raise RuntimeError('broken')
+        with mock.patch.object(History, 'records', fail):
+            ExportDb(mock_session, database=db)()
+        out, err = stdouterr()
+        assert 'Can\'t export history' in err
+        assert out.startswith('Exported ')
+        con = sqlite3.connect(db)
+        tables = {r[0] for r in con.execute(
+            'SELECT name FROM sqlite_master WHERE type = "table"')}
+        assert 'history' not in tables
+        assert 'visits' in tables
+
+    def test_failing_profile(self, mock_session, tmpdir, stderr):
+        db = str(tmpdir / 'case.sqlite')
+
+        def fail(self, *args):
+            raise RuntimeError('broken')
+        with mock.patch.object(ExportDb, 'record_features', fail):
+            ExportDb(mock_session, database=db)()
+        assert 'Can\'t export "%s": broken' % mock_session.profile in \
+            stderr()
+        con = sqlite3.connect(db)
+        assert con.execute('SELECT COUNT(*) FROM profiles').fetchone() == \
+            (0,)
+
+
+class TestCollectFeature:
+
+    def test_collect(self, mock_session, tmpdir, stdout):
+        Collect(mock_session, output_dir=str(tmpdir))()
+        assert stdout().startswith('Collected ')
+        manifest = json.loads((tmpdir / 'manifest.json').read())
+        assert manifest['profile'] == str(mock_session.profile)
+        features = manifest['features']
+        assert 'infect' not in features and 'collect' not in features
+        assert features['history']['file'] == 'history.jsonl'
+        assert features['history']['rows'] == 3
+        assert features['hosts']['rows'] == 2
+        assert features['permissions']['format'] == 'jsonl'
+        assert (tmpdir / 'hosts.txt').read().split() == [
+            'one.example', 'two.example']
+        assert features['hosts']['sha256'] == hashlib.sha256(
+            (tmpdir / 'hosts.txt').read_binary()).hexdigest()
+        assert features['hashes']['rows'] > 0
+        lines = (tmpdir / 'visits.jsonl').read().splitlines()
+        assert json.loads(lines[0])['url'] == 'http://one.example/'
+
+    def test_compress(self, mock_session, tmpdir, stdout):
+        Collect(mock_session, output_dir=str(tmpdir), compression='gz')()
+        with gzip.open(str(tmpdir / 'forms.jsonl.gz'), 'rt') as f:
+            assert json.loads(f.readline()) == {'fieldname': 'aaa',
+                                                'value': 'bbb'}
+
+    def test_failed_feature(self, tmpdir, stdout):
+        profile = tmpdir.mkdir('profile')
+        Collect(Session(profile), output_dir=str(tmpdir / 'out'))()
+        assert '(' in stdout()
+        manifest = json.loads((tmpdir / 'out/manifest.json').read())
+        assert manifest['features']['history']['file'] is None
+        assert 'places.sqlite' in manifest['features']['history']['error']
+        assert not (tmpdir / 'out/history.jsonl').exists()
+
+    def test_unexpected_error(self, mock_session, tmpdir, stdouterr):
+
+        def fail(self):
+            raise RuntimeError('broken')
+        with mock.patch.object(History, 'run', fail):
+            Collect(mock_session, output_dir=str(tmpdir))()
+        out, err = stdouterr()
+        assert '(1 failed)' in out
+        assert 'Collecting history failed' in err
+        manifest = json.loads((tmpdir / 'manifest.json').read())
+        assert manifest['features']['history']['error'] == \
+            'RuntimeError: broken'
+        assert manifest['features']['visits']['rows'] == 3
+        assert not (tmpdir / 'history.jsonl').exists()
+
+    def test_hashes_first(self, mock_session, tmpdir, stdout):
+        calls = []
+        hashes_run = Hashes.run
+        history_run = History.run
+
+        def run_hashes(self):
+            hashes_run(self)
+            calls.append('hashes')
+
+        def run_history(self):
+            calls.append('history')
+            history_run(self)
+        with mock.patch.object(Hashes, 'run', run_hashes), \
+                mock.patch.object(History, 'run', run_history):
+            Collect(mock_session, output_dir=str(tmpdir), workers=4)()
+        assert calls == ['hashes', 'history']
+
+    def test_output_not_created(self, mock_session, tmpdir, stdout):
+        # The output file can't be opened, so there's nothing to remove
+        tmpdir.mkdir('history.jsonl')
+        Collect(mock_session, output_dir=str(tmpdir))()
+        manifest = json.loads((tmpdir / 'manifest.json').read())
+        assert 'Is a directory' in manifest['features']['history']['error']
+
+    def test_no_output_dir(self, mock_session):
+        with pytest.raises(FatalError, match='No output directory'):
+            Collect(mock_session)()
+
+
+class TestHashesFeature:
+
+    def test_list(self, mock_session, stdout):
+        Hashes(mock_session)()
+        hashes = dict(reversed(l.split('  ')) for l in
+                      stdout().splitlines())
+        profile = Path(str(mock_session.profile))
+        for name in ['places.sqlite', 'logins.json', 'extensions.json',
+                     'times.json', 'sessionstore.jsonlz4', 'prefs.js']:
+            assert hashes[name] == hashlib.sha256(
+                (profile / name).read_bytes()).hexdigest()
+        assert list(hashes) == sorted(hashes)
+
+    def test_formats(self, mock_session, stdout):
+        Hashes(mock_session, format='csv', workers=1)()
+        data = parse_csv(stdout())
+        assert data[0] == ['path', 'size', 'sha256']
+        size = (Path(str(mock_session.profile)) /
+                'places.sqlite').stat().st_size
+        assert ['places.sqlite', str(size)] in [row[:2] for row in data]
+        Hashes(mock_session, format='jsonl', group_by='path', count=True)()
+        assert json.loads(stdout().splitlines()[0])['count'] == 1
+
+
+class TestDiffFeature:
+
+    @pytest.fixture
+    def profiles(self, mock_profile, tmpdir):
+        a = tmpdir / 'a'
+        b = tmpdir / 'b'
+        shutil.copytree(str(mock_profile), str(a))
+        shutil.copytree(str(mock_profile), str(b))
+        con = sqlite3.connect(str(b / 'places.sqlite'))
+        with con:
+            con.execute('DELETE FROM moz_places WHERE id = 1')
+            con.execute('UPDATE moz_places SET title = ?, visit_count = ? '
+                        'WHERE id = 2', ('zwei', 201))
+            con.execute('INSERT INTO moz_places VALUES (4, ?, ?, 1, 4000000, '
+                        '0)', ('http://four.example/', 'four'))
+        con.close()
+        con = sqlite3.connect(str(b / 'cookies.sqlite'))
+        with con:
+            con.execute('UPDATE moz_cookies SET value = ? WHERE name = ?',
+                        ('changed', 'k2'))
+        con.close()
+        return str(a), str(b)
+
+    def test_list(self, mock_session, profiles, stdout):
+        Diff(mock_session, *profiles, feature_name='history')()
+        assert stdout().splitlines() == [
+            good('+ http://four.example/'),
+            bad('- http://one.example/'),
+            okay('~ http://two.example/'),
+            "    title: 'two' -> 'zwei'",
+            '    visit_count: 200 -> 201',
+            '1 added, 1 removed, 1 changed.',
+        ]
+
+    def test_jsonl(self, mock_session, profiles, stdout):
+        Diff(mock_session, *profiles, feature_name='cookies',
+             format='jsonl')()
+        assert [json.loads(l) for l in stdout().splitlines()] == [{
+            'change': 'changed',
+            'key': {'host': 'two.example', 'name': 'k2', 'path': '/p2'},
+            'fields': {'value': ['v2', 'changed']},
+        }]
+        Diff(mock_session, *profiles[::-1], feature_name='history',
+             format='jsonl')()
+        changes = [json.loads(l) for l in stdout().splitlines()]
+        assert changes[0]['change'] == 'removed'
+        assert changes[0]['record']['title'] == 'four'
+
+    def test_bookmarks(self, mock_session, profiles, stdout):
+        # The URL of a bookmark was removed from history
+        Diff(mock_session, *profiles, feature_name='bookmarks')()
+        assert stdout().splitlines()[:2] == [
+            okay('~ guid3'), "    url: 'http://one.example/' -> None"]
+
+    def test_unchanged(self, mock_session, profiles, stdout):
+        for name in ['bookmarks', 'preferences', 'permissions', 'forms',
+                     'downloads', 'addons']:
+            Diff(mock_session, profiles[0], profiles[0], feature_name=name)()
+            assert stdout() == '0 added, 0 removed, 0 changed.\n'
+
+    def test_ordered_by_database(self, mock_session, profiles):
+        diff = Diff(mock_session, *profiles, feature_name='permissions')
+        diff.prepare()
+        records = diff.ordered_records(diff.profiles[0])
+        assert [(r.host, r.permission) for r in records] == sorted(
+            (r.host, r.permission) for r in
+            Permissions(Session(diff.profiles[0])).load_sqlite(
+                db='permissions.sqlite', table='moz_perms', cls=Permission,
+                column_map={'origin': 'host', 'type': 'permission'}))
+
+    def test_invalid(self, mock_session, profiles):
+        with pytest.raises(FatalError, match='Two profiles'):
+            Diff(mock_session, profiles[0])()
+        with pytest.raises(FatalError):
+            Diff(mock_session, profiles[0], 'nonexistent',
+                 feature_name='history')()
+
+
+class TestIocFeature:
+
+    @pytest.fixture
+    def indicators(self, tmpdir):
+        path = tmpdir / 'iocs.txt'
+        path.write(dedent('''
+            # Comment
+            http://one.example/
+            hxxps://three[.]example/
+            .two.example
+            substring:foo/
+            unmatched.example
+        '''))
+        return str(path)
+
+    def test_jsonl(self, mock_session, indicators, stdout):
+        Ioc(mock_session, format='jsonl', indicator_file=indicators)()
+        hits = [json.loads(l) for l in stdout().splitlines()]
+        assert {(h['source'], h['value'], h['type'], h['indicator'])
+                for h in hits} == {
+            ('history', 'http://one.example/', 'url', 'http://one.example/'),
+            ('history', 'http://two.example/', 'domain', 'two.example'),
+            ('visits', 'http://one.example/', 'url', 'http://one.example/'),
+            ('visits', 'http://two.example/', 'domain', 'two.example'),
+            ('cookies', 'two.example', 'domain', 'two.example'),
+            ('permissions', 'http://one.example/', 'url',
+             'http://one.example/'),
+            ('permissions', 'https://two.example/', 'domain',
+             'two.example'),
+            ('permissions', 'https://three.example/', 'url',
+             'https://three.example/'),
+            # The source of a download, not its destination file
+            ('downloads', 'http://two.example/', 'domain', 'two.example'),
+        }
+        assert hits[0]['date'] == 1
+
+    def test_list(self, mock_session, indicators, stdout):
+        Ioc(mock_session, indicator_file=indicators, since=2)()
+        lines = stdout().splitlines()
+        assert '[history] http://two.example/ (domain: two.example)' in \
+            lines[0]
+        assert lines[-1] == '5 hits found.'
+
+    def test_group_by(self, mock_session, indicators, stdout):
+        Ioc(mock_session, format='csv', indicator_file=indicators,
+            group_by='indicator')()
+        assert parse_csv(stdout())[1] == ['two.example', '5']
+
+    def test_csv_fields(self, mock_session, tmpdir, stdout):
+        path = tmpdir / 'iocs.txt'
+        path.write('unmatched.example\n')
+        Ioc(mock_session, format='csv', indicator_file=str(path),
+            fields=['value', 'indicator'])()
+        assert parse_csv(stdout()) == [['value', 'indicator']]
+
+    def test_missing_list(self, mock_session, tmpdir):
+        with pytest.raises(FatalError, match='No indicator list'):
+            Ioc(mock_session)()
+        with pytest.raises(FatalError, match='not found'):
+            Ioc(mock_session, indicator_file=str(tmpdir / 'nonexistent'))()
+
+    def test_indicators(self):
+        indicators = Indicators.from_lines([
+            'url:http://a.example/x', 'domain:EVIL.example', '*.b.example',
+            'evil', 'http://c.example/y'])
+        assert indicators.urls == {'http://a.example/x',
+                                   'http://c.example/y'}
+        assert indicators.domains.domains == {'evil.example', 'b.example'}
+        assert len(indicators) == 5
+        assert list(indicators.match('http://www.evil.example/evil',
+                                     True)) == [('domain', 'evil.example'),
+                                                ('substring', 'evil')]
+        assert list(indicators.match('.x.b.example', False)) == [
+            ('domain', 'b.example')]
+        assert list(indicators.match('http://notevil.example/', True)) == [
+            ('substring', 'evil')]
+
+    def test_normalized_urls(self):
+        indicators = Indicators.from_lines([
+            'HTTP://Evil.example', 'url:hXXps://b[.]example/Path',
+            'foo-hxxp-bar'])
+        assert indicators.urls == {'http://evil.example/',
+                                   'https://b.example/Path'}
+        assert list(indicators.match('http://evil.example/', True)) == [
+            ('url', 'http://evil.example/')]
+        assert list(indicators.match('https://B.example/Path', True)) == [
+            ('url', 'https://b.example/Path')]
+        assert list(indicators.match('https://b.example/path', True)) == []
+        # Only defanged schemes are refanged
+        assert list(indicators.match('http://x.example/foo-hxxp-bar',
+                                     True)) == [('substring', 'foo-hxxp-bar')]
+
+    def test_aho_corasick(self):
+        automaton = AhoCorasick()
+        for word in ['he', 'she', 'his', 'hers']:
+            automaton.add(word)
+        assert list(automaton.search('ushers')) == ['she', 'he', 'hers']
+        automaton.add('us')
+        assert list(automaton.search('ushers')) == ['us', 'she', 'he',
+                                                    'hers']
+        assert list(automaton.search('')) == []
+
+
+class TestTimelineFeature:
+
+    def test_csv(self, mock_session, stdout):
+        Timeline(mock_session, format='csv')()
+        data = parse_csv(stdout())
+        assert data[0] == ['date', 'source', 'description']
+        dates = [int(row[0]) for row in data[1:]]
+        assert dates == sorted(dates)
+        sources = {row[1] for row in data[1:]}
+        assert sources == {'visit', 'download', 'bookmark', 'form-first-use',
+                           'form-last-use', 'cookie-expiry', 'permission',
+                           'profile-created'}
+        assert ['1', 'profile-created', 'times.json'] in data
+        assert ['3', 'visit', 'http://three.example/'] in data
+        assert ['1462493666', 'permission', 'https://three.example/ '
+                'permission3'] in data
+
+    def test_sources(self, mock_session, stdout):
+        Timeline(mock_session, sources=['download'])()
+        lines = stdout().strip().split('\n')
+        assert lines == [
+            '%s [download] file:///foo/bar' % datetime.fromtimestamp(1),
+            '%s [download] file:///baz' % datetime.fromtimestamp(3),
+        ]
+
+    def test_missing_sources(self, tmpdir, stdout):
+        Timeline(Session(tmpdir))()
+        assert stdout() == ''
+
+
 class TestSummaryFeature:
 
     def test_creation_date(self, mock_session):
@@ -0,0 +1,41 @@
+import hashlib
+from pathlib import Path
+
+from firefed import hashing
+from firefed.util import profile_dir
+
+from tests.test_archive import ROOT, make_archive, profile_files
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_hash_file(tmpdir, monkeypatch):
+    path = Path(str(tmpdir)) / 'file'
+    data = bytes(range(256)) * 10000
+    path.write_bytes(data)
+    assert hashing.hash_file(path) == sha256(data)
+    assert hashing.sized_hash(path) == (len(data), sha256(data))
+    path.write_bytes(b'')
+    assert hashing.sized_hash(path) == (0, sha256(b''))
+
+
+def test_hash_archive_member(mock_profile, tmpdir, monkeypatch):
+    monkeypatch.setattr(hashing, 'CHUNK_SIZE', 100)
+    archive = make_archive(Path(str(tmpdir)) / 'profile.zip',
+                           profile_files(mock_profile, ROOT))
+    path = profile_dir(str(archive)) / 'places.sqlite'
+    expected = sha256((Path(str(mock_profile)) / 'places.sqlite').read_bytes())
+    assert hashing.hash_file(path) == expected
+    assert hashing.sized_hash(path)[0] == path.stat().st_size
+
+
+def test_hash_files(tmpdir):
+    paths = []
+    for i in range(10):
+        path = Path(str(tmpdir)) / str(i)
+        path.write_bytes(b'%d' % i * 100000)
+        paths.append(path)
+    assert list(hashing.hash_files(paths, workers=3)) == [
+        (p, 100000, sha256(p.read_bytes())) for p in paths]
@@ -1,3 +1,13 @@
+import bz2
+import gzip
+import io
+import lzma
+from pathlib import Path
+import threading
+
+import lz4.frame
+import pytest
+
 from firefed import Session, output
 
 
@@ -26,3 +36,44 @@ class TestOutput:
         session = Session(profile=mock_profile, verbosity=1)
         session.logger.info('foo')
         assert 'foo' in caplog.text
+
+    def test_redirect(self, stdout):
+        stream = io.StringIO()
+        with output.redirect(stream):
+            output.out('foo')
+            thread = threading.Thread(target=output.out, args=('bar',))
+            thread.start()
+            thread.join()
+        output.out('baz')
+        assert stream.getvalue() == 'foo\n'
+        assert stdout() == 'bar\nbaz\n'
+
+    @pytest.mark.parametrize('suffix, open_', [
+        ('.gz', gzip.open),
+        ('.bz2', bz2.open),
+        ('.xz', lzma.open),
+        ('.lz4', lz4.frame.open),
+        ('.txt', open),
+    ])
+    def test_open_output(self, tmpdir, suffix, open_):
+        path = Path(str(tmpdir / ('out' + suffix)))
+        lines = ['line %d \u00e4' % i for i in range(100000)]
+        with output.open_output(path) as f, output.redirect(f):
+            for line in lines:
+                output.out(line)
+        with open_(str(path), 'rt', encoding='utf-8') as f:
+            assert f.read().splitlines() == lines
+
+    def test_compression_error(self):
+        class BrokenFile:
+            closed = False
+            def write(self, data):
+                raise OSError('disk full')
+            def close(self):
+                self.closed = True
+        file = BrokenFile()
+        writer = output.CompressingWriter(file)
+        writer.write('foo')
+        with pytest.raises(OSError, match='disk full'):
+            writer.close()
+        assert file.closed
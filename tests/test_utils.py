@@ -1,10 +1,12 @@
+import argparse
 from datetime import datetime
 import os
 
 import pytest
 
 from firefed.util import (ProfileNotFoundError, make_parser, moz_datetime,
-                          moz_to_unix_timestamp, profile_dir, tabulate)
+                          moz_to_unix_timestamp, moz_url_hash, parse_date,
+                          profile_dir, tabulate)
 
 
 class TestUtils:
@@ -36,6 +38,26 @@ class TestUtils:
         dt = moz_datetime(1000000)
         assert dt == datetime.fromtimestamp(1)
 
+    def test_parse_date(self):
+        assert parse_date('1000') == 1000
+        assert parse_date('2018-01-31') == \
+            datetime(2018, 1, 31).timestamp()
+        assert parse_date('2018-01-31 12:30') == \
+            datetime(2018, 1, 31, 12, 30).timestamp()
+        assert parse_date('2018-01-31T12:30:15') == \
+            datetime(2018, 1, 31, 12, 30, 15).timestamp()
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_date('yesterday')
+
+    def test_url_hash(self):
+        # The upper 16 bits only depend on the scheme
+        assert moz_url_hash('http://one.example/') >> 32 == \
+            moz_url_hash('http://two.example/') >> 32
+        assert moz_url_hash('https://one.example/') >> 32 != \
+            moz_url_hash('http://one.example/') >> 32
+        assert moz_url_hash('noscheme') < 2 ** 32
+        assert moz_url_hash('https://www.mozilla.org/') == 47358155560141
+
     def test_tabulate(self, stdout):
         rows = [
             ('r1c1', 'r1c2_'),